@@ -0,0 +1,373 @@
+# Load test of the chat API. The app runs in-process behind httpx's ASGI transport
+# with the stub LLM provider, so the numbers measure our own code (routing, DB,
+# caches, prompt building), not the network or Groq.
+#
+#   python -m benchmarks.chat_load --users 32 --turns 10 --latency 0.05
+#   python -m benchmarks.chat_load --save-baseline    # record the current results
+#   python -m benchmarks.chat_load --check            # exit 1 if slower than the baseline
+#
+# Every virtual user keeps one conversation and per turn sends a chat message,
+# reads the conversation's message history and lists its conversations. Compare
+# settings with --env KEY=VALUE (e.g. --env WRITE_BEHIND=true) and --name so
+# each configuration keeps its own baseline. Baselines are machine-specific:
+# record them on the machine that runs --check. Each baseline stores the
+# machine, app settings and revision it was recorded with, and --check prints
+# what differs so a failure can be told apart from a real regression.
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "chat_load.json")
+
+# Environment settings recorded with the results (secrets, URLs and paths left out)
+SETTING_PREFIXES = ("DB_", "SQLITE_", "LLM_", "STUB_LLM_", "WRITE_BEHIND", "SHARED_CACHE_", "RESPONSE_CACHE_",
+                    "MEMORY_", "SUMMARY_", "EMBEDDING_", "CONTEXT_", "CATALOG_", "SEMANTIC_")
+
+QUESTIONS = [
+    "What laptops do you have?",
+    "How much is the {product}?",
+    "Is the {product} in stock?",
+    "Show me some products",
+    "Where is my order?",
+    "Tell me about the {product}",
+    "Do you sell anything for the kitchen?",
+    "Thanks, that helps!",
+]
+CATEGORIES = ["Electronics", "Home", "Kitchen", "Outdoor", "Books", "Toys"]
+ADJECTIVES = ["Compact", "Deluxe", "Smart", "Classic", "Portable", "Eco"]
+NOUNS = ["Laptop", "Kettle", "Lamp", "Backpack", "Speaker", "Blender", "Tent", "Novel"]
+
+# Metrics where a larger value is a regression (the rest: smaller is worse)
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        if ok:
+            self.latencies[endpoint].append(seconds)
+        else:
+            self.errors[endpoint] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        results = {}
+        endpoints = sorted(set(self.latencies) | set(self.errors))
+        for endpoint in endpoints + ["all"]:
+            if endpoint == "all":
+                samples = [value for values in self.latencies.values() for value in values]
+                errors = sum(self.errors.values())
+            else:
+                samples, errors = self.latencies[endpoint], self.errors[endpoint]
+            if not samples:
+                results[endpoint] = {"requests": 0, "errors": errors}
+                continue
+            p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+            results[endpoint] = {
+                "requests": len(samples),
+                "errors": errors,
+                "throughput_rps": round(len(samples) / elapsed, 1),
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2),
+            }
+        return results
+
+
+async def _timed(recorder, endpoint, request):
+    started = time.perf_counter()
+    try:
+        response = await request
+        ok = response.status_code < 400
+    except Exception:
+        response, ok = None, False
+    recorder.record(endpoint, time.perf_counter() - started, ok)
+    return response if ok else None
+
+
+async def _stream_chat(client, payload, recorder):
+    # httpx's ASGI transport delivers the body once the app finished it, so this is
+    # the full stream time; time to first token is in /metrics (llm_time_to_first_token_seconds)
+    started = time.perf_counter()
+    conversation_id = None
+    try:
+        async with client.stream("POST", "/api/chat/stream", json=payload) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("data: ") and conversation_id is None:
+                    conversation_id = json.loads(line[6:]).get("conversation_id")
+        ok = response.status_code < 400 and conversation_id is not None
+    except Exception:
+        ok = False
+    recorder.record("chat_stream", time.perf_counter() - started, ok)
+    return conversation_id
+
+
+async def _virtual_user(client, state: dict, turns: int, recorder: Recorder, stream: bool, products: list):
+    for turn in range(turns):
+        question = QUESTIONS[(state["user_id"] + state["turn"]) % len(QUESTIONS)]
+        question = question.format(product=products[(state["user_id"] * 7 + state["turn"]) % len(products)])
+        state["turn"] += 1
+        payload = {"user_id": str(state["user_id"]), "message": question}
+        if state["conversation_id"]:
+            payload["conversation_id"] = state["conversation_id"]
+
+        if stream:
+            conversation_id = await _stream_chat(client, payload, recorder)
+        else:
+            response = await _timed(recorder, "chat", client.post("/api/chat", json=payload))
+            conversation_id = response.json()["conversation_id"] if response is not None else None
+        state["conversation_id"] = state["conversation_id"] or conversation_id
+        if not state["conversation_id"]:
+            continue
+
+        await _timed(recorder, "history", client.get(
+            f"/api/conversations/{state['conversation_id']}/messages", params={"limit": 50}
+        ))
+        await _timed(recorder, "listing", client.get(
+            f"/api/users/{state['user_id']}/conversations", params={"limit": 20}
+        ))
+
+
+def _database_size(url: str) -> int:
+    """Bytes on disk of a SQLite database, after folding the WAL back into it"""
+    from sqlalchemy import text
+    from database import engine
+
+    path = url.split("///", 1)[1] if url.startswith("sqlite:///") else None
+    if not path:
+        return 0
+    with engine.connect() as conn:
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+def _seed(products: int, users: int) -> list:
+    from database import engine, Product
+    from models import User
+
+    names = [
+        f"{ADJECTIVES[i % len(ADJECTIVES)]} {NOUNS[(i // len(ADJECTIVES)) % len(NOUNS)]} {i}"
+        for i in range(products)
+    ]
+    with engine.begin() as conn:
+        conn.execute(Product.__table__.insert(), [
+            {"name": name, "description": f"A {name.lower()} for everyday use",
+             "price": round(5 + (i * 37) % 995 + 0.99, 2), "category": CATEGORIES[i % len(CATEGORIES)],
+             "stock_quantity": (i * 13) % 200}
+            for i, name in enumerate(names)
+        ])
+        conn.execute(User.__table__.insert(), [
+            {"username": f"bench{i}", "email": f"bench{i}@example.com"} for i in range(users)
+        ])
+    return names
+
+
+def _table_rows(table_names) -> dict:
+    from sqlalchemy import text
+    from database import engine
+
+    with engine.connect() as conn:
+        return {name: conn.execute(text(f"SELECT COUNT(*) FROM {name}")).scalar() for name in table_names}
+
+
+async def _run(args) -> dict:
+    import httpx
+    from main import app
+    from migrations import prepare_database
+    from database import engine
+
+    prepare_database(engine)
+    products = _seed(args.products, args.users)
+    size_before = _database_size(os.environ["DATABASE_URL"])
+    rows_before = _table_rows(["messages", "conversation_sessions"])
+
+    recorder, warmup = Recorder(), Recorder()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            states = [{"user_id": user_id, "turn": 0, "conversation_id": None}
+                      for user_id in range(1, args.users + 1)]
+            # Warm-up turns fill caches and connection pools and are not reported
+            await asyncio.gather(*[
+                _virtual_user(client, state, args.warmup, warmup, args.stream, products) for state in states
+            ])
+            started = time.perf_counter()
+            await asyncio.gather(*[
+                _virtual_user(client, state, args.turns, recorder, args.stream, products) for state in states
+            ])
+            elapsed = time.perf_counter() - started
+
+    size_after = _database_size(os.environ["DATABASE_URL"])
+    rows_after = _table_rows(["messages", "conversation_sessions"])
+    new_messages = rows_after["messages"] - rows_before["messages"]
+    return {
+        "config": {
+            "users": args.users, "turns": args.turns, "products": args.products, "stream": args.stream,
+            "latency": args.latency, "tokens_per_sec": args.tokens_per_sec, "env": sorted(args.env),
+        },
+        "machine": _machine(),
+        "settings": _settings(),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "seconds": round(elapsed, 2),
+        "endpoints": recorder.summary(elapsed),
+        "database": {
+            "bytes_before": size_before,
+            "bytes_after": size_after,
+            "new_messages": new_messages,
+            "bytes_per_message": round((size_after - size_before) / new_messages, 1) if new_messages else None,
+            "rows_after": rows_after,
+        },
+    }
+
+
+def _machine() -> dict:
+    """What the numbers depend on besides the code"""
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        revision = ""
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "revision": revision or None,
+    }
+
+
+def _settings() -> dict:
+    return {
+        key: value for key, value in sorted(os.environ.items())
+        if key.startswith(SETTING_PREFIXES)
+        and not any(part in key for part in ("KEY", "TOKEN", "PASSWORD", "URL", "PATH"))
+    }
+
+
+def _differences(recorded: dict, current: dict) -> list:
+    return [f"{key}: {recorded.get(key)} -> {current.get(key)}"
+            for key in sorted(set(recorded) | set(current)) if recorded.get(key) != current.get(key)]
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of results against a baseline, as readable lines"""
+    regressions = []
+    for endpoint, expected in baseline["endpoints"].items():
+        actual = results["endpoints"].get(endpoint)
+        if actual is None or not actual.get("requests"):
+            regressions.append(f"{endpoint}: no successful requests")
+            continue
+        if actual["errors"] > expected.get("errors", 0):
+            regressions.append(f"{endpoint}: {actual['errors']} errors (baseline {expected.get('errors', 0)})")
+        for metric, value in expected.items():
+            if metric in LOWER_IS_BETTER and actual[metric] > value * (1 + tolerance):
+                regressions.append(f"{endpoint} {metric}: {actual[metric]} > {value} + {tolerance:.0%}")
+            elif metric == "throughput_rps" and actual[metric] < value * (1 - tolerance):
+                regressions.append(f"{endpoint} {metric}: {actual[metric]} < {value} - {tolerance:.0%}")
+    return regressions
+
+
+def _print_report(results: dict):
+    print(f"\n{'endpoint':<26}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in results["endpoints"].items():
+        if not stats["requests"]:
+            print(f"{endpoint:<26}{0:>9}{stats['errors']:>8}")
+            continue
+        print(f"{endpoint:<26}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput_rps']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    database = results["database"]
+    print(f"\nDatabase: {database['bytes_before']:,} -> {database['bytes_after']:,} bytes "
+          f"({database['new_messages']:,} new messages, {database['bytes_per_message']} bytes/message)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process load test of the chat API with the stub LLM")
+    parser.add_argument("--users", type=int, default=32, help="concurrent virtual users")
+    parser.add_argument("--turns", type=int, default=10, help="measured turns per user")
+    parser.add_argument("--warmup", type=int, default=2, help="unreported turns per user before measuring")
+    parser.add_argument("--products", type=int, default=1000, help="catalog size to seed")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub LLM latency in seconds")
+    parser.add_argument("--tokens-per-sec", type=float, default=200, help="stub LLM streaming token rate")
+    parser.add_argument("--stream", action="store_true", help="chat through /api/chat/stream")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the app, e.g. WRITE_BEHIND=true")
+    parser.add_argument("--name", default="default", help="baseline entry to save or check")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="exit 1 on regressions against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative slowdown")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The app reads its settings at import time, so configure it before importing
+        os.environ.update({
+            "DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+            "LLM_PROVIDER": "stub",
+            "STUB_LLM_LATENCY": str(args.latency),
+            "STUB_LLM_TOKENS_PER_SEC": str(args.tokens_per_sec),
+            "EMBEDDING_INDEX_PATH": f"{tmp}/product_vectors",
+            "TRACE_EXPORT_PATH": "",
+            "LOG_LEVEL": "WARNING",
+        })
+        os.environ.pop("SCHEMA_PREPARED", None)
+        for setting in args.env:
+            key, _, value = setting.partition("=")
+            os.environ[key] = value
+        results = asyncio.run(_run(args))
+
+    _print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[args.name] = results
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved baseline '{args.name}' to {args.baseline}")
+
+    if args.check:
+        baseline = baselines.get(args.name)
+        if baseline is None:
+            sys.exit(f"No baseline '{args.name}' in {args.baseline}; record one with --save-baseline")
+        if baseline["config"] != results["config"]:
+            print(f"Warning: baseline '{args.name}' was recorded with {baseline['config']}")
+        # Revisions always differ; other differences make a failure less meaningful
+        for section in ("machine", "settings"):
+            recorded = {key: value for key, value in baseline.get(section, {}).items() if key != "revision"}
+            current = {key: value for key, value in results[section].items() if key != "revision"}
+            changed = _differences(recorded, current)
+            if changed:
+                print(f"Warning: {section} differs from the baseline ({baseline.get('recorded_at', 'unknown date')}, "
+                      f"revision {baseline.get('machine', {}).get('revision')}): " + "; ".join(changed))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS against baseline '%s':" % args.name)
+            for line in regressions:
+                print(f"  ✗ {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against baseline '{args.name}' (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
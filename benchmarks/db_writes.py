@@ -0,0 +1,126 @@
+# Concurrent chat-write throughput of the "plain" and "tuned" engine profiles on SQLite.
+#
+#   python -m benchmarks.db_writes --processes 4 --writers 16 --turns 20 [--write-behind]
+#
+# Every turn writes what POST /api/chat writes: the user message plus the
+# conversation's updated_at in one commit, then the AI message in another.
+# --write-behind sends them through the batched MessageWriter instead.
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from database import Base, create_db_engine
+from models import User, ConversationSession, Message
+from services.write_behind import MessageWriter
+
+
+async def _writer(session_factory, user_id: int, turns: int, errors: list, writer: MessageWriter):
+    conversation_id = None
+    for turn in range(turns):
+        try:
+            if writer.enabled and conversation_id is not None:
+                await writer.write(conversation_id, "user", f"question {turn}")
+                await writer.write(conversation_id, "ai", f"answer {turn} " * 20)
+                continue
+            async with session_factory() as db:
+                if conversation_id is None:
+                    conversation = ConversationSession(user_id=user_id)
+                    db.add(conversation)
+                    await db.flush()
+                    conversation_id = conversation.id
+                db.add(Message(conversation_id=conversation_id, sender="user", content=f"question {turn}"))
+                await db.execute(
+                    update(ConversationSession)
+                    .where(ConversationSession.id == conversation_id)
+                    .values(updated_at=datetime.utcnow())
+                )
+                await db.commit()
+
+            async with session_factory() as db:
+                db.add(Message(conversation_id=conversation_id, sender="ai", content=f"answer {turn} " * 20))
+                await db.commit()
+        except OperationalError as e:
+            errors.append(str(e.orig))
+
+
+async def _run_writers(url: str, profile: str, writers: int, turns: int, write_behind: bool) -> list:
+    engine = create_db_engine(url, is_async=True, profile=profile)
+    session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    writer = MessageWriter(enabled=write_behind, session_factory=session_factory)
+    writer.start()
+    async with session_factory() as db:
+        user = User(username=f"bench{os.getpid()}", email=f"bench{os.getpid()}@example.com")
+        db.add(user)
+        await db.commit()
+
+    errors = []
+    await asyncio.gather(*[_writer(session_factory, user.id, turns, errors, writer) for _ in range(writers)])
+    await writer.stop()
+    await engine.dispose()
+    return errors
+
+
+def _process(url, profile, writers, turns, write_behind, start, results):
+    start.wait()
+    results.put(asyncio.run(_run_writers(url, profile, writers, turns, write_behind)))
+
+
+def run(profile: str, processes: int, writers: int, turns: int, write_behind: bool = False) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{tmp}/bench.db"
+        setup_engine = create_db_engine(url, profile=profile)
+        Base.metadata.create_all(bind=setup_engine)
+        setup_engine.dispose()
+
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=_process, args=(url, profile, writers, turns, write_behind, start, results))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        started = time.perf_counter()
+        start.set()
+        errors = [error for _ in workers for error in results.get()]
+        elapsed = time.perf_counter() - started
+        for worker in workers:
+            worker.join()
+
+    turns_total = processes * writers * turns
+    return {
+        "profile": profile + ("+write-behind" if write_behind else ""),
+        "turns": turns_total,
+        "failed": len(errors),
+        "seconds": round(elapsed, 2),
+        "turns_per_sec": round((turns_total - len(errors)) / elapsed, 1),
+        "first_error": errors[0] if errors else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent chat-write throughput per engine profile")
+    parser.add_argument("--processes", type=int, default=4, help="worker processes writing at once")
+    parser.add_argument("--writers", type=int, default=16, help="concurrent conversations per process")
+    parser.add_argument("--turns", type=int, default=20, help="chat turns per conversation")
+    parser.add_argument("--profiles", default="plain,tuned")
+    parser.add_argument("--write-behind", action="store_true", help="batch message writes with MessageWriter")
+    args = parser.parse_args()
+
+    for profile in args.profiles.split(","):
+        print(run(profile, args.processes, args.writers, args.turns, args.write_behind))
+
+
+if __name__ == "__main__":
+    main()
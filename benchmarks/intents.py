@@ -0,0 +1,107 @@
+# Microbenchmark of intent classification: the compiled IntentClassifier
+# against the keyword scans it replaced.
+#
+#   python -m benchmarks.intents --products 100000 --repeat 5
+#
+# The legacy path lowercased the message and scanned three keyword lists per
+# request (and still extracted no entities); the classifier finds intents, order
+# ids and price ranges in one regex pass plus product names by n-gram lookup in
+# a catalog of --products synthetic names.
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from services.intents import IntentClassifier
+
+MESSAGES = [
+    "What laptops do you have?",
+    "How much is the {product}?",
+    "Is the {product} in stock?",
+    "Show me some products under $50",
+    "Where is my order #{order}?",
+    "Tell me about the {product} and anything between $20 and $80",
+    "I want to order 2 of the {product}",
+    "Thanks, that helps! Crossing the border tomorrow.",
+    "hey, can I buy gifts for a customer of mine?",
+]
+ADJECTIVES = ["Compact", "Deluxe", "Smart", "Classic", "Portable", "Eco", "Ultra", "Mini"]
+NOUNS = ["Laptop", "Kettle", "Lamp", "Backpack", "Speaker", "Blender", "Tent", "Novel", "Mug", "Chair"]
+
+
+def legacy_scan(message: str) -> tuple:
+    """The checks get_ai_response, get_ecommerce_context and get_mock_response made per request"""
+    ecommerce_keywords = ["product", "order", "buy", "purchase", "price", "stock", "customer"]
+    is_ecommerce = any(keyword in message.lower() for keyword in ecommerce_keywords)
+    wants_listing = any(word in message.lower() for word in ["product", "item", "buy", "price"])
+    about_orders = "order" in message.lower()
+    greeting = any(word in message.lower() for word in ["hello", "hi", "hey"])
+    return is_ecommerce, wants_listing, about_orders, greeting
+
+
+def product_names(count: int) -> list:
+    return [(i + 1, f"{ADJECTIVES[i % len(ADJECTIVES)]} {NOUNS[(i // len(ADJECTIVES)) % len(NOUNS)]} {i}")
+            for i in range(count)]
+
+
+def corpus(names: list, size: int) -> list:
+    rng = random.Random(42)
+    return [
+        rng.choice(MESSAGES).format(product=rng.choice(names)[1] if names else "Smart Lamp",
+                                    order=rng.randint(1, 100000))
+        for _ in range(size)
+    ]
+
+
+def time_per_message(function, messages: list, repeat: int) -> float:
+    """Best of `repeat` runs, in microseconds per message"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message in messages:
+            function(message)
+        best = min(best, time.perf_counter() - started)
+    return best / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Intent classification microbenchmark")
+    parser.add_argument("--products", type=int, default=100000, help="catalog names indexed for entity matching")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    names = product_names(args.products)
+    classifier = IntentClassifier(max_names=max(args.products, 1))
+    started = time.perf_counter()
+    classifier.load_names(names)
+    load_ms = (time.perf_counter() - started) * 1000
+    messages = corpus(names, args.messages)
+
+    legacy = time_per_message(legacy_scan, messages, args.repeat)
+    without_names = time_per_message(IntentClassifier().classify, messages, args.repeat)
+    with_names = time_per_message(classifier.classify, messages, args.repeat)
+
+    print(f"{args.messages:,} messages, {args.products:,} product names indexed in {load_ms:.0f} ms\n")
+    print(f"{'variant':<36} {'us/message':>11} {'messages/s':>12}")
+    for label, micros in (
+        ("legacy keyword scans", legacy),
+        ("classifier (intents, ids, prices)", without_names),
+        ("classifier + product names", with_names),
+    ):
+        print(f"{label:<36} {micros:>11.2f} {1e6 / micros:>12,.0f}")
+
+    sample = messages[: len(MESSAGES)]
+    print("\nSample classifications:")
+    for message in sample:
+        result = classifier.classify(message)
+        print(f"  {message!r}\n    intents={sorted(result.intents)} orders={result.order_ids} "
+              f"prices={result.price_range} products={result.product_ids}")
+
+
+if __name__ == "__main__":
+    main()
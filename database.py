@@ -1,6 +1,8 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Float, ForeignKey
+from sqlalchemy import create_engine, event, select, text, Column, Integer, BigInteger, String, DateTime, Text, Float, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from datetime import datetime
 import os
 from dotenv import load_dotenv
@@ -8,8 +10,91 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
+
+# Engine performance profile (overridable from the environment).
+# "tuned" applies the settings below; "plain" keeps SQLAlchemy/driver defaults
+DB_PROFILE = os.getenv("DB_PROFILE", "tuned")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# SQLite has a single writer: a few pooled connections per process queue requests
+# fairly in the pool instead of in SQLite's sleep-and-retry busy handler
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+
+def get_async_database_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto the matching async driver"""
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+def _is_sqlite_memory(url: str) -> bool:
+    path = url.split("://", 1)[1].split("?", 1)[0]
+    return path in ("", "/", "/:memory:") or "mode=memory" in url
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # Run on every new connection; journal_mode=WAL is persistent but cheap to repeat
+    cursor = dbapi_connection.cursor()
+    for pragma in (
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        # With WAL, NORMAL only syncs at checkpoints: still safe against corruption
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        "PRAGMA temp_store=MEMORY",
+    ):
+        cursor.execute(pragma)
+    cursor.close()
+
+def create_db_engine(url: str, is_async: bool = False, profile: str = DB_PROFILE):
+    """Create the sync or async engine for `url` with the configured performance profile"""
+    if is_async:
+        url = get_async_database_url(url)
+    if profile != "tuned":
+        return create_async_engine(url) if is_async else create_engine(url)
+
+    options = {}
+    if url.startswith("sqlite"):
+        if not _is_sqlite_memory(url):
+            # aiosqlite defaults to NullPool (a new connection and thread per session)
+            options.update(
+                poolclass=AsyncAdaptedQueuePool if is_async else QueuePool,
+                pool_size=SQLITE_POOL_SIZE,
+                max_overflow=0,
+                pool_timeout=DB_POOL_TIMEOUT,
+                connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+            )
+    elif url.startswith("postgresql"):
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True
+        )
+
+    new_engine = create_async_engine(url, **options) if is_async else create_engine(url, **options)
+    if url.startswith("sqlite") and not _is_sqlite_memory(url):
+        sync_engine = new_engine.sync_engine if is_async else new_engine
+        event.listen(sync_engine, "connect", _sqlite_pragmas)
+    return new_engine
+
+# Sync engine (scripts such as load_data.py)
+engine = create_db_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine (API request handlers)
+async_engine = create_db_engine(DATABASE_URL, is_async=True)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # E-commerce tables
@@ -17,12 +102,14 @@ class Product(Base):
     __tablename__ = "products"
     
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
     description = Column(Text)
-    price = Column(Float, nullable=False)
+    price = Column(Float, nullable=False, index=True)
     category = Column(String)
     stock_quantity = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Content hash of the source row, set by the CSV loader to detect changes on sync
+    source_hash = Column(BigInteger)
 
 class Customer(Base):
     __tablename__ = "customers"
@@ -33,9 +120,14 @@ class Customer(Base):
     phone = Column(String)
     address = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+    source_hash = Column(BigInteger)
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # A customer's orders, newest first, without scanning the table
+        Index("ix_orders_customer_date", "customer_id", "order_date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"))
@@ -44,10 +136,81 @@ class Order(Base):
     total_amount = Column(Float, nullable=False)
     order_date = Column(DateTime, default=datetime.utcnow)
     status = Column(String, default="pending")
+    source_hash = Column(BigInteger)
     
     customer = relationship("Customer")
     product = relationship("Product")
 
+class CatalogVersion(Base):
+    """Single-row counter bumped whenever products change, so every process can invalidate its caches"""
+    __tablename__ = "catalog_versions"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CatalogChange(Base):
+    """Change event log: which products/customers were inserted, updated or deleted at which catalog version"""
+    __tablename__ = "catalog_changes"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+    entity = Column(String, nullable=False)  # "product" or "customer"
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String, nullable=False)  # "insert", "update" or "delete"
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+def bump_catalog_version(connection):
+    """Increment the catalog version inside the caller's transaction"""
+    result = connection.execute(
+        CatalogVersion.__table__.update()
+        .where(CatalogVersion.id == 1)
+        .values(version=CatalogVersion.version + 1, updated_at=datetime.utcnow())
+    )
+    if result.rowcount == 0:
+        connection.execute(CatalogVersion.__table__.insert().values(id=1, version=1, updated_at=datetime.utcnow()))
+
+def record_catalog_changes(connection, entity: str, changes: dict) -> int:
+    """Log {operation: ids} change events inside the caller's transaction; returns the catalog version.
+
+    Product changes bump the version first, so a worker that sees a new version finds
+    exactly the products to invalidate. A bump without events means "anything may have changed".
+    """
+    if entity == "product" and any(changes.values()):
+        bump_catalog_version(connection)
+    version = connection.execute(select(CatalogVersion.version).where(CatalogVersion.id == 1)).scalar() or 0
+    now = datetime.utcnow()
+    rows = [
+        {"version": version, "entity": entity, "entity_id": int(entity_id), "operation": operation, "changed_at": now}
+        for operation, ids in changes.items() for entity_id in ids
+    ]
+    if rows:
+        connection.execute(CatalogChange.__table__.insert(), rows)
+    return version
+
+def link_users_to_customers(connection) -> int:
+    """Link chat users without a customer to the customer with the same email; returns the count"""
+    # Customer emails are stored lowercase by the loader
+    result = connection.execute(text(
+        "UPDATE users SET customer_id = "
+        "(SELECT customers.id FROM customers WHERE customers.email = lower(users.email)) "
+        "WHERE customer_id IS NULL "
+        "AND EXISTS (SELECT 1 FROM customers WHERE customers.email = lower(users.email))"
+    ))
+    return result.rowcount
+
+@event.listens_for(Session, "after_flush")
+def _bump_on_product_change(session, flush_context):
+    # Any ORM write to products bumps the version and logs the change in the same transaction
+    changes = {
+        operation: [obj.id for obj in objects if isinstance(obj, Product)]
+        for operation, objects in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted))
+    }
+    product_ids = {product_id for ids in changes.values() for product_id in ids}
+    if product_ids:
+        session.info.setdefault("changed_product_ids", set()).update(product_ids)
+        record_catalog_changes(session.connection(), "product", changes)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -55,5 +218,9 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def create_tables():
     Base.metadata.create_all(bind=engine)
\ No newline at end of file
@@ -1,71 +1,233 @@
-import pandas as pd
-from sqlalchemy.orm import Session
-from database import SessionLocal, Product, Customer, Order, create_tables
+import argparse
 import os
+from datetime import datetime
+import pandas as pd
+from database import SessionLocal, Product, Customer, Order, engine, bump_catalog_version, link_users_to_customers
+from migrations import prepare_database
+from services.bulk_load import load_frames, read_csv_chunks, lookup, BULK_CHUNK_SIZE
+from services.catalog_sync import sync_frames, with_fingerprint
+from services.embeddings import product_embeddings
+from services.search import search_triggers_suspended
 
-def load_products_from_csv(db: Session, csv_path: str):
-    """Load products from CSV file"""
-    if not os.path.exists(csv_path):
-        # Create sample data if CSV doesn't exist
-        sample_products = [
-            {"name": "Laptop", "description": "High-performance laptop", "price": 999.99, "category": "Electronics", "stock_quantity": 50},
-            {"name": "Smartphone", "description": "Latest smartphone", "price": 699.99, "category": "Electronics", "stock_quantity": 100},
-            {"name": "Coffee Mug", "description": "Ceramic coffee mug", "price": 12.99, "category": "Home", "stock_quantity": 200},
-        ]
-        for product_data in sample_products:
-            product = Product(**product_data)
-            db.add(product)
-    else:
-        df = pd.read_csv(csv_path)
-        for _, row in df.iterrows():
-            product = Product(
-                name=row['name'],
-                description=row.get('description', ''),
-                price=float(row['price']),
-                category=row.get('category', ''),
-                stock_quantity=int(row.get('stock_quantity', 0))
-            )
-            db.add(product)
-
-def load_customers_from_csv(db: Session, csv_path: str):
-    """Load customers from CSV file"""
+# Used when the matching CSV file doesn't exist
+SAMPLE_PRODUCTS = [
+    {"name": "Laptop", "description": "High-performance laptop", "price": 999.99, "category": "Electronics", "stock_quantity": 50},
+    {"name": "Smartphone", "description": "Latest smartphone", "price": 699.99, "category": "Electronics", "stock_quantity": 100},
+    {"name": "Coffee Mug", "description": "Ceramic coffee mug", "price": 12.99, "category": "Home", "stock_quantity": 200},
+]
+
+SAMPLE_CUSTOMERS = [
+    {"name": "John Doe", "email": "john@example.com", "phone": "123-456-7890", "address": "123 Main St"},
+    {"name": "Jane Smith", "email": "jane@example.com", "phone": "098-765-4321", "address": "456 Oak Ave"},
+]
+
+
+def _text(df: pd.DataFrame, column: str, default=None, strip: bool = True) -> pd.Series:
+    if column not in df:
+        return pd.Series(default, index=df.index, dtype=object)
+    values = df[column].str.strip() if strip else df[column]
+    values = values.replace("", None)
+    return values.fillna(default) if default is not None else values
+
+
+def _number(df: pd.DataFrame, column: str) -> pd.Series:
+    if column not in df:
+        return pd.Series(float("nan"), index=df.index)
+    return pd.to_numeric(df[column], errors="coerce")
+
+
+def _with_id(df: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    # Rows that carry their own id are upserted on it
+    if "id" in df:
+        rows.insert(0, "id", _number(df, "id").astype("Int64"))
+    return rows
+
+
+def clean_products(conn, df: pd.DataFrame):
+    """Coerce a raw products chunk; returns (valid rows, rejected count)"""
+    rows = pd.DataFrame({
+        "name": _text(df, "name"),
+        "description": _text(df, "description", "", strip=False),
+        "price": _number(df, "price"),
+        "category": _text(df, "category", ""),
+        "stock_quantity": _number(df, "stock_quantity").fillna(0).astype("int64"),
+        "created_at": datetime.utcnow(),
+    })
+    rows = _with_id(df, rows)
+    valid = rows["name"].notna() & rows["price"].notna() & (rows["price"] >= 0)
+    return rows[valid], int((~valid).sum())
+
+
+def clean_customers(conn, df: pd.DataFrame):
+    """Coerce a raw customers chunk; returns (valid rows, rejected count)"""
+    rows = pd.DataFrame({
+        "name": _text(df, "name"),
+        "email": _text(df, "email").str.lower(),
+        "phone": _text(df, "phone", ""),
+        "address": _text(df, "address", "", strip=False),
+        "created_at": datetime.utcnow(),
+    })
+    valid = rows["name"].notna() & rows["email"].str.contains("@", na=False)
+    return rows[valid], int((~valid).sum())
+
+
+def clean_orders(conn, df: pd.DataFrame):
+    """Coerce a raw orders chunk, resolving customer emails and product names to ids"""
+    customer_id = _number(df, "customer_id")
+    if "customer_email" in df:
+        emails = _text(df, "customer_email").str.lower()
+        found = lookup(conn, Customer.email, [Customer.id], emails[customer_id.isna()].dropna().unique())
+        customer_id = customer_id.fillna(emails.map(dict(zip(found["email"], found["id"]))).astype(float))
+
+    product_id = _number(df, "product_id")
+    if "product_name" in df:
+        names = _text(df, "product_name")
+        found = lookup(conn, Product.name, [Product.id], names[product_id.isna()].dropna().unique())
+        product_id = product_id.fillna(names.map(dict(zip(found["name"], found["id"]))).astype(float))
+    found = lookup(conn, Product.id, [Product.price], product_id.dropna().astype("int64").unique().tolist())
+    price = product_id.map(dict(zip(found["id"], found["price"])))
+
+    quantity = _number(df, "quantity").fillna(1)
+    order_date = pd.to_datetime(df["order_date"], errors="coerce") if "order_date" in df else pd.NaT
+    rows = pd.DataFrame({
+        "customer_id": customer_id.astype("Int64"),
+        "product_id": product_id.astype("Int64"),
+        "quantity": quantity.astype("int64"),
+        # Missing totals are priced from the catalog
+        "total_amount": _number(df, "total_amount").fillna(quantity * price),
+        "order_date": pd.Series(order_date, index=df.index).fillna(datetime.utcnow()),
+        "status": _text(df, "status", "pending"),
+    })
+    rows = _with_id(df, rows)
+    valid = (rows["customer_id"].notna() & rows["product_id"].notna()
+             & (rows["quantity"] > 0) & rows["total_amount"].notna())
+    return rows[valid], int((~valid).sum())
+
+
+def _frames(csv_path: str, sample: list, chunk_size: int):
+    if os.path.exists(csv_path):
+        return read_csv_chunks(csv_path, chunk_size)
+    return [pd.DataFrame(sample)] if sample else []
+
+
+def _bump_on_product_change(conn, inserted: int, updated: int):
+    # Bulk writes bypass the ORM hooks, so tell running workers' caches here
+    if inserted or updated:
+        bump_catalog_version(conn)
+
+
+def load_products_from_csv(csv_path: str, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """Upsert products from CSV (keyed on id when present, else name)"""
+    frames = _frames(csv_path, SAMPLE_PRODUCTS, chunk_size)
+    # One full-text rebuild at the end is far cheaper than a trigger per row
+    with search_triggers_suspended(engine):
+        return load_frames(engine, "products", Product.__table__, frames, with_fingerprint(clean_products),
+                           key=_product_key(csv_path), on_chunk=_bump_on_product_change)
+
+
+def load_customers_from_csv(csv_path: str, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """Upsert customers from CSV, keyed on email"""
+    frames = _frames(csv_path, SAMPLE_CUSTOMERS, chunk_size)
+    return load_frames(engine, "customers", Customer.__table__, frames, with_fingerprint(clean_customers),
+                       key="email")
+
+
+def sync_products_from_csv(csv_path: str, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """Make products match the CSV: only new, changed and removed rows are written"""
+    return sync_frames(engine, "products", Product.__table__, "product",
+                       read_csv_chunks(csv_path, chunk_size), clean_products, key=_product_key(csv_path))
+
+
+def sync_customers_from_csv(csv_path: str, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """Make customers match the CSV: only new, changed and removed rows are written"""
+    return sync_frames(engine, "customers", Customer.__table__, "customer",
+                       read_csv_chunks(csv_path, chunk_size), clean_customers, key="email")
+
+
+def load_orders_from_csv(csv_path: str, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """Upsert orders from CSV, keyed on id when present, else on customer, product and order date"""
+    frames = _frames(csv_path, [], chunk_size)
+    insert_only = _order_insert_only(csv_path)
+    return load_frames(engine, "orders", Order.__table__, frames, with_fingerprint(clean_orders, insert_only),
+                       key=_order_key(csv_path), insert_only=insert_only)
+
+
+def sync_orders_from_csv(csv_path: str, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """Write only new and changed orders; orders missing from the file are kept (they are history)"""
+    return sync_frames(engine, "orders", Order.__table__, None, read_csv_chunks(csv_path, chunk_size),
+                       clean_orders, key=_order_key(csv_path), insert_only=_order_insert_only(csv_path),
+                       delete_missing=False)
+
+
+def _order_insert_only(csv_path: str) -> tuple:
+    # Without dates in the file, reloads must not move existing orders to today
+    return () if _has_column(csv_path, "order_date") else ("order_date",)
+
+
+def _product_key(csv_path: str) -> str:
+    return "id" if _has_column(csv_path, "id") else "name"
+
+
+def _order_key(csv_path: str):
+    if _has_column(csv_path, "id"):
+        return "id"
+    # Order files without ids are matched on their natural key; without dates (filled in
+    # with the load time) the quantity stands in for the date
+    if _has_column(csv_path, "order_date"):
+        return ("customer_id", "product_id", "order_date")
+    return ("customer_id", "product_id", "quantity")
+
+
+def _has_column(csv_path: str, column: str) -> bool:
     if not os.path.exists(csv_path):
-        # Create sample data
-        sample_customers = [
-            {"name": "John Doe", "email": "john@example.com", "phone": "123-456-7890", "address": "123 Main St"},
-            {"name": "Jane Smith", "email": "jane@example.com", "phone": "098-765-4321", "address": "456 Oak Ave"},
-        ]
-        for customer_data in sample_customers:
-            customer = Customer(**customer_data)
-            db.add(customer)
-    else:
-        df = pd.read_csv(csv_path)
-        for _, row in df.iterrows():
-            customer = Customer(
-                name=row['name'],
-                email=row['email'],
-                phone=row.get('phone', ''),
-                address=row.get('address', '')
-            )
-            db.add(customer)
-
-def main():
-    create_tables()
-    db = SessionLocal()
-    
+        return False
+    return column in pd.read_csv(csv_path, nrows=0).columns
+
+
+def main(data_dir: str = "data", chunk_size: int = BULK_CHUNK_SIZE, sync: bool = False):
+    prepare_database(engine)
+
+    changed_products = None
+    orders_csv = os.path.join(data_dir, "orders.csv")
     try:
-        # Load data from CSV files or create sample data
-        load_products_from_csv(db, "data/products.csv")
-        load_customers_from_csv(db, "data/customers.csv")
-        
-        db.commit()
-        print("Data loaded successfully!")
-        
+        if sync:
+            # The files are the full source of truth; a missing file is skipped, never treated as empty
+            products_csv = os.path.join(data_dir, "products.csv")
+            customers_csv = os.path.join(data_dir, "customers.csv")
+            if os.path.exists(products_csv):
+                changed_products = sync_products_from_csv(products_csv, chunk_size)["changed_ids"]
+            if os.path.exists(customers_csv):
+                sync_customers_from_csv(customers_csv, chunk_size)
+            if os.path.exists(orders_csv):
+                sync_orders_from_csv(orders_csv, chunk_size)
+        else:
+            # Load data from CSV files or create sample data
+            load_products_from_csv(os.path.join(data_dir, "products.csv"), chunk_size)
+            load_customers_from_csv(os.path.join(data_dir, "customers.csv"), chunk_size)
+            load_orders_from_csv(orders_csv, chunk_size)
+        # Chat users registered before their customer record existed
+        with engine.begin() as conn:
+            linked = link_users_to_customers(conn)
+        if linked:
+            print(f"Linked {linked} users to their customer records")
+        print("Data synced successfully!" if sync else "Data loaded successfully!")
     except Exception as e:
-        db.rollback()
         print(f"Error loading data: {e}")
+        return
+
+    # Embed new or changed products for semantic search
+    db = SessionLocal()
+    try:
+        embedded = product_embeddings.sync(db, ids=changed_products)
+        print(f"Product vector index updated ({embedded} products embedded)")
     finally:
         db.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Bulk load products, customers and orders from CSV")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE)
+    parser.add_argument("--sync", action="store_true",
+                        help="apply only the difference to the CSVs, deleting products/customers missing from them")
+    args = parser.parse_args()
+    main(args.data_dir, args.chunk_size, args.sync)
@@ -1,15 +1,70 @@
-from fastapi import FastAPI, Depends, HTTPException
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from database import get_db, create_tables, Base, engine
+from sqlalchemy import text, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, engine, async_engine, AsyncSessionLocal, Customer
 from models import User, ConversationSession, Message
 from schemas import UserCreate, User as UserSchema
 from routes.chat import router as chat_router
+from migrations import prepare_database
+from services.providers import get_provider, close_provider
+from services.summarizer import summarizer
+from services.write_behind import message_writer
+from services.catalog_cache import catalog_cache
+from services.response_cache import response_cache
+from services.shared_cache import get_shared_cache, close_shared_cache
+from services.embeddings import product_embeddings
+from services.intents import intent_classifier
+from services.metrics import MetricsMiddleware, instrument_engine, render_metrics, mark_worker_exited
+from services.tracing import TracingMiddleware, exporter as span_exporter
+from services.log import setup_logging, shutdown_logging, get_logger
+from prometheus_client import CONTENT_TYPE_LATEST
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Per-route database time for /metrics
+instrument_engine(async_engine)
 
-app = FastAPI(title="Conversational AI Backend", version="1.0.0")
+logger = get_logger("main")
+
+async def warm_up():
+    """Open clients and fill caches so the first requests skip cold starts"""
+    get_provider()
+    get_shared_cache()
+    async with AsyncSessionLocal() as db:
+        # Also opens the first pooled database connection
+        await db.execute(text("SELECT 1"))
+        cached = await catalog_cache.warm(db)
+        names = await intent_classifier.warm(db)
+    await product_embeddings.warm()
+    logger.info("Worker %d ready (%d products cached, %d product names indexed)", os.getpid(), cached, names)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    # serve.py prepares the schema once before starting its workers
+    if not os.getenv("SCHEMA_PREPARED"):
+        prepare_database(engine)
+    else:
+        # serve.py's prepare() is the only writer of the vector index; workers
+        # keep their updates in memory and reload it when it is saved again
+        product_embeddings.writable = False
+    await warm_up()
+    summarizer.start()
+    message_writer.start()
+    yield
+    # Runs after the server stopped accepting and drained in-flight requests
+    await summarizer.stop()
+    # Commit batched writes still queued before the engine goes away
+    await message_writer.stop()
+    await close_provider()
+    await close_shared_cache()
+    await async_engine.dispose()
+    mark_worker_exited()
+    span_exporter.stop()
+    shutdown_logging()
+
+app = FastAPI(title="Conversational AI Backend", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -19,6 +74,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Root span per request; the chat pipeline adds its stages as child spans
+app.add_middleware(TracingMiddleware)
+# Outermost, so latency covers CORS handling and whole streamed responses
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(chat_router)
@@ -27,21 +86,42 @@ app.include_router(chat_router)
 async def root():
     return {"message": "Conversational AI Backend is running!"}
 
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    shared = get_shared_cache()
+    return {
+        "catalog": catalog_cache.stats(),
+        "responses": response_cache.stats(),
+        "shared_backend": shared.name if shared is not None else None
+    }
+
 @app.post("/api/users", response_model=UserSchema)
-async def create_user(user: UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     db_user = User(username=user.username, email=user.email)
+    # Users chatting with a customer's email see that customer's orders
+    db_user.customer_id = await db.scalar(select(Customer.id).where(Customer.email == user.email.lower()))
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @app.get("/api/users/{user_id}", response_model=UserSchema)
-async def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 if __name__ == "__main__":
     import uvicorn
+    # Single-process development server; use serve.py in production
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,91 @@
+from sqlalchemy import text, inspect
+from sqlalchemy.engine import Engine
+from datetime import datetime
+from database import Base, link_users_to_customers
+from services.search import create_search_index, restore_search_triggers
+from services.log import get_logger
+import models  # noqa: F401 (registers the chat tables on Base.metadata)
+
+logger = get_logger("migrations")
+
+def add_column(table: str, column: str, ddl: str):
+    """Migration step adding a column, unless create_all already created the table with it"""
+    def step(conn):
+        if column not in {existing["name"] for existing in inspect(conn).get_columns(table)}:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return step
+
+# Base.metadata.create_all only creates missing tables, so indexes and columns
+# added to existing tables are applied here. Each entry runs once per database;
+# steps are SQL strings or callables taking the connection.
+MIGRATIONS = [
+    (1, "Index conversation listing by user and recency", [
+        "CREATE INDEX IF NOT EXISTS ix_conversation_sessions_user_updated "
+        "ON conversation_sessions (user_id, updated_at)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_conversation_id ON messages (conversation_id)",
+    ]),
+    (2, "Composite index for paginated message history", [
+        "CREATE INDEX IF NOT EXISTS ix_messages_conversation_timestamp "
+        "ON messages (conversation_id, timestamp)",
+        # Superseded by the composite index above
+        "DROP INDEX IF EXISTS ix_messages_conversation_id",
+    ]),
+    (3, "Full-text search index over products", [
+        create_search_index,
+    ]),
+    (4, "Seed the catalog version counter", [
+        "INSERT INTO catalog_versions (id, version) "
+        "SELECT 1, 0 WHERE NOT EXISTS (SELECT 1 FROM catalog_versions WHERE id = 1)",
+    ]),
+    (5, "Index product names for bulk upserts", [
+        "CREATE INDEX IF NOT EXISTS ix_products_name ON products (name)",
+    ]),
+    (6, "Source row fingerprints for incremental catalog sync", [
+        add_column("products", "source_hash", "BIGINT"),
+        add_column("customers", "source_hash", "BIGINT"),
+    ]),
+    (7, "Link chat users to customers and index orders per customer", [
+        add_column("users", "customer_id", "INTEGER REFERENCES customers (id)"),
+        "CREATE INDEX IF NOT EXISTS ix_users_customer_id ON users (customer_id)",
+        "CREATE INDEX IF NOT EXISTS ix_orders_customer_date ON orders (customer_id, order_date)",
+        link_users_to_customers,
+    ]),
+    (8, "Index product prices for price-range questions", [
+        "CREATE INDEX IF NOT EXISTS ix_products_price ON products (price)",
+    ]),
+    (9, "Source row fingerprints for incremental order sync", [
+        add_column("orders", "source_hash", "BIGINT"),
+    ]),
+]
+
+def run_migrations(engine: Engine):
+    """Apply pending migrations and record them in schema_migrations"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, description VARCHAR, applied_at TIMESTAMP)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+        for version, description, steps in MIGRATIONS:
+            if version in applied:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) "
+                     "VALUES (:version, :description, :applied_at)"),
+                {"version": version, "description": description, "applied_at": datetime.utcnow()}
+            )
+            logger.info("Applied migration %d: %s", version, description, extra={"migration": version})
+
+
+def prepare_database(engine: Engine):
+    """Create missing tables, then apply pending migrations"""
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    with engine.begin() as conn:
+        restore_search_triggers(conn)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -10,11 +10,17 @@ class User(Base):
     username = Column(String, unique=True, nullable=False)
     email = Column(String, unique=True, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # The e-commerce customer this user chats as (matched on email), if any
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)
     
     conversations = relationship("ConversationSession", back_populates="user")
+    customer = relationship("Customer")
 
 class ConversationSession(Base):
     __tablename__ = "conversation_sessions"
+    __table_args__ = (
+        Index("ix_conversation_sessions_user_updated", "user_id", "updated_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -27,6 +33,9 @@ class ConversationSession(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_conversation_timestamp", "conversation_id", "timestamp"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversation_sessions.id"))
@@ -34,4 +43,13 @@ class Message(Base):
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     
-    conversation = relationship("ConversationSession", back_populates="messages")
\ No newline at end of file
+    conversation = relationship("ConversationSession", back_populates="messages")
+
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+    
+    conversation_id = Column(Integer, ForeignKey("conversation_sessions.id"), primary_key=True)
+    content = Column(Text, nullable=False)
+    last_message_id = Column(Integer, nullable=False)  # newest message folded into the summary
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,58 +1,94 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
-from models import User, ConversationSession, Message
-from schemas import ChatRequest, ChatResponse
-from services.llm import get_ai_response
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, update, delete, func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, AsyncSessionLocal
+from models import User, ConversationSession, Message, ConversationSummary
+from schemas import ChatRequest, ChatResponse, Message as MessageSchema
+from services.llm import get_ai_response, stream_ai_response
+from services.llm_router import LLMUnavailableError
+from services.memory import conversation_memory
+from services.summarizer import summarizer
+from services.write_behind import message_writer
+from services.tracing import span
 from datetime import datetime
+from typing import Optional
 
 router = APIRouter()
 
-@router.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, db: Session = Depends(get_db)):
-    try:
-        # Get or create user
-        user = db.query(User).filter(User.id == int(request.user_id)).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Get or create conversation
+async def get_or_create_conversation(request: ChatRequest, db: AsyncSession) -> ConversationSession:
+    """Look up the requesting user and their conversation, creating it if needed"""
+    with span("user_lookup"):
+        user = await db.get(User, int(request.user_id))
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    with span("conversation", created=not request.conversation_id):
         if request.conversation_id:
-            conversation = db.query(ConversationSession).filter(
-                ConversationSession.id == int(request.conversation_id)
-            ).first()
+            conversation = await db.get(ConversationSession, int(request.conversation_id))
             if not conversation:
                 raise HTTPException(status_code=404, detail="Conversation not found")
         else:
             conversation = ConversationSession(user_id=user.id)
             db.add(conversation)
-            db.flush()
+            await db.flush()
+    
+    return conversation
+
+async def save_message(db: AsyncSession, conversation_id: int, sender: str, content: str) -> Message:
+    """Commit a message and bump its conversation's updated_at"""
+    if message_writer.enabled:
+        # The batched writer uses its own connection, so anything pending here
+        # (e.g. a new conversation) must be committed first
+        await db.commit()
+        return await message_writer.write(conversation_id, sender, content)
+    
+    message = Message(
+        conversation_id=conversation_id,
+        sender=sender,
+        content=content,
+        timestamp=datetime.utcnow()
+    )
+    db.add(message)
+    await db.execute(
+        update(ConversationSession)
+        .where(ConversationSession.id == conversation_id)
+        .values(updated_at=datetime.utcnow())
+    )
+    await db.commit()
+    return message
+
+async def record_message(message: Message):
+    """Add a committed message to the conversation memory, summarising what overflows"""
+    window = await conversation_memory.append(message.conversation_id, message.sender, message.content, message.id)
+    # Only when this message pushed older ones out, not on every turn after the first overflow
+    if window is not None and window.dropped_tokens:
+        summarizer.schedule(message.conversation_id)
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/api/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, db: AsyncSession = Depends(get_async_db)):
+    try:
+        # Get or create user and conversation
+        conversation = await get_or_create_conversation(request, db)
         
-        # Save user message
-        user_message = Message(
-            conversation_id=conversation.id,
-            sender="user",
-            content=request.message,
-            timestamp=datetime.utcnow()
-        )
-        db.add(user_message)
+        # Save user message; committed before the LLM call so no write
+        # transaction is held while waiting
+        with span("persist_user_message"):
+            user_message = await save_message(db, conversation.id, "user", request.message)
+            await record_message(user_message)
         
         # Get AI response
-        ai_response_content = await get_ai_response(request.message, conversation.id, db)
+        ai_response_content = await get_ai_response(request.message, conversation.id, db, conversation.user_id)
         
-        # Save AI message
-        ai_message = Message(
-            conversation_id=conversation.id,
-            sender="ai",
-            content=ai_response_content,
-            timestamp=datetime.utcnow()
-        )
-        db.add(ai_message)
-        
-        # Update conversation timestamp
-        conversation.updated_at = datetime.utcnow()
-        
-        db.commit()
+        # Save AI message and update the conversation timestamp
+        with span("persist_ai_message"):
+            ai_message = await save_message(db, conversation.id, "ai", ai_response_content)
+            await record_message(ai_message)
         
         return ChatResponse(
             conversation_id=str(conversation.id),
@@ -60,44 +96,167 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db)):
             ai_response=ai_message
         )
         
+    except LLMUnavailableError as e:
+        # The user's message is kept; no answer is saved for it
+        await db.rollback()
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest, db: AsyncSession = Depends(get_async_db)):
+    """Stream the AI response as Server-Sent Events.
+
+    Emits a ``start`` event with the saved user message, ``token`` events as the
+    provider generates text and a ``done`` event with the saved AI message.
+    """
+    try:
+        conversation = await get_or_create_conversation(request, db)
+        
+        # Save user message up front so it survives a dropped stream
+        with span("persist_user_message"):
+            user_message = await save_message(db, conversation.id, "user", request.message)
+            await record_message(user_message)
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    conversation_id = conversation.id
+    user_id = conversation.user_id
+    start_payload = {
+        "conversation_id": str(conversation_id),
+        "user_message": MessageSchema.model_validate(user_message).model_dump(mode="json")
+    }
+    
+    async def event_stream():
+        yield sse_event("start", start_payload)
+        
+        # Client disconnects cancel this generator, which closes the upstream stream
+        chunks = []
+        try:
+            async for chunk in stream_ai_response(request.message, conversation_id, db, user_id):
+                chunks.append(chunk)
+                yield sse_event("token", {"delta": chunk})
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+            return
+        
+        # Save AI message once the full response is known
+        async with AsyncSessionLocal() as session:
+            try:
+                with span("persist_ai_message"):
+                    ai_message = await save_message(session, conversation_id, "ai", "".join(chunks))
+                    await record_message(ai_message)
+                yield sse_event("done", {"ai_response": MessageSchema.model_validate(ai_message).model_dump(mode="json")})
+            except Exception as e:
+                await session.rollback()
+                yield sse_event("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/api/users/{user_id}/conversations")
-async def get_user_conversations(user_id: int, db: Session = Depends(get_db)):
-    conversations = db.query(ConversationSession).filter(
-        ConversationSession.user_id == user_id
-    ).order_by(ConversationSession.updated_at.desc()).all()
+async def get_user_conversations(
+    user_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """List a user's conversations, most recently updated first.
+
+    Keyset pagination: pass the ``updated_at`` and ``id`` of the last item
+    received as ``before`` and ``before_id`` to fetch the next page.
+    """
+    # Counted per returned row, served by the messages.conversation_id index
+    message_count = (
+        select(func.count(Message.id))
+        .where(Message.conversation_id == ConversationSession.id)
+        .scalar_subquery()
+    )
+    query = (
+        select(
+            ConversationSession.id,
+            ConversationSession.title,
+            ConversationSession.updated_at,
+            message_count.label("message_count")
+        )
+        .where(ConversationSession.user_id == user_id)
+        .order_by(ConversationSession.updated_at.desc(), ConversationSession.id.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        query = query.where(or_(
+            ConversationSession.updated_at < before,
+            and_(ConversationSession.updated_at == before, ConversationSession.id < (before_id or 0))
+        ))
+    
+    result = await db.execute(query)
     
     return [
         {
-            "id": str(conv.id),
-            "title": conv.title or f"Conversation {conv.id}",
-            "updated_at": conv.updated_at.isoformat(),
-            "message_count": len(conv.messages)
+            "id": str(row.id),
+            "title": row.title or f"Conversation {row.id}",
+            "updated_at": row.updated_at.isoformat(),
+            "message_count": row.message_count
         }
-        for conv in conversations
+        for row in result
     ]
 
 @router.get("/api/conversations/{conversation_id}/messages")
-async def get_conversation_messages(conversation_id: int, db: Session = Depends(get_db)):
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(Message.timestamp.asc()).all()
+async def get_conversation_messages(
+    conversation_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Return the latest page of messages in chronological order.
+
+    Pass the ``id`` of the oldest message received as ``before_id`` to fetch
+    the page before it. Rows are selected as plain columns rather than ORM
+    objects to keep large pages cheap.
+    """
+    query = (
+        select(
+            Message.id,
+            Message.conversation_id,
+            Message.sender,
+            Message.content,
+            Message.timestamp
+        )
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(limit)
+    )
+    if before_id is not None:
+        cursor_timestamp = select(Message.timestamp).where(Message.id == before_id).scalar_subquery()
+        query = query.where(or_(
+            Message.timestamp < cursor_timestamp,
+            and_(Message.timestamp == cursor_timestamp, Message.id < before_id)
+        ))
+    
+    result = await db.execute(query)
+    rows = result.mappings().all()
     
-    return messages
+    return [dict(row) for row in reversed(rows)]
 
 @router.delete("/api/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: int, db: Session = Depends(get_db)):
-    conversation = db.query(ConversationSession).filter(
-        ConversationSession.id == conversation_id
-    ).first()
+async def delete_conversation(conversation_id: int, db: AsyncSession = Depends(get_async_db)):
+    conversation = await db.get(ConversationSession, conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    db.delete(conversation)
-    db.commit()
+    await db.execute(delete(ConversationSummary).where(ConversationSummary.conversation_id == conversation_id))
+    await db.delete(conversation)
+    await db.commit()
+    await conversation_memory.evict(conversation_id)
     return {"message": "Conversation deleted"}
 
 
@@ -0,0 +1,63 @@
+import os
+import glob
+import tempfile
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Production server settings (overridable from the environment)
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Conversation windows are cached per worker unless a shared cache is configured,
+# so several workers without one would each serve turns from a stale window
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1) if SHARED_CACHE_URL else "1"))
+# Seconds in-flight requests (including open chat streams) get to finish after SIGTERM
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+KEEPALIVE_TIMEOUT = int(os.getenv("KEEPALIVE_TIMEOUT", "5"))
+
+
+def prepare():
+    """One-off work done before any worker starts, so workers never race on it"""
+    from database import engine, SessionLocal
+    from migrations import prepare_database
+    from services.embeddings import product_embeddings
+
+    prepare_database(engine)
+    db = SessionLocal()
+    try:
+        print(f"Product vector index up to date ({product_embeddings.sync(db)} products re-embedded)")
+    finally:
+        db.close()
+    engine.dispose()
+
+
+def main():
+    prepare()
+    # Inherited by the workers: their lifespan handler skips schema creation
+    os.environ["SCHEMA_PREPARED"] = "1"
+    if WEB_CONCURRENCY > 1 and not SHARED_CACHE_URL:
+        print(f"⚠️ {WEB_CONCURRENCY} workers without SHARED_CACHE_URL: conversation history may be stale across workers")
+    if WEB_CONCURRENCY > 1:
+        # Workers share metric files so /metrics reports all of them
+        metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="think41-metrics-"))
+        os.makedirs(metrics_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(metrics_dir, "*.db")):
+            os.remove(stale)
+
+    print(f"Starting {WEB_CONCURRENCY} worker(s) on {HOST}:{PORT}")
+    # On SIGTERM each worker stops accepting, drains in-flight requests for up
+    # to GRACEFUL_TIMEOUT seconds, then runs the lifespan shutdown
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        timeout_keep_alive=KEEPALIVE_TIMEOUT
+    )
+
+
+if __name__ == "__main__":
+    main()
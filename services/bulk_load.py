@@ -0,0 +1,195 @@
+import io
+import os
+import time
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+import pandas as pd
+from sqlalchemy import Column, MetaData, Table
+from sqlalchemy.engine import Connection, Engine
+
+# Rows per chunk read from CSV and written per transaction (overridable from the environment)
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "50000"))
+
+# Upsert key: a column name or the columns of a composite natural key
+Key = Union[str, Sequence[str]]
+
+
+def _column_values(series: pd.Series) -> list:
+    """Plain Python values of one column (NaN/NaT/NA as None), converted column-wise"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        # Same text format SQLAlchemy writes for DateTime on SQLite; timestamps
+        # repeat a lot (one load time, order dates), so format each distinct value once
+        codes, uniques = pd.factorize(series)
+        formatted = pd.Index(uniques).strftime("%Y-%m-%d %H:%M:%S.%f").tolist() + [None]
+        return [formatted[code] for code in codes]
+    missing = series.isna()
+    if not missing.any():
+        return series.tolist()
+    return series.astype(object).where(~missing, None).tolist()
+
+
+def _records(df: pd.DataFrame) -> List[tuple]:
+    """Row tuples ready for executemany"""
+    return list(zip(*[_column_values(df[name]) for name in df.columns]))
+
+
+class BulkUpserter:
+    """Set-based upsert of DataFrame chunks into one table through a temporary staging table.
+
+    Each chunk is written to staging (COPY on Postgres, executemany elsewhere), then
+    applied with one UPDATE for rows whose key exists and whose values differ and one
+    INSERT for new keys. Without a key every row is inserted. `insert_only` columns
+    (e.g. created_at) are written for new rows but never compared or updated.
+    Rows repeating a key within a chunk are merged (the last one wins) and counted
+    in `duplicates`.
+    """
+
+    def __init__(self, conn: Connection, table: Table, columns: List[str], key: Optional[Key] = None,
+                 insert_only: Tuple[str, ...] = ("created_at",)):
+        self.conn = conn
+        self.table = table
+        self.columns = columns
+        # One column, or several forming a natural key (e.g. customer, product and date of an order)
+        self.key = [key] if isinstance(key, str) else list(key or [])
+        self.insert_only = insert_only
+        self.duplicates = 0
+        self.dialect = conn.dialect.name
+        self.staging = Table(
+            f"staging_{table.name}",
+            MetaData(),
+            *[Column(name, table.c[name].type) for name in columns],
+            prefixes=["TEMPORARY"]
+        )
+        self.staging.create(conn, checkfirst=True)
+
+    def upsert(self, df: pd.DataFrame) -> Tuple[int, int]:
+        """Apply one chunk; returns (inserted, updated)"""
+        if df.empty:
+            return 0, 0
+        if self.key:
+            deduplicated = df.drop_duplicates(subset=self.key, keep="last")
+            self.duplicates += len(df) - len(deduplicated)
+            df = deduplicated
+        df = df[self.columns]
+
+        self.conn.execute(self.staging.delete())
+        self._fill_staging(df)
+
+        target, staging = self.table.name, self.staging.name
+        column_list = ", ".join(self.columns)
+        updated = 0
+        if self.key:
+            changed = "IS DISTINCT FROM" if self.dialect == "postgresql" else "IS NOT"
+            values = [name for name in self.columns if name not in self.key and name not in self.insert_only]
+            if values:
+                updated = self.conn.exec_driver_sql(
+                    f"UPDATE {target} SET {', '.join(f'{name} = s.{name}' for name in values)} "
+                    f"FROM {staging} s WHERE {self._match(target, 's')} "
+                    f"AND ({' OR '.join(f'{target}.{name} {changed} s.{name}' for name in values)})"
+                ).rowcount
+            inserted = self.conn.exec_driver_sql(
+                f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {staging} s "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {target} t WHERE {self._match('t', 's')})"
+            ).rowcount
+        else:
+            inserted = self.conn.exec_driver_sql(
+                f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {staging}"
+            ).rowcount
+        return inserted, updated
+
+    def _match(self, target: str, staging: str) -> str:
+        return " AND ".join(f"{target}.{name} = {staging}.{name}" for name in self.key)
+
+    def _fill_staging(self, df: pd.DataFrame):
+        column_list = ", ".join(self.columns)
+        if self.dialect == "postgresql":
+            # COPY is several times faster than any INSERT form on Postgres
+            buffer = io.StringIO()
+            df.to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor = self.conn.connection.dbapi_connection.cursor()
+            try:
+                cursor.copy_expert(f"COPY {self.staging.name} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+            finally:
+                cursor.close()
+            return
+
+        placeholder = "?" if self.conn.dialect.paramstyle == "qmark" else "%s"
+        self.conn.exec_driver_sql(
+            f"INSERT INTO {self.staging.name} ({column_list}) "
+            f"VALUES ({', '.join([placeholder] * len(self.columns))})",
+            _records(df)
+        )
+
+    def finish(self):
+        if self.dialect == "postgresql" and self.key == ["id"]:
+            # Explicit ids bypass the sequence; move it past them
+            self.conn.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('{self.table.name}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {self.table.name}), 1))"
+            )
+        self.staging.drop(self.conn, checkfirst=True)
+
+
+def load_frames(engine: Engine, label: str, table: Table, frames, clean: Callable,
+                key: Optional[Key] = None, on_chunk: Optional[Callable] = None,
+                insert_only: Tuple[str, ...] = ("created_at",)) -> dict:
+    """Clean and upsert an iterable of DataFrame chunks, one transaction per chunk.
+
+    `clean(conn, df)` coerces a raw chunk vectorised and returns (rows, rejected);
+    `on_chunk(conn, inserted, updated)` runs inside each chunk's transaction.
+    Every row read ends up in exactly one of the counts: inserted, updated,
+    unchanged (its key already held the same values), duplicates or rejected.
+    """
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "duplicates": 0, "rejected": 0}
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        upserter = None
+        for raw in frames:
+            with conn.begin():
+                rows, rejected = clean(conn, raw)
+                if upserter is None:
+                    columns = [name for name in rows.columns if name in table.c]
+                    keys = [key] if isinstance(key, str) else list(key or [])
+                    # A key the source doesn't have (e.g. no id column) means plain inserts
+                    usable = bool(keys) and all(name in columns for name in keys)
+                    upserter = BulkUpserter(conn, table, columns, key if usable else None, insert_only)
+                duplicates = upserter.duplicates
+                inserted, updated = upserter.upsert(rows)
+                duplicates = upserter.duplicates - duplicates
+                if on_chunk is not None:
+                    on_chunk(conn, inserted, updated)
+
+            stats["rows"] += len(raw)
+            stats["inserted"] += inserted
+            stats["updated"] += updated
+            stats["unchanged"] += len(rows) - duplicates - inserted - updated
+            stats["duplicates"] += duplicates
+            stats["rejected"] += rejected
+            elapsed = time.perf_counter() - started
+            print(f"  {label}: {stats['rows']:,} rows read, {stats['inserted']:,} new, "
+                  f"{stats['updated']:,} updated, {stats['unchanged']:,} unchanged, "
+                  f"{stats['duplicates']:,} duplicates merged, {stats['rejected']:,} rejected "
+                  f"({stats['rows'] / elapsed:,.0f} rows/s)")
+
+        if upserter is not None:
+            with conn.begin():
+                upserter.finish()
+    return stats
+
+
+def lookup(conn: Connection, key_column, value_columns, values) -> pd.DataFrame:
+    """Rows whose key_column is in values, queried in batches below the bind-parameter limit"""
+    values = list(values)
+    table = key_column.table
+    frames = [
+        pd.read_sql(table.select().with_only_columns(key_column, *value_columns)
+                    .where(key_column.in_(values[start:start + 10000])), conn)
+        for start in range(0, len(values), 10000)
+    ]
+    columns = [key_column.name] + [column.name for column in value_columns]
+    return pd.concat(frames) if frames else pd.DataFrame(columns=columns)
+
+
+def read_csv_chunks(csv_path: str, chunk_size: int = BULK_CHUNK_SIZE):
+    """Stream a CSV as DataFrame chunks without loading the whole file"""
+    return pd.read_csv(csv_path, chunksize=chunk_size, dtype=str, keep_default_na=False, na_values=[""])
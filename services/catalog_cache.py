@@ -0,0 +1,217 @@
+import os
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterable, Tuple, Callable, Set
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Product, CatalogVersion, CatalogChange
+from services.shared_cache import get_shared_cache
+from services.metrics import record_cache_lookups
+
+# Cache settings (overridable from the environment)
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "10000"))
+CATALOG_VERSION_CHECK_INTERVAL = float(os.getenv("CATALOG_VERSION_CHECK_INTERVAL", "5"))
+CATALOG_WARM_SIZE = int(os.getenv("CATALOG_WARM_SIZE", "1000"))
+# Above this many changed products a version bump drops the whole cache
+CATALOG_TARGETED_INVALIDATION_LIMIT = int(os.getenv("CATALOG_TARGETED_INVALIDATION_LIMIT", "5000"))
+
+PRODUCT_COLUMNS = (Product.id, Product.name, Product.description, Product.price,
+                   Product.category, Product.stock_quantity)
+
+
+class ProductRecord:
+    """Read-only snapshot of a product row"""
+    __slots__ = ("id", "name", "description", "price", "category", "stock_quantity", "expires_at")
+
+    def __init__(self, id, name, description, price, category, stock_quantity, expires_at=0.0):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.price = price
+        self.category = category
+        self.stock_quantity = stock_quantity
+        self.expires_at = expires_at
+
+
+class CatalogCache:
+    """Read-through product cache shared by all requests of a worker (TTL + LRU bounded)"""
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL, max_size: int = CATALOG_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._records: "OrderedDict[int, ProductRecord]" = OrderedDict()
+        self._listings: Dict[int, Tuple[float, Tuple[int, ...]]] = {}
+        self.version: Optional[int] = None
+        self._version_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._listeners: List[Callable[[Optional[Set[int]]], None]] = []
+
+    def add_invalidation_listener(self, listener: Callable[[Optional[Set[int]]], None]):
+        """Call `listener(ids)` whenever cached products are invalidated (ids is None for everything)"""
+        self._listeners.append(listener)
+
+    async def _check_version(self, db: AsyncSession):
+        """Drop the products another process changed (or everything if unknown)"""
+        now = time.monotonic()
+        if now - self._version_checked_at < CATALOG_VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked_at = now
+        version = await db.scalar(select(CatalogVersion.version).where(CatalogVersion.id == 1))
+        if version != self.version:
+            if self.version is not None:
+                self.invalidate(await self._changed_since(db, self.version, version))
+            self.version = version
+
+    async def _changed_since(self, db: AsyncSession, old: int, new: Optional[int]) -> Optional[Set[int]]:
+        """Products changed between two versions, from the change log; None when it doesn't cover them all"""
+        if new is None or new < old:
+            return None
+        result = await db.execute(
+            select(CatalogChange.version, CatalogChange.entity_id)
+            .where(CatalogChange.entity == "product", CatalogChange.version > old, CatalogChange.version <= new)
+            .limit(CATALOG_TARGETED_INVALIDATION_LIMIT + 1)
+        )
+        rows = result.all()
+        # Bulk loads bump the version without logging ids, and old events get pruned
+        if len(rows) > CATALOG_TARGETED_INVALIDATION_LIMIT or {row.version for row in rows} != set(range(old + 1, new + 1)):
+            return None
+        return {row.entity_id for row in rows}
+
+    def _shared_key(self, kind: str, key) -> str:
+        # Keys carry the catalog version, so a bump orphans every shared entry at once
+        return f"catalog:{self.version}:{kind}:{key}"
+
+    def _store(self, row, now: float) -> ProductRecord:
+        record = ProductRecord(*row, expires_at=now + self.ttl)
+        self._records[record.id] = record
+        self._records.move_to_end(record.id)
+        if len(self._records) > self.max_size:
+            self._records.popitem(last=False)
+        return record
+
+    async def get_products(self, db: AsyncSession, ids: List[int]) -> List[ProductRecord]:
+        """Products by id in the given order, loading misses with one query"""
+        await self._check_version(db)
+        now = time.monotonic()
+        found: Dict[int, ProductRecord] = {}
+        missing = []
+        for product_id in ids:
+            record = self._records.get(product_id)
+            if record is not None and record.expires_at > now:
+                self._records.move_to_end(product_id)
+                found[product_id] = record
+                self.hits += 1
+            else:
+                missing.append(product_id)
+                self.misses += 1
+        record_cache_lookups("catalog", hits=len(found), misses=len(missing))
+
+        shared = get_shared_cache()
+        if missing and shared is not None:
+            # Rows another worker already loaded, fetched in one round trip
+            rows = await shared.get_many([self._shared_key("product", product_id) for product_id in missing])
+            for row in rows:
+                if row is not None:
+                    found[row[0]] = self._store(row, now)
+            missing = [product_id for product_id in missing if product_id not in found]
+
+        if missing:
+            result = await db.execute(select(*PRODUCT_COLUMNS).where(Product.id.in_(missing)))
+            loaded = [self._store(row, now) for row in result]
+            for record in loaded:
+                found[record.id] = record
+            if shared is not None and loaded:
+                await shared.set_many(
+                    {self._shared_key("product", record.id): self._row(record) for record in loaded},
+                    self.ttl
+                )
+
+        return [found[product_id] for product_id in ids if product_id in found]
+
+    async def get_listing(self, db: AsyncSession, limit: int) -> List[ProductRecord]:
+        """The first `limit` products, as shown for generic product questions"""
+        await self._check_version(db)
+        now = time.monotonic()
+        listing = self._listings.get(limit)
+        if listing is not None and listing[0] > now:
+            return await self.get_products(db, list(listing[1]))
+
+        self.misses += 1
+        record_cache_lookups("catalog_listing", misses=1)
+        shared = get_shared_cache()
+        if shared is not None:
+            ids = await shared.get(self._shared_key("listing", limit))
+            if ids is not None:
+                self._listings[limit] = (now + self.ttl, tuple(ids))
+                return await self.get_products(db, ids)
+
+        result = await db.execute(select(*PRODUCT_COLUMNS).limit(limit))
+        records = [self._store(row, now) for row in result]
+        self._listings[limit] = (now + self.ttl, tuple(record.id for record in records))
+        if shared is not None:
+            await shared.set_many({
+                self._shared_key("listing", limit): [record.id for record in records],
+                **{self._shared_key("product", record.id): self._row(record) for record in records}
+            }, self.ttl)
+        return records
+
+    @staticmethod
+    def _row(record: ProductRecord) -> list:
+        return [record.id, record.name, record.description, record.price,
+                record.category, record.stock_quantity]
+
+    async def warm(self, db: AsyncSession, limit: int = CATALOG_WARM_SIZE) -> int:
+        """Preload up to `limit` products before the worker serves traffic"""
+        await self._check_version(db)
+        now = time.monotonic()
+        result = await db.execute(select(*PRODUCT_COLUMNS).order_by(Product.id).limit(min(limit, self.max_size)))
+        for row in result:
+            self._store(row, now)
+        return len(self._records)
+
+    def invalidate(self, ids: Optional[Iterable[int]] = None):
+        """Forget the given products (and cached listings), or everything"""
+        self.invalidations += 1
+        self._listings.clear()
+        # Re-read the catalog version on the next lookup so shared keys move on too
+        self._version_checked_at = 0.0
+        if ids is None:
+            self._records.clear()
+        else:
+            ids = set(ids)
+            for product_id in ids:
+                self._records.pop(product_id, None)
+        for listener in self._listeners:
+            listener(ids)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._records),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "version": self.version
+        }
+
+
+catalog_cache = CatalogCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_products(session):
+    # Products written through the ORM in this process are dropped right away;
+    # other processes notice the catalog version bump
+    product_ids = session.info.pop("changed_product_ids", None)
+    if product_ids:
+        catalog_cache.invalidate(product_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_products(session):
+    session.info.pop("changed_product_ids", None)
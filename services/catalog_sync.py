@@ -0,0 +1,165 @@
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional, Tuple
+import pandas as pd
+from sqlalchemy import select, delete
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import Table
+from database import CatalogChange, record_catalog_changes
+from services.bulk_load import BulkUpserter, Key, lookup
+
+# Sync safety and housekeeping settings (overridable from the environment)
+# A source missing more than this share of existing rows is treated as a truncated export
+SYNC_MAX_DELETE_FRACTION = float(os.getenv("SYNC_MAX_DELETE_FRACTION", "0.5"))
+CATALOG_CHANGES_RETENTION_DAYS = int(os.getenv("CATALOG_CHANGES_RETENTION_DAYS", "7"))
+
+DELETE_BATCH_SIZE = 10000
+
+
+def fingerprint_rows(rows: pd.DataFrame, columns: List[str]) -> pd.Series:
+    """64-bit content hash per row over the given columns (stable across runs)"""
+    hashes = pd.util.hash_pandas_object(rows[columns], index=False)
+    return pd.Series(hashes.to_numpy().view("int64"), index=rows.index)
+
+
+def with_fingerprint(clean: Callable, insert_only: Tuple[str, ...] = ("created_at",)) -> Callable:
+    """Wrap a chunk cleaner so its rows carry source_hash over their content columns"""
+    def clean_with_fingerprint(conn: Connection, df: pd.DataFrame):
+        rows, rejected = clean(conn, df)
+        columns = [name for name in rows.columns if name not in ("id", "source_hash", *insert_only)]
+        rows = rows.assign(source_hash=fingerprint_rows(rows, columns))
+        return rows, rejected
+    return clean_with_fingerprint
+
+
+def _key_index(frame: pd.DataFrame, keys: List[str]) -> pd.Index:
+    if len(keys) == 1:
+        return pd.Index(frame[keys[0]], name=keys[0])
+    return pd.MultiIndex.from_frame(frame[keys])
+
+
+def _existing(conn: Connection, table: Table, keys: List[str]) -> pd.DataFrame:
+    """id and stored fingerprint of every row, indexed by the sync key"""
+    result = conn.execute(select(*[table.c[name] for name in keys], table.c.id, table.c.source_hash)).all()
+    stored = pd.DataFrame(result, columns=[*keys, "id", "source_hash"])
+    existing = pd.DataFrame(
+        {"id": pd.array(stored["id"], dtype="int64"), "source_hash": pd.array(stored["source_hash"], dtype="Int64")},
+        index=_key_index(stored, keys)
+    )
+    return existing[~existing.index.duplicated(keep="last")]
+
+
+def _referencing_columns(table: Table) -> list:
+    """Foreign key columns of other tables pointing at table.id (rows they use are never deleted)"""
+    return [
+        foreign_key.parent
+        for other in table.metadata.tables.values()
+        for foreign_key in other.foreign_keys
+        if foreign_key.column is table.c.id
+    ]
+
+
+def _delete_unreferenced(conn: Connection, table: Table, ids: List[int]) -> List[int]:
+    """Delete the given rows except those still referenced (e.g. by orders); returns the deleted ids"""
+    deleted = []
+    references = _referencing_columns(table)
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        batch = set(ids[start:start + DELETE_BATCH_SIZE])
+        for column in references:
+            batch -= set(conn.execute(select(column).where(column.in_(batch)).distinct()).scalars())
+        if batch:
+            conn.execute(delete(table).where(table.c.id.in_(batch)))
+            deleted.extend(batch)
+    return deleted
+
+
+def sync_frames(engine: Engine, label: str, table: Table, entity: Optional[str], frames: Iterable[pd.DataFrame],
+                clean: Callable, key: Key, insert_only: Tuple[str, ...] = ("created_at",),
+                delete_missing: bool = True) -> dict:
+    """Make `table` match a full source export, writing only the delta.
+
+    Every source row is fingerprinted and compared with the stored source_hash:
+    unchanged rows are skipped before touching the database, new and changed rows
+    are upserted in bulk, and rows whose key is missing from the source are deleted
+    (unless still referenced). Each chunk's changes are logged as `entity` change
+    events in the same transaction, which running workers turn into targeted cache
+    invalidation; tables no cache follows pass entity=None.
+    """
+    keys = [key] if isinstance(key, str) else list(key)
+    if entity is not None and len(keys) > 1:
+        raise ValueError("change events need a single-column sync key")
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0, "kept": 0,
+             "duplicates": 0, "rejected": 0, "changed_ids": set()}
+    clean = with_fingerprint(clean, insert_only)
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        with conn.begin():
+            existing = _existing(conn, table, keys)
+        seen = []
+        upserter = None
+        for raw in frames:
+            with conn.begin():
+                rows, rejected = clean(conn, raw)
+                keyed = rows.dropna(subset=keys)
+                rejected += len(rows) - len(keyed)
+                rows = keyed.drop_duplicates(subset=keys, keep="last")
+                duplicates = len(keyed) - len(rows)
+                seen.append(_key_index(rows, keys))
+
+                known = existing.reindex(_key_index(rows, keys))
+                is_new = known["id"].isna().to_numpy()
+                stored = known["source_hash"]
+                differs = ~is_new & (stored.isna().to_numpy()
+                                     | (stored.fillna(0).astype("int64").to_numpy() != rows["source_hash"].to_numpy()))
+                delta = rows[is_new | differs]
+
+                inserted = updated = 0
+                if not delta.empty:
+                    if upserter is None:
+                        columns = [name for name in delta.columns if name in table.c]
+                        upserter = BulkUpserter(conn, table, columns, key, insert_only)
+                    inserted, updated = upserter.upsert(delta)
+                    if entity is not None:
+                        new_keys = delta[keys[0]][is_new[is_new | differs]].dropna().unique()
+                        new_ids = lookup(conn, table.c[keys[0]], [table.c.id], new_keys)["id"].tolist()
+                        changed_ids = known["id"][differs].astype("int64").tolist()
+                        record_catalog_changes(conn, entity, {"insert": new_ids, "update": changed_ids})
+                        stats["changed_ids"].update(new_ids, changed_ids)
+
+            stats["rows"] += len(raw)
+            stats["inserted"] += inserted
+            stats["updated"] += updated
+            stats["unchanged"] += int(len(rows) - len(delta))
+            stats["duplicates"] += duplicates
+            stats["rejected"] += rejected
+            _report(label, stats, started)
+
+        with conn.begin():
+            if upserter is not None:
+                upserter.finish()
+            if delete_missing and stats["rows"]:
+                seen_keys = seen[0].append(seen[1:]) if seen else pd.Index([])
+                missing = existing["id"][~existing.index.isin(seen_keys)].tolist()
+                if missing and len(missing) > SYNC_MAX_DELETE_FRACTION * len(existing):
+                    print(f"  {label}: source is missing {len(missing):,} of {len(existing):,} rows; "
+                          f"not deleting (above SYNC_MAX_DELETE_FRACTION={SYNC_MAX_DELETE_FRACTION})")
+                elif missing:
+                    deleted = _delete_unreferenced(conn, table, missing)
+                    if entity is not None:
+                        record_catalog_changes(conn, entity, {"delete": deleted})
+                    stats["changed_ids"].update(deleted)
+                    stats["deleted"] = len(deleted)
+                    stats["kept"] = len(missing) - len(deleted)
+            conn.execute(delete(CatalogChange).where(
+                CatalogChange.changed_at < datetime.utcnow() - timedelta(days=CATALOG_CHANGES_RETENTION_DAYS)
+            ))
+        _report(label, stats, started)
+    return stats
+
+
+def _report(label: str, stats: dict, started: float):
+    elapsed = time.perf_counter() - started
+    print(f"  {label}: {stats['rows']:,} rows read, {stats['inserted']:,} new, {stats['updated']:,} updated, "
+          f"{stats['unchanged']:,} unchanged, {stats['deleted']:,} deleted, {stats['kept']:,} kept (referenced), "
+          f"{stats['duplicates']:,} duplicates merged, {stats['rejected']:,} rejected ({stats['rows'] / elapsed:,.0f} rows/s)")
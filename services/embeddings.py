@@ -0,0 +1,425 @@
+import os
+import re
+import zlib
+import asyncio
+import hashlib
+import threading
+from typing import List, Tuple, Iterable, Optional, Set
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Product, SessionLocal
+from services.search import STOPWORDS
+from services.catalog_cache import catalog_cache
+from services.log import get_logger
+
+# Embedding settings (overridable from the environment)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")  # e.g. a local sentence-transformers model
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+EMBEDDING_INDEX_PATH = os.getenv("EMBEDDING_INDEX_PATH", "data/product_vectors")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "512"))
+SEMANTIC_MIN_SCORE = float(os.getenv("SEMANTIC_MIN_SCORE", "0.3"))
+
+logger = get_logger("embeddings")
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashingEncoder:
+    """Deterministic feature-hashing encoder over words and character trigrams (no model needed)"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, stopwords=STOPWORDS):
+        self.dim = dim
+        self.stopwords = stopwords
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Iterable[Tuple[str, float]]:
+        for word in _WORD_RE.findall(text.lower()):
+            if word in self.stopwords:
+                continue
+            if len(word) > 3 and word.endswith("s"):
+                word = word[:-1]
+            yield "w:" + word, 1.0
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                yield "c:" + padded[i:i + 3], 0.3
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                # crc32 is stable across processes, unlike hash()
+                h = zlib.crc32(feature.encode())
+                vectors[row, h % self.dim] += weight if h & 0x80000000 else -weight
+        return normalize(vectors)
+
+
+class SentenceTransformerEncoder:
+    """Local sentence-transformers model, used when EMBEDDING_MODEL is set and installed"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self._model = SentenceTransformer(model_name)
+        self.dim = self._model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name}"
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self._model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def get_encoder():
+    if EMBEDDING_MODEL:
+        try:
+            return SentenceTransformerEncoder(EMBEDDING_MODEL)
+        except Exception as e:
+            logger.warning("Embedding model %s unavailable, using hashing encoder: %s", EMBEDDING_MODEL, e)
+    return HashingEncoder()
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def product_text(product) -> str:
+    return " ".join(part for part in (product.name, product.category, product.description) if part)
+
+
+def fingerprint(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+
+
+class VectorIndex:
+    """Unit vectors in a memory-mapped float32 matrix, with id and fingerprint sidecars.
+
+    A read-only index maps the files copy-on-write: updates stay in this process's
+    memory and save() is a no-op, so only one process ever writes the files.
+    """
+
+    def __init__(self, path: str, dim: int, encoder_name: str, writable: bool = True):
+        self.path = path
+        self.dim = dim
+        self.encoder_name = encoder_name
+        self.writable = writable
+        self.count = 0  # rows in use, including deleted ones awaiting reuse
+        self.ids = np.empty(0, dtype=np.int64)  # -1 marks a deleted row
+        self.fingerprints = np.empty(0, dtype=np.uint64)
+        self._vectors: Optional[np.memmap] = None
+        self._rows = {}
+        self._free: List[int] = []
+        self._loaded_mtime: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def vectors_path(self) -> str:
+        return f"{self.path}.f32"
+
+    @property
+    def meta_path(self) -> str:
+        return f"{self.path}.meta.npz"
+
+    def _meta_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.meta_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def stale(self) -> bool:
+        """True when the writer saved the index since this process loaded it"""
+        return self._meta_mtime() != self._loaded_mtime
+
+    def load(self) -> bool:
+        """Open the index on disk; returns False if missing or built by another encoder"""
+        if not (os.path.exists(self.meta_path) and os.path.exists(self.vectors_path)):
+            return False
+        self._loaded_mtime = self._meta_mtime()
+        meta = np.load(self.meta_path)
+        if int(meta["dim"]) != self.dim or str(meta["encoder"]) != self.encoder_name:
+            return False
+
+        with self._lock:
+            self.ids = meta["ids"].copy()
+            self.fingerprints = meta["fingerprints"].copy()
+            self.count = int(meta["count"])
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+" if self.writable else "c",
+                                      shape=(len(self.ids), self.dim))
+            self._rows = {int(product_id): row for row, product_id in enumerate(self.ids[:self.count]) if product_id >= 0}
+            self._free = [row for row in range(self.count) if self.ids[row] < 0]
+        return True
+
+    def save(self):
+        if not self.writable:
+            return
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            os.makedirs(os.path.dirname(self.meta_path) or ".", exist_ok=True)
+            tmp_path = f"{self.meta_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, ids=self.ids, fingerprints=self.fingerprints, count=self.count,
+                         dim=self.dim, encoder=self.encoder_name)
+            os.replace(tmp_path, self.meta_path)
+
+    def _ensure_capacity(self, rows: int):
+        capacity = len(self.ids)
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, capacity * 2, 1024)
+        if self.writable:
+            self._grow_file(new_capacity)
+        else:
+            # Read-only indexes grow in memory and leave the files alone
+            vectors = np.zeros((new_capacity, self.dim), dtype=np.float32)
+            if self._vectors is not None:
+                vectors[:capacity] = self._vectors
+            self._vectors = vectors
+        self.ids = np.concatenate([self.ids, np.full(new_capacity - capacity, -1, dtype=np.int64)])
+        self.fingerprints = np.concatenate([self.fingerprints, np.zeros(new_capacity - capacity, dtype=np.uint64)])
+
+    def _grow_file(self, new_capacity: int):
+        os.makedirs(os.path.dirname(self.vectors_path) or ".", exist_ok=True)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        # Growing the file zero-fills the new rows
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+",
+                                  shape=(new_capacity, self.dim))
+
+    def fingerprint_of(self, product_id: int) -> Optional[int]:
+        row = self._rows.get(product_id)
+        return None if row is None else int(self.fingerprints[row])
+
+    def product_ids(self) -> Set[int]:
+        return set(self._rows)
+
+    def upsert(self, ids: List[int], vectors: np.ndarray, fingerprints: List[int]):
+        with self._lock:
+            new_rows = sum(1 for product_id in ids if product_id not in self._rows)
+            self._ensure_capacity(self.count + max(0, new_rows - len(self._free)))
+            for product_id, vector, fp in zip(ids, vectors, fingerprints):
+                row = self._rows.get(product_id)
+                if row is None:
+                    if self._free:
+                        row = self._free.pop()
+                    else:
+                        row = self.count
+                        self.count += 1
+                    self._rows[product_id] = row
+                    self.ids[row] = product_id
+                self._vectors[row] = vector
+                self.fingerprints[row] = fp
+
+    def remove(self, ids: Iterable[int]):
+        with self._lock:
+            for product_id in ids:
+                row = self._rows.pop(product_id, None)
+                if row is not None:
+                    self.ids[row] = -1
+                    self._vectors[row] = 0
+                    self._free.append(row)
+
+    def search(self, queries: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        """Top-k cosine matches for each query vector (one matrix product for the batch)"""
+        with self._lock:
+            if not self._rows:
+                return [[] for _ in range(len(queries))]
+            ids = self.ids[:self.count]
+            scores = queries @ self._vectors[:self.count].T
+        scores[:, ids < 0] = -np.inf
+
+        k = min(k, len(self._rows))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query_scores, candidates in zip(scores, top):
+            ranked = candidates[np.argsort(-query_scores[candidates])]
+            results.append([(int(ids[row]), float(query_scores[row])) for row in ranked])
+        return results
+
+
+class ProductEmbeddings:
+    """Embedding pipeline over the product catalog with incremental index updates.
+
+    Serving workers set `writable = False`: the launcher (or load_data.py) is the
+    only process that writes the index, and workers reload it when it changes.
+    """
+
+    def __init__(self, encoder=None, path: str = EMBEDDING_INDEX_PATH, writable: bool = True):
+        self._encoder = encoder
+        self.path = path
+        self.writable = writable
+        self._index: Optional[VectorIndex] = None
+        self._dirty: Set[int] = set()
+        self._build: Optional[asyncio.Task] = None
+        self._resync: Optional[asyncio.Task] = None
+        self._resync_needed = False
+        self._dirty_lock = threading.Lock()
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = get_encoder()
+        return self._encoder
+
+    @property
+    def index(self) -> VectorIndex:
+        if self._index is None:
+            self._index = self._open()
+        return self._index
+
+    def _open(self) -> VectorIndex:
+        index = VectorIndex(self.path, self.encoder.dim, self.encoder.name, writable=self.writable)
+        index.load()
+        return index
+
+    def _reload(self):
+        index = self._open()
+        # An index saved by the writer replaces this process's copy, unless it is
+        # still missing or was built by another encoder
+        if index.count:
+            self._index = index
+
+    def mark_dirty(self, product_id: int):
+        with self._dirty_lock:
+            self._dirty.add(product_id)
+
+    def mark_changed(self, ids: Optional[Set[int]]):
+        """Catalog change event: re-embed these products, or re-sync everything when ids is None"""
+        if ids is None:
+            self._resync_needed = True
+            return
+        with self._dirty_lock:
+            self._dirty.update(ids)
+
+    def _take_dirty(self) -> List[int]:
+        with self._dirty_lock:
+            dirty, self._dirty = list(self._dirty), set()
+        return dirty
+
+    def _embed(self, batch: List[Tuple[int, str, int]]):
+        ids, texts, fingerprints = zip(*batch)
+        self.index.upsert(list(ids), self.encoder.encode(list(texts)), list(fingerprints))
+
+    def sync(self, db: Session, batch_size: int = EMBEDDING_BATCH_SIZE, ids: Optional[Iterable[int]] = None) -> int:
+        """Embed new or changed products and drop deleted ones; returns the number embedded.
+
+        With `ids` (e.g. from a catalog sync) only those products are checked, unless
+        the index is still empty.
+        """
+        index = self.index
+        seen = set()
+        batch = []
+        embedded = 0
+        query = select(Product.id, Product.name, Product.category, Product.description)
+        if ids is not None and index.count:
+            ids = set(ids)
+            id_list = sorted(ids)
+            # Batched below the bind-parameter limit
+            rows = (row for start in range(0, len(id_list), 10000)
+                    for row in db.execute(query.where(Product.id.in_(id_list[start:start + 10000]))))
+        else:
+            ids = None
+            rows = db.execute(query.execution_options(yield_per=10000))
+        for row in rows:
+            seen.add(row.id)
+            text = product_text(row)
+            fp = fingerprint(text)
+            # Unchanged products keep their stored vector
+            if index.fingerprint_of(row.id) != fp:
+                batch.append((row.id, text, fp))
+            if len(batch) >= batch_size:
+                self._embed(batch)
+                embedded += len(batch)
+                batch = []
+        if batch:
+            self._embed(batch)
+            embedded += len(batch)
+
+        index.remove((index.product_ids() if ids is None else ids) - seen)
+        index.save()
+        return embedded
+
+    def _build_from_database(self):
+        db = SessionLocal()
+        try:
+            embedded = self.sync(db)
+            logger.info("Product vector index ready (%d products embedded)", embedded)
+        except Exception:
+            logger.exception("Product vector index build failed")
+        finally:
+            db.close()
+
+    async def refresh(self, db: AsyncSession):
+        """Re-embed products written in this process or reported by change events since the last refresh"""
+        if not self.writable and self.index.stale():
+            await asyncio.to_thread(self._reload)
+        if self._resync_needed and (self._resync is None or self._resync.done()):
+            # Changes without ids (e.g. a bulk load): re-check every fingerprint off the event loop
+            self._resync_needed = False
+            self._resync = asyncio.create_task(asyncio.to_thread(self._build_from_database))
+        dirty = self._take_dirty()
+        if not dirty:
+            return
+        result = await db.execute(
+            select(Product.id, Product.name, Product.category, Product.description)
+            .where(Product.id.in_(dirty))
+        )
+        batch = [(row.id, product_text(row), fingerprint(product_text(row))) for row in result]
+        if batch:
+            await asyncio.to_thread(self._embed, batch)
+        self.index.remove(set(dirty) - {product_id for product_id, _, _ in batch})
+        await asyncio.to_thread(self.index.save)
+
+    def _ready(self) -> bool:
+        if self.index.count:
+            return True
+        # First use with no index on disk: build it off the event loop
+        if self._build is None:
+            self._build = asyncio.create_task(asyncio.to_thread(self._build_from_database))
+        return self._build.done()
+
+    async def warm(self):
+        """Load the index from disk (or build it) before the first search"""
+        await asyncio.to_thread(lambda: self.index)
+        if not self._ready():
+            await self._build
+
+    def search_batch(self, messages: List[str], k: int) -> List[List[Tuple[int, float]]]:
+        return self.index.search(self.encoder.encode(messages), k)
+
+    async def search_ids(self, db: AsyncSession, message: str, limit: int = 5,
+                         min_score: float = SEMANTIC_MIN_SCORE) -> List[int]:
+        """Ids of the products whose embedding is closest to the message, best first"""
+        if not self._ready():
+            return []
+        await self.refresh(db)
+
+        hits = (await asyncio.to_thread(self.search_batch, [message], limit))[0]
+        return [product_id for product_id, score in hits if score >= min_score]
+
+
+product_embeddings = ProductEmbeddings()
+
+
+# Product writes through the ORM mark the product for re-embedding
+@event.listens_for(Product, "after_insert")
+@event.listens_for(Product, "after_update")
+@event.listens_for(Product, "after_delete")
+def _mark_product_dirty(mapper, connection, target):
+    product_embeddings.mark_dirty(target.id)
+
+
+# Changes made by other processes arrive through the catalog cache's change events
+catalog_cache.add_invalidation_listener(product_embeddings.mark_changed)
+
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        print(f"Embedded {product_embeddings.sync(db)} products into {EMBEDDING_INDEX_PATH}")
+    finally:
+        db.close()
@@ -0,0 +1,231 @@
+import os
+import re
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Product
+from services.catalog_cache import catalog_cache
+
+# Product names kept for entity matching per worker; larger catalogs rely on search alone
+INTENT_MAX_PRODUCT_NAMES = int(os.getenv("INTENT_MAX_PRODUCT_NAMES", "200000"))
+# Longer names are still found by product search, just not as entities
+MAX_NAME_WORDS = 6
+MAX_ORDER_IDS = 5
+MAX_PRODUCT_ENTITIES = 5
+
+# Keywords per intent, matched as whole words ("order" no longer fires on "border")
+INTENT_KEYWORDS = {
+    "product": ("product", "products", "item", "items"),
+    "purchase": ("buy", "buying", "bought", "purchase", "purchases", "purchased", "purchasing"),
+    "price": ("price", "prices", "pricing", "cost", "costs", "how much"),
+    "stock": ("stock", "in stock", "out of stock"),
+    "order": ("order", "orders", "ordered", "ordering"),
+    "customer": ("customer", "customers"),
+    "greeting": ("hello", "hi", "hey"),
+}
+# Any of these makes a message an e-commerce question (worth the profile and a product listing)
+ECOMMERCE_INTENTS = frozenset({"product", "purchase", "price", "stock", "order", "customer"})
+# Generic product questions that get a short listing when nothing specific matches
+LISTING_INTENTS = frozenset({"product", "purchase", "price"})
+
+_AMOUNT = r"\$?\s*(\d+(?:\.\d+)?)"
+# Order ids and price ranges in one alternation, run on the lowercased message and only
+# when it contains digits. The lookahead lists the first characters of the branches, so
+# most positions are rejected before any branch is tried
+_ENTITY_RE = re.compile(
+    "(?=[#$abclmou])(?:" + "|".join([
+        # "order #123", "order no. 123", "order number 123", or "order 123" unless a word
+        # follows the number ("order 2 mugs" is a quantity)
+        r"(?P<order_id>\border\s*(?:(?:#|no\.?|number)\s*(\d+)\b|(\d+)\b(?!\s*[a-z])))",
+        r"(?P<hash_id>#(\d+)\b)",
+        rf"(?P<between>\bbetween\s+{_AMOUNT}\s+and\s+{_AMOUNT})",
+        rf"(?P<span>\$\s*(\d+(?:\.\d+)?)\s*(?:-|to)\s*{_AMOUNT})",
+        rf"(?P<below>\b(?:under|below|less than|cheaper than|up to|at most|max(?:imum)?)\s+{_AMOUNT})",
+        rf"(?P<above>\b(?:over|above|more than|at least|min(?:imum)?)\s+{_AMOUNT})",
+    ]) + ")"
+)
+_DIGIT_RE = re.compile(r"\d")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(_WORD_RE.findall(name.lower()))
+
+
+class Classification:
+    """Intents of one message and the entities mentioned in it"""
+    __slots__ = ("intents", "order_ids", "price_range", "product_ids")
+
+    def __init__(self, intents: FrozenSet[str], order_ids: List[int],
+                 price_range: Optional[Tuple[Optional[float], Optional[float]]], product_ids: List[int]):
+        self.intents = intents
+        self.order_ids = order_ids
+        # (min, max) with None for an open end
+        self.price_range = price_range
+        self.product_ids = product_ids
+
+    @property
+    def is_ecommerce(self) -> bool:
+        return not self.intents.isdisjoint(ECOMMERCE_INTENTS)
+
+    @property
+    def wants_listing(self) -> bool:
+        return not self.intents.isdisjoint(LISTING_INTENTS)
+
+    def in_price_range(self, price: float) -> bool:
+        if self.price_range is None:
+            return True
+        low, high = self.price_range
+        return (low is None or price >= low) and (high is None or price <= high)
+
+
+class IntentClassifier:
+    """Rule-based intent and entity extraction, compiled once per worker.
+
+    The message is split into words once; keywords and catalog product names
+    are found by looking up word n-grams (only those starting with a known
+    first word), and order ids and price ranges by one precompiled regex when
+    the message has digits. Names are kept current through catalog change events.
+    """
+
+    def __init__(self, max_names: int = INTENT_MAX_PRODUCT_NAMES):
+        self.max_names = max_names
+        self._keywords: Dict[str, str] = {
+            normalize_name(keyword): intent for intent, keywords in INTENT_KEYWORDS.items() for keyword in keywords
+        }
+        self._names: Dict[str, int] = {}
+        self._names_by_id: Dict[int, str] = {}
+        # Longest keyword or name starting with each word: most words start nothing,
+        # so they cost one dict lookup
+        self._starts: Dict[str, int] = {}
+        self._reload_needed = False
+        self._dirty: Set[int] = set()
+        self._dirty_lock = threading.Lock()
+        self._index_phrases(self._keywords)
+
+    def _index_phrases(self, phrases: Iterable[str]):
+        for phrase in phrases:
+            words = phrase.split(" ")
+            if self._starts.get(words[0], 0) < len(words):
+                self._starts[words[0]] = len(words)
+
+    def classify(self, message: str) -> Classification:
+        intents = set()
+        product_ids: List[int] = []
+        message = message.lower()
+        words = _WORD_RE.findall(message)
+        position = 0
+        # Longest keyword or product name at each position, like a word-level trie
+        while position < len(words):
+            longest = self._starts.get(words[position])
+            length = 1
+            if longest is not None:
+                for length in range(min(longest, len(words) - position), 0, -1):
+                    phrase = " ".join(words[position:position + length]) if length > 1 else words[position]
+                    intent = self._keywords.get(phrase)
+                    if intent is not None:
+                        intents.add(intent)
+                        break
+                    product_id = self._names.get(phrase)
+                    if product_id is not None:
+                        if product_id not in product_ids and len(product_ids) < MAX_PRODUCT_ENTITIES:
+                            product_ids.append(product_id)
+                        break
+            position += length
+        if product_ids:
+            intents.add("product")
+
+        order_ids: List[int] = []
+        price_range = None
+        if _DIGIT_RE.search(message):
+            order_ids, price_range = self._entities(message, intents)
+        return Classification(frozenset(intents), order_ids, price_range, product_ids)
+
+    def _entities(self, message: str, intents: set) -> tuple:
+        """Order ids and the price range mentioned in a message"""
+        order_ids: List[int] = []
+        low = high = None
+        for match in _ENTITY_RE.finditer(message):
+            kind = match.lastgroup
+            # Numbers captured inside the matched branch (groups of other branches are None)
+            values = [value for value in match.groups()[match.lastindex:] if value is not None]
+            if kind in ("order_id", "hash_id"):
+                intents.add("order")
+                order_id = int(values[0])
+                if order_id not in order_ids and len(order_ids) < MAX_ORDER_IDS:
+                    order_ids.append(order_id)
+                continue
+            intents.add("price")
+            amounts = [float(value) for value in values]
+            if kind in ("between", "span"):
+                low, high = min(amounts[:2]), max(amounts[:2])
+            elif kind == "below":
+                high = amounts[0]
+            else:
+                low = amounts[0]
+        price_range = (low, high) if low is not None or high is not None else None
+        return order_ids, price_range
+
+    def load_names(self, rows: Iterable[Tuple[int, str]]):
+        """Replace the product names matched as entities"""
+        self._names.clear()
+        self._names_by_id.clear()
+        self._starts.clear()
+        self._index_phrases(self._keywords)
+        self._add_names(rows)
+
+    def _add_names(self, rows: Iterable[Tuple[int, str]]):
+        for product_id, name in rows:
+            if len(self._names) >= self.max_names:
+                break
+            key = normalize_name(name or "")
+            words = key.count(" ") + 1
+            if not key or words > MAX_NAME_WORDS:
+                continue
+            # Duplicate names keep the first (lowest id) product
+            self._names.setdefault(key, product_id)
+            self._names_by_id[product_id] = key
+            self._index_phrases((key,))
+
+    def _remove_names(self, ids: Iterable[int]):
+        for product_id in ids:
+            key = self._names_by_id.pop(product_id, None)
+            if key is not None and self._names.get(key) == product_id:
+                del self._names[key]
+
+    def mark_changed(self, ids: Optional[Set[int]]):
+        """Catalog change event: re-read these products' names, or all of them when ids is None"""
+        if ids is None:
+            self._reload_needed = True
+            return
+        with self._dirty_lock:
+            self._dirty.update(ids)
+
+    async def warm(self, db: AsyncSession) -> int:
+        """Load the catalog's product names; returns how many are matched as entities"""
+        result = await db.execute(select(Product.id, Product.name).order_by(Product.id).limit(self.max_names))
+        self.load_names(result.all())
+        return len(self._names)
+
+    async def refresh(self, db: AsyncSession):
+        """Apply catalog changes reported since the last refresh"""
+        if self._reload_needed:
+            self._reload_needed = False
+            with self._dirty_lock:
+                self._dirty.clear()
+            await self.warm(db)
+            return
+        with self._dirty_lock:
+            dirty, self._dirty = list(self._dirty), set()
+        if not dirty:
+            return
+        result = await db.execute(select(Product.id, Product.name).where(Product.id.in_(dirty)))
+        self._remove_names(dirty)
+        self._add_names(result.all())
+
+
+intent_classifier = IntentClassifier()
+
+# Product renames and deletions arrive through the catalog cache's change events
+catalog_cache.add_invalidation_listener(intent_classifier.mark_changed)
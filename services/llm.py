@@ -1,89 +1,181 @@
 import os
-from groq import Groq
-from sqlalchemy.orm import Session
-from database import Product, Customer, Order
-from typing import Optional
+import time
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, List, Dict, AsyncIterator
 from dotenv import load_dotenv
+from services.providers import get_provider, DEFAULT_MODEL, CONTEXT_HEADER, SUMMARY_HEADER
+from services.llm_router import LLMUnavailableError, answer_cacheable
+from services.memory import ConversationWindow
+from services.intents import Classification, intent_classifier
+from services.retrieval import RetrievalResult, retrieve_context, product_context, order_context
+from services.response_cache import response_cache
+from services.tracing import span
+from services.log import get_logger
 
 # Load environment variables
 load_dotenv()
 
-# Debug: Check if API key is loaded
-api_key = os.getenv("GROQ_API_KEY")
-print(f"Debug: API key loaded: {'Yes' if api_key else 'No'}")
-if api_key:
-    print(f"Debug: API key starts with: {api_key[:10]}...")
+logger = get_logger("llm")
 
-# Initialize Groq client with error handling
-try:
-    if not api_key:
-        raise ValueError("GROQ_API_KEY not found in environment variables")
-    
-    client = Groq(api_key=api_key)
-    print("✅ Groq client initialized successfully")
-except Exception as e:
-    print(f"❌ Groq client initialization failed: {e}")
-    client = None
+# Never log any part of the key itself
+logger.info("GROQ_API_KEY %s", "loaded" if os.getenv("GROQ_API_KEY") else "not set")
 
-async def get_ai_response(user_message: str, conversation_id: int, db: Session) -> str:
-    try:
-        if not client:
-            return "I apologize, but the AI service is currently unavailable. Please check your API configuration."
-        
-        # Check if message is e-commerce related
-        ecommerce_keywords = ["product", "order", "buy", "purchase", "price", "stock", "customer"]
-        is_ecommerce_query = any(keyword in user_message.lower() for keyword in ecommerce_keywords)
-        
-        system_prompt = """You are a helpful AI assistant for an e-commerce platform. 
+# Async LLM provider router (pooled clients, retries, hedging and fallbacks)
+provider = get_provider()
+
+SYSTEM_PROMPT = """You are a helpful AI assistant for an e-commerce platform. 
         You can help users with product information, orders, and general questions.
         If you need more information to provide a helpful answer, ask clarifying questions.
         Be concise and friendly in your responses."""
+
+class PreparedPrompt:
+    """Messages for the LLM plus how long each pre-LLM stage took"""
+    __slots__ = ("messages", "classification", "retrieval", "timings", "cacheable")
+
+    def __init__(self, messages: List[Dict[str, str]], classification: Classification,
+                 retrieval: RetrievalResult, timings: Dict[str, float]):
+        self.messages = messages
+        self.classification = classification
+        self.retrieval = retrieval
+        # Answers about one customer's orders are never reused by anyone else; keep
+        # them from evicting shared entries
+        self.cacheable = "order" not in classification.intents
+        # Milliseconds per stage: classify, each context source, retrieval (wall time) and prompt_build
+        self.timings = timings
+
+async def prepare_prompt(user_message: str, conversation_id: int, user_id: Optional[int] = None) -> PreparedPrompt:
+    """Run the pre-LLM pipeline: classify, retrieve context concurrently, assemble the prompt"""
+    started = time.perf_counter()
+    # Intents and entities (product names, order ids, price ranges) in one pass
+    classification = intent_classifier.classify(user_message)
+    classified = time.perf_counter()
+    
+    with span("context_retrieval", intents=",".join(sorted(classification.intents))) as stage:
+        retrieval = await retrieve_context(user_message, conversation_id, user_id, classification)
+        if stage is not None:
+            stage.set(degraded=",".join(retrieval.degraded))
+    
+    with span("prompt_build"):
+        assembled = time.perf_counter()
+        system_prompt = SYSTEM_PROMPT
+        context = "\n\n".join(
+            part for part in (retrieval.value(name) for name in ("profile", "products", "orders")) if part
+        )
+        if context:
+            system_prompt += f"\n\n{CONTEXT_HEADER}\n{context}"
         
-        context = ""
-        if is_ecommerce_query:
-            context = get_ecommerce_context(user_message, db)
-            if context:
-                system_prompt += f"\n\nHere's relevant information from our database:\n{context}"
+        # A conversation that couldn't be loaded in time is answered without its history
+        window = retrieval.value("history") or ConversationWindow()
+        if window.summary:
+            system_prompt += f"\n\n{SUMMARY_HEADER}\n{window.summary}"
+        history = window.to_chat_messages()
+        current = {"role": "user", "content": user_message}
+        if not history or history[-1] != current:
+            history.append(current)
+    
+    timings = {"classify": round((classified - started) * 1000, 2)}
+    timings.update(retrieval.timings)
+    timings["prompt_build"] = round((time.perf_counter() - assembled) * 1000, 2)
+    messages = [{"role": "system", "content": system_prompt}] + history
+    return PreparedPrompt(messages, classification, retrieval, timings)
+
+async def build_messages(user_message: str, conversation_id: int, db: AsyncSession,
+                         user_id: Optional[int] = None) -> List[Dict[str, str]]:
+    """Build the chat messages sent to the LLM for a user message"""
+    return (await prepare_prompt(user_message, conversation_id, user_id)).messages
+
+async def get_ai_response(user_message: str, conversation_id: int, db: AsyncSession,
+                          user_id: Optional[int] = None) -> str:
+    """Answer a user message; raises LLMUnavailableError when no provider could answer"""
+    if not provider:
+        raise LLMUnavailableError("AI service is currently unavailable. Please check your API configuration.")
+    try:
         
-        print(f"Debug: Sending request to Groq with message: {user_message[:50]}...")
+        # End the caller's transaction so its pooled connection isn't held while the LLM runs
+        await db.commit()
+        prompt = await prepare_prompt(user_message, conversation_id, user_id)
+        messages = prompt.messages
+        logger.debug("Prompt ready in %.1f ms", prompt.retrieval.elapsed_ms,
+                     extra={"conversation_id": conversation_id, "timings_ms": prompt.timings})
         
-        response = client.chat.completions.create(
-            model="llama3-8b-8192",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
+        # Repeated questions with the same context are answered from the cache
+        cached = None
+        if prompt.cacheable:
+            with span("response_cache") as stage:
+                cached = await response_cache.get(messages, DEFAULT_MODEL, max_tokens=500, temperature=0.7)
+                if stage is not None:
+                    stage.set(hit=cached is not None)
+        if cached is not None:
+            return cached
+        
+        logger.debug("Sending request to %s: %.50s", provider.name, user_message,
+                     extra={"provider": provider.name, "conversation_id": conversation_id})
+        
+        with span("llm_call", provider=provider.name, model=DEFAULT_MODEL):
+            ai_response = await provider.complete(
+                messages=messages,
+                model=DEFAULT_MODEL,
+                max_tokens=500,
+                temperature=0.7
+            )
         
-        ai_response = response.choices[0].message.content
-        print(f"Debug: Received response from Groq: {ai_response[:50]}...")
+        logger.debug("Received response from %s: %.50s", provider.name, ai_response,
+                     extra={"provider": provider.name, "conversation_id": conversation_id})
+        # Fallback answers from the rule-based provider aren't worth keeping
+        if prompt.cacheable and answer_cacheable():
+            await response_cache.put(messages, DEFAULT_MODEL, ai_response, product_ids=prompt.retrieval.product_ids,
+                                     max_tokens=500, temperature=0.7)
         return ai_response
         
-    except Exception as e:
-        print(f"Debug: Error in get_ai_response: {e}")
-        return f"I apologize, but I'm having trouble processing your request right now. Error: {str(e)}"
+    except Exception:
+        # Failures are reported to the caller instead of being saved as the AI's answer
+        logger.exception("get_ai_response failed", extra={"conversation_id": conversation_id})
+        raise
 
-def get_ecommerce_context(message: str, db: Session) -> str:
-    """Get relevant e-commerce data based on user message"""
-    context_parts = []
+async def stream_ai_response(user_message: str, conversation_id: int, db: AsyncSession,
+                             user_id: Optional[int] = None) -> AsyncIterator[str]:
+    """Stream the AI response token by token; errors propagate to the caller"""
+    if not provider:
+        raise LLMUnavailableError("AI service is currently unavailable. Please check your API configuration.")
     
-    # Search for products
-    if any(word in message.lower() for word in ["product", "item", "buy", "price"]):
-        products = db.query(Product).limit(5).all()
-        if products:
-            context_parts.append("Available products:")
-            for product in products:
-                context_parts.append(f"- {product.name}: ${product.price} ({product.stock_quantity} in stock)")
+    # Streams can last many seconds; don't keep a pooled connection for all of them
+    await db.commit()
+    prompt = await prepare_prompt(user_message, conversation_id, user_id)
+    messages = prompt.messages
+    logger.debug("Prompt ready in %.1f ms", prompt.retrieval.elapsed_ms,
+                 extra={"conversation_id": conversation_id, "timings_ms": prompt.timings})
     
-    # Search for order information
-    if "order" in message.lower():
-        recent_orders = db.query(Order).limit(3).all()
-        if recent_orders:
-            context_parts.append("\nRecent orders:")
-            for order in recent_orders:
-                context_parts.append(f"- Order #{order.id}: {order.quantity} items, ${order.total_amount}")
+    cached = None
+    if prompt.cacheable:
+        with span("response_cache") as stage:
+            cached = await response_cache.get(messages, DEFAULT_MODEL, max_tokens=500, temperature=0.7)
+            if stage is not None:
+                stage.set(hit=cached is not None)
+    if cached is not None:
+        yield cached
+        return
     
-    return "\n".join(context_parts)
+    chunks = []
+    with span("llm_call", provider=provider.name, model=DEFAULT_MODEL, stream=True) as stage:
+        async for chunk in provider.stream(
+            messages=messages,
+            model=DEFAULT_MODEL,
+            max_tokens=500,
+            temperature=0.7
+        ):
+            chunks.append(chunk)
+            yield chunk
+        if stage is not None:
+            stage.set(chunks=len(chunks))
+    if prompt.cacheable and answer_cacheable():
+        await response_cache.put(messages, DEFAULT_MODEL, "".join(chunks), product_ids=prompt.retrieval.product_ids,
+                                 max_tokens=500, temperature=0.7)
 
+async def get_ecommerce_context(message: str, db: AsyncSession, include_listing: bool = True,
+                                user_id: Optional[int] = None) -> str:
+    """Get relevant e-commerce data based on user message (sequentially, on one session)"""
+    classification = intent_classifier.classify(message)
+    context_parts = [await product_context(message, db, include_listing, classification)]
+    if "order" in classification.intents:
+        context_parts.append(await order_context(message, db, user_id, classification))
+    return "\n\n".join(part for part in context_parts if part)
@@ -0,0 +1,560 @@
+import os
+import json
+import time
+import random
+import asyncio
+from collections import deque
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import httpx
+from dotenv import load_dotenv
+from services.providers import LLMProvider, DEFAULT_MODEL, LLM_PROVIDER, LLM_TIMEOUT, LLM_MAX_RETRIES
+from services.metrics import LLM_RETRIES, LLM_HEDGES, LLM_FALLBACKS, LLM_CIRCUIT_OPEN, LLM_COALESCED
+from services.tracing import span
+from services.log import get_logger
+
+load_dotenv()
+
+# Providers tried in order: "groq", "local" (OpenAI-compatible server), "stub" or "rules"
+# (canned answers from the retrieved context, never fails)
+LLM_PROVIDERS = [name.strip() for name in os.getenv("LLM_PROVIDERS", f"{LLM_PROVIDER},rules").split(",")
+                 if name.strip()]
+# Whole routed call, retries and fallbacks included; then only "rules" is still tried
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", str(LLM_TIMEOUT)))
+
+# Retries per provider with full-jitter exponential backoff
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.2"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "2.0"))
+
+# A provider slower than this percentile of its recent latencies gets a hedged duplicate (0 disables)
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.25"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+# Hedges allowed per routed call, so a slow provider never sees twice the load
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+
+# Consecutive transient failures that open a provider's circuit, and seconds until it is probed again
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+# Identical calls (model, messages, params) made while one is in flight share it,
+# up to LLM_COALESCE_MAX_FANOUT callers per upstream call
+LLM_COALESCE = os.getenv("LLM_COALESCE", "true").lower() == "true"
+LLM_COALESCE_MAX_FANOUT = int(os.getenv("LLM_COALESCE_MAX_FANOUT", "100"))
+
+logger = get_logger("llm_router")
+
+# The provider that answered the latest routed call of this request
+_answered_by: ContextVar[Optional[LLMProvider]] = ContextVar("llm_answered_by", default=None)
+
+
+class LLMUnavailableError(RuntimeError):
+    """Every configured provider failed or was out of time"""
+
+
+def is_transient(error: BaseException) -> bool:
+    """Timeouts, connection failures, rate limits and server errors are worth a retry"""
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    # The Groq SDK's connection errors don't derive from httpx's
+    if type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+def answer_cacheable() -> bool:
+    """Whether the latest answer came from a provider whose answers may be cached"""
+    provider = _answered_by.get()
+    return provider is None or provider.cacheable
+
+
+class CircuitBreaker:
+    """Closed: calls pass. Open: calls are refused until `reset_timeout` has passed.
+    Half-open: one probe call decides whether to close or open again."""
+
+    def __init__(self, name: str, failure_threshold: int = LLM_BREAKER_FAILURES,
+                 reset_timeout: float = LLM_BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self._probing = False
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("Circuit for %s closed", self.name)
+            LLM_CIRCUIT_OPEN.labels(self.name).set(0)
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning("Circuit for %s opened after %d failures", self.name, self.failures)
+                LLM_CIRCUIT_OPEN.labels(self.name).set(1)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """A call let through was cancelled before it could tell anything"""
+        self._probing = False
+
+
+class LatencyWindow:
+    """Recent latencies of one provider, for the hedging threshold"""
+
+    def __init__(self, size: int = LLM_HEDGE_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._threshold: Optional[float] = None
+        self._stale = 0
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+        self._stale += 1
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if len(self._samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        # Re-sorting every tenth sample is plenty for a threshold
+        if self._threshold is None or self._stale >= 10:
+            ordered = sorted(self._samples)
+            self._threshold = ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+            self._stale = 0
+        return self._threshold
+
+
+class Backend:
+    """A provider with its circuit breaker and latency history"""
+    __slots__ = ("provider", "breaker", "latency", "first_chunk")
+
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self.breaker = CircuitBreaker(provider.name)
+        self.latency = LatencyWindow()
+        # Streams are hedged on time to first chunk
+        self.first_chunk = LatencyWindow()
+
+
+class ProviderRouter(LLMProvider):
+    """Routes calls over several providers: retries transient failures with jittered
+    backoff, skips providers whose circuit is open, hedges calls slower than the
+    provider's latency percentile and falls back down the list, all within LLM_DEADLINE.
+
+    Streams can only fall back or be hedged until their first chunk has been sent.
+    """
+    name = "router"
+
+    def __init__(self, providers: List[LLMProvider], retries: int = LLM_MAX_RETRIES,
+                 deadline: float = LLM_DEADLINE, hedge_percentile: float = LLM_HEDGE_PERCENTILE):
+        super().__init__(timeout=deadline)
+        if not providers:
+            raise ValueError("ProviderRouter needs at least one provider")
+        self.backends = [Backend(provider) for provider in providers]
+        self.retries = retries
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+        self._hedge_tokens = 1.0
+
+    @property
+    def providers(self) -> List[str]:
+        return [backend.provider.name for backend in self.backends]
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+    def _hedge_delay(self, window: LatencyWindow) -> Optional[float]:
+        if self.hedge_percentile <= 0:
+            return None
+        threshold = window.percentile(self.hedge_percentile)
+        return None if threshold is None else max(threshold, LLM_HEDGE_MIN_DELAY)
+
+    def _hedge_target(self, backend: Backend) -> Optional[Backend]:
+        """The next hedgeable provider with a closed circuit, else the same one again"""
+        if self._hedge_tokens < 1:
+            return None
+        index = self.backends.index(backend)
+        for candidate in self.backends[index + 1:] + [backend]:
+            if candidate.provider.hedgeable and candidate.breaker.allow():
+                self._hedge_tokens -= 1
+                return candidate
+        return None
+
+    async def _attempts(self):
+        """(backend, seconds left) for each try, in order, with backoff between retries"""
+        started = time.monotonic()
+        for backend in self.backends:
+            for attempt in range(self.retries + 1):
+                remaining = started + self.deadline - time.monotonic()
+                # Past the deadline only providers that can't be slow are tried
+                if remaining <= 0 and backend.provider.hedgeable:
+                    break
+                if not backend.breaker.allow():
+                    break
+                error = yield backend, remaining if remaining > 0 else backend.provider.timeout
+                if error is None or not is_transient(error) or attempt == self.retries:
+                    break
+                LLM_RETRIES.labels(backend.provider.name).inc()
+                delay = self._backoff(attempt)
+                if delay < started + self.deadline - time.monotonic():
+                    await asyncio.sleep(delay)
+
+    # --- completions ---
+
+    async def _call(self, backend: Backend, messages, model, max_tokens, temperature) -> str:
+        provider = backend.provider
+        started = time.monotonic()
+        with span("llm_attempt", provider=provider.name):
+            try:
+                reply = await provider.complete(messages, provider.model or model, max_tokens, temperature)
+            except asyncio.CancelledError:
+                backend.breaker.release()
+                raise
+            except Exception as e:
+                if is_transient(e):
+                    backend.breaker.record_failure()
+                else:
+                    backend.breaker.release()
+                raise
+        backend.breaker.record_success()
+        backend.latency.add(time.monotonic() - started)
+        return reply
+
+    async def _hedged_call(self, backend: Backend, messages, model, max_tokens, temperature,
+                           remaining: float) -> Tuple[Backend, str]:
+        """Call `backend`; if it is slower than usual, race a duplicate on another provider"""
+        tasks = {asyncio.ensure_future(self._call(backend, messages, model, max_tokens, temperature)): backend}
+        pending = set(tasks)
+        deadline = time.monotonic() + remaining
+        delay = self._hedge_delay(backend.latency)
+        errors = []
+        try:
+            if delay is not None and delay < remaining:
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    hedge = self._hedge_target(backend)
+                    if hedge is not None:
+                        logger.debug("Hedging %s call after %.2fs on %s", backend.provider.name, delay,
+                                     hedge.provider.name)
+                        task = asyncio.ensure_future(self._call(hedge, messages, model, max_tokens, temperature))
+                        tasks[task] = hedge
+                        pending.add(task)
+                pending |= {task for task in done}
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=deadline - time.monotonic(), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError(f"{backend.provider.name} did not answer within the deadline")
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            hedge_won = task is not next(iter(tasks))
+                            LLM_HEDGES.labels(list(tasks.values())[-1].provider.name,
+                                              "won" if hedge_won else "lost").inc()
+                        return tasks[task], task.result()
+                    errors.append(task.exception())
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                       max_tokens: int = 500, temperature: float = 0.7) -> str:
+        self._hedge_tokens = min(self._hedge_tokens + LLM_HEDGE_BUDGET, 10.0)
+        last_error: Optional[Exception] = None
+        attempts = self._attempts()
+        try:
+            step = await attempts.__anext__()
+            while True:
+                backend, remaining = step
+                try:
+                    winner, reply = await self._hedged_call(backend, messages, model, max_tokens,
+                                                            temperature, remaining)
+                except Exception as e:
+                    last_error = e
+                    logger.warning("LLM call to %s failed: %s", backend.provider.name, e or type(e).__name__)
+                    step = await attempts.asend(e)
+                    continue
+                _answered_by.set(winner.provider)
+                if winner is not self.backends[0]:
+                    LLM_FALLBACKS.labels(winner.provider.name).inc()
+                return reply
+        except StopAsyncIteration:
+            pass
+        finally:
+            await attempts.aclose()
+        raise LLMUnavailableError(f"No LLM provider could answer: {last_error}") from last_error
+
+    # --- streaming ---
+
+    async def _open_stream(self, backend: Backend, messages, model, max_tokens,
+                           temperature) -> Tuple[AsyncIterator[str], str]:
+        """Start a stream and wait for its first chunk, so failures before it can still fall back"""
+        provider = backend.provider
+        chunks = provider.stream(messages, provider.model or model, max_tokens, temperature)
+        started = time.monotonic()
+        # The attempt span covers the wait for the first chunk
+        with span("llm_attempt", provider=provider.name, stream=True):
+            try:
+                try:
+                    first = await chunks.__anext__()
+                except StopAsyncIteration:
+                    first = ""
+            except asyncio.CancelledError:
+                backend.breaker.release()
+                await chunks.aclose()
+                raise
+            except Exception as e:
+                if is_transient(e):
+                    backend.breaker.record_failure()
+                else:
+                    backend.breaker.release()
+                await chunks.aclose()
+                raise
+        backend.breaker.record_success()
+        backend.first_chunk.add(time.monotonic() - started)
+        return chunks, first
+
+    async def _hedged_stream(self, backend: Backend, messages, model, max_tokens, temperature,
+                             remaining: float) -> Tuple[Backend, AsyncIterator[str], str]:
+        tasks = {asyncio.ensure_future(self._open_stream(backend, messages, model, max_tokens, temperature)): backend}
+        pending = set(tasks)
+        deadline = time.monotonic() + remaining
+        delay = self._hedge_delay(backend.first_chunk)
+        errors = []
+        try:
+            if delay is not None and delay < remaining:
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    hedge = self._hedge_target(backend)
+                    if hedge is not None:
+                        task = asyncio.ensure_future(
+                            self._open_stream(hedge, messages, model, max_tokens, temperature)
+                        )
+                        tasks[task] = hedge
+                        pending.add(task)
+                pending |= {task for task in done}
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=deadline - time.monotonic(), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError(f"{backend.provider.name} sent nothing within the deadline")
+                winner = next((task for task in done if task.exception() is None), None)
+                # Two streams may open at once: keep one, close the other
+                for task in done:
+                    if task is not winner and task.exception() is None:
+                        await task.result()[0].aclose()
+                    elif task.exception() is not None:
+                        errors.append(task.exception())
+                if winner is not None:
+                    if len(tasks) > 1:
+                        LLM_HEDGES.labels(list(tasks.values())[-1].provider.name,
+                                          "lost" if winner is next(iter(tasks)) else "won").inc()
+                    chunks, first = winner.result()
+                    return tasks[winner], chunks, first
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                     max_tokens: int = 500, temperature: float = 0.7) -> AsyncIterator[str]:
+        self._hedge_tokens = min(self._hedge_tokens + LLM_HEDGE_BUDGET, 10.0)
+        last_error: Optional[Exception] = None
+        opened = None
+        attempts = self._attempts()
+        try:
+            step = await attempts.__anext__()
+            while opened is None:
+                backend, remaining = step
+                try:
+                    opened = await self._hedged_stream(backend, messages, model, max_tokens,
+                                                       temperature, remaining)
+                except Exception as e:
+                    last_error = e
+                    logger.warning("LLM stream from %s failed: %s", backend.provider.name, e or type(e).__name__)
+                    step = await attempts.asend(e)
+        except StopAsyncIteration:
+            pass
+        finally:
+            await attempts.aclose()
+        if opened is None:
+            raise LLMUnavailableError(f"No LLM provider could answer: {last_error}") from last_error
+
+        winner, chunks, first = opened
+        _answered_by.set(winner.provider)
+        if winner is not self.backends[0]:
+            LLM_FALLBACKS.labels(winner.provider.name).inc()
+        try:
+            if first:
+                yield first
+            # Text has been sent: a failure from here on can't be retried elsewhere
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            if is_transient(e):
+                winner.breaker.record_failure()
+            raise
+        finally:
+            await chunks.aclose()
+
+    async def aclose(self):
+        for backend in self.backends:
+            await backend.provider.aclose()
+
+
+class Flight:
+    """One upstream call and the callers waiting for it"""
+    __slots__ = ("task", "waiters", "chunks", "finished", "error", "answered_by", "_changed")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # Streams: chunks so far, replayed to callers that join late
+        self.chunks: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.answered_by: Optional[LLMProvider] = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class CoalescingProvider(LLMProvider):
+    """Single-flight wrapper: a call identical to one already in flight waits for
+    that call's answer (or replays and follows its stream) instead of calling the
+    provider again. Nothing is kept once the call finishes, so answers are never stale.
+    """
+
+    def __init__(self, provider: LLMProvider, max_fanout: int = LLM_COALESCE_MAX_FANOUT):
+        super().__init__(timeout=provider.timeout)
+        self.provider = provider
+        self.name = provider.name
+        self.max_fanout = max_fanout
+        self._completions: Dict[str, Flight] = {}
+        self._streams: Dict[str, Flight] = {}
+
+    @property
+    def providers(self) -> List[str]:
+        return getattr(self.provider, "providers", [self.provider.name])
+
+    def _join(self, flights: Dict[str, Flight], key: str, mode: str) -> Tuple[Flight, bool]:
+        """The flight in progress for key, or a new one when there is none or it is full"""
+        flight = flights.get(key)
+        if flight is not None and flight.waiters < self.max_fanout:
+            LLM_COALESCED.labels(mode).inc()
+            return flight, False
+        flight = Flight()
+        flights[key] = flight
+        return flight, True
+
+    @staticmethod
+    def _forget(flights: Dict[str, Flight], key: str, flight: Flight):
+        # A full flight may already have been replaced by a newer one
+        if flights.get(key) is flight:
+            del flights[key]
+
+    def _leave(self, flights: Dict[str, Flight], key: str, flight: Flight):
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            # Every caller is gone (e.g. disconnected): stop paying for the answer.
+            # Forgotten right away, so a new caller starts a fresh call instead of
+            # joining one that is being cancelled
+            self._forget(flights, key, flight)
+            flight.task.cancel()
+
+    async def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                       max_tokens: int = 500, temperature: float = 0.7) -> str:
+        key = json.dumps([model, max_tokens, temperature, messages])
+        flight, leader = self._join(self._completions, key, "complete")
+        if leader:
+            flight.task = asyncio.ensure_future(self._call(flight, messages, model, max_tokens, temperature))
+            flight.task.add_done_callback(lambda _: self._forget(self._completions, key, flight))
+        flight.waiters += 1
+        try:
+            # Shielded, so one caller's cancellation doesn't cancel the others' answer
+            reply = await asyncio.shield(flight.task)
+        finally:
+            self._leave(self._completions, key, flight)
+        _answered_by.set(flight.answered_by)
+        return reply
+
+    async def _call(self, flight: Flight, messages, model, max_tokens, temperature) -> str:
+        reply = await self.provider.complete(messages, model, max_tokens, temperature)
+        flight.answered_by = _answered_by.get()
+        return reply
+
+    async def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                     max_tokens: int = 500, temperature: float = 0.7) -> AsyncIterator[str]:
+        key = json.dumps([model, max_tokens, temperature, messages])
+        flight, leader = self._join(self._streams, key, "stream")
+        if leader:
+            flight.task = asyncio.ensure_future(self._pump(flight, messages, model, max_tokens, temperature))
+            flight.task.add_done_callback(lambda _: self._forget(self._streams, key, flight))
+        flight.waiters += 1
+        position = 0
+        try:
+            while True:
+                if position < len(flight.chunks):
+                    position += 1
+                    yield flight.chunks[position - 1]
+                elif flight.finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    break
+                else:
+                    await flight.wait()
+        finally:
+            self._leave(self._streams, key, flight)
+        _answered_by.set(flight.answered_by)
+
+    async def _pump(self, flight: Flight, messages, model, max_tokens, temperature):
+        """Read the upstream stream once, for every caller following it"""
+        chunks = self.provider.stream(messages, model, max_tokens, temperature)
+        try:
+            async for chunk in chunks:
+                flight.answered_by = _answered_by.get()
+                flight.chunks.append(chunk)
+                flight.notify()
+        except Exception as e:
+            flight.error = e
+        except asyncio.CancelledError:
+            # A cut-off stream must not look like a finished answer to anyone still following it
+            flight.error = LLMUnavailableError("Coalesced stream was cancelled")
+            raise
+        finally:
+            await chunks.aclose()
+            flight.finished = True
+            flight.notify()
@@ -3,6 +3,8 @@ from sqlalchemy.orm import Session
 from database import Product, Customer, Order
 from typing import Optional
 from dotenv import load_dotenv
+from services.intents import intent_classifier
+from services.providers import rule_based_reply
 
 load_dotenv()
 
@@ -25,8 +27,7 @@ async def get_ai_response(user_message: str, conversation_id: int, db: Session)
     try:
         if USE_GROQ and 'client' in globals():
             # Use real Groq
-            ecommerce_keywords = ["product", "order", "buy", "purchase", "price", "stock", "customer"]
-            is_ecommerce_query = any(keyword in user_message.lower() for keyword in ecommerce_keywords)
+            is_ecommerce_query = intent_classifier.classify(user_message).is_ecommerce
             
             system_prompt = """You are a helpful AI assistant for an e-commerce platform. 
             You can help users with product information, orders, and general questions.
@@ -59,28 +60,17 @@ async def get_ai_response(user_message: str, conversation_id: int, db: Session)
 
 def get_mock_response(user_message: str, db: Session) -> str:
     """Smart mock responses based on user input"""
-    message_lower = user_message.lower()
-    
-    if any(word in message_lower for word in ["product", "item", "buy", "price"]):
-        context = get_ecommerce_context(user_message, db)
-        return f"Here are our available products:\n\n{context}\n\nWould you like more details about any specific product? (Note: Using mock AI - Groq will be connected soon!)"
-    
-    elif "order" in message_lower:
-        context = get_ecommerce_context(user_message, db)
-        return f"Here's information about orders:\n\n{context}\n\nWhat would you like to know about orders? (Note: Using mock AI)"
-    
-    elif any(word in message_lower for word in ["hello", "hi", "hey"]):
-        return "Hello! 👋 I'm your e-commerce AI assistant. I can help you with:\n\n• Product information\n• Order details\n• General questions\n\nWhat would you like to know? (Note: Using mock AI - Groq will be connected soon!)"
-    
-    else:
-        return f"I understand you're asking about: '{user_message}'\n\nI'm your e-commerce assistant and I can help with products, orders, and general questions. Could you be more specific about what you'd like to know? (Note: Using mock AI - Groq will be connected soon!)"
+    # The same canned replies the async stack falls back to when no model answers
+    reply = rule_based_reply(user_message, get_ecommerce_context(user_message, db))
+    return f"{reply} (Note: Using mock AI - Groq will be connected soon!)"
 
 def get_ecommerce_context(message: str, db: Session) -> str:
     """Get relevant e-commerce data based on user message"""
     context_parts = []
+    classification = intent_classifier.classify(message)
     
     # Search for products
-    if any(word in message.lower() for word in ["product", "item", "buy", "price"]):
+    if classification.wants_listing:
         products = db.query(Product).limit(5).all()
         if products:
             context_parts.append("Available products:")
@@ -88,7 +78,7 @@ def get_ecommerce_context(message: str, db: Session) -> str:
                 context_parts.append(f"- {product.name}: ${product.price} ({product.stock_quantity} in stock)")
     
     # Search for order information
-    if "order" in message.lower():
+    if "order" in classification.intents:
         recent_orders = db.query(Order).limit(3).all()
         if recent_orders:
             context_parts.append("\nRecent orders:")
@@ -0,0 +1,186 @@
+import os
+import re
+from collections import OrderedDict, deque
+from typing import Callable, List, Dict, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Message, ConversationSummary
+from services.shared_cache import get_shared_cache
+
+# Memory settings (overridable from the environment)
+MEMORY_MAX_MESSAGES = int(os.getenv("MEMORY_MAX_MESSAGES", "20"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "2000"))
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", "1024"))
+MEMORY_SHARED_TTL = float(os.getenv("MEMORY_SHARED_TTL", "3600"))
+
+ROLES = {"user": "user", "ai": "assistant"}
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: one per word or symbol, plus one per 6 chars of long words"""
+    return sum(1 + len(token) // 6 for token in _TOKEN_RE.findall(text))
+
+
+class ConversationWindow:
+    """The most recent messages of one conversation, bounded by count and tokens"""
+    __slots__ = ("messages", "total_tokens", "max_messages", "token_budget", "summary", "truncated", "dropped_tokens")
+
+    def __init__(self, max_messages: int = MEMORY_MAX_MESSAGES, token_budget: int = MEMORY_TOKEN_BUDGET):
+        self.messages = deque()
+        self.total_tokens = 0
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.summary: Optional[str] = None
+        # Set once older messages fell out of the window (candidates for summarisation)
+        self.truncated = False
+        # Tokens the latest append pushed out of the window
+        self.dropped_tokens = 0
+
+    def append(self, sender: str, content: str, message_id: Optional[int] = None):
+        tokens = estimate_tokens(content)
+        self.messages.append((message_id, ROLES.get(sender, sender), content, tokens))
+        self.total_tokens += tokens
+
+        # Drop the oldest messages, but always keep the newest one
+        self.dropped_tokens = 0
+        while len(self.messages) > 1 and (
+            len(self.messages) > self.max_messages or self.total_tokens > self.token_budget
+        ):
+            dropped = self.messages.popleft()[3]
+            self.total_tokens -= dropped
+            self.dropped_tokens += dropped
+            self.truncated = True
+
+    def set_summary(self, summary: str, last_message_id: int):
+        """Attach a summary and drop the messages it already covers"""
+        self.summary = summary
+        self.truncated = False
+        while self.messages and self.messages[0][0] is not None and self.messages[0][0] <= last_message_id:
+            self.total_tokens -= self.messages.popleft()[3]
+
+    def to_chat_messages(self) -> List[Dict[str, str]]:
+        return [{"role": role, "content": content} for _, role, content, _ in self.messages]
+
+    def to_state(self) -> dict:
+        """JSON-serialisable form for the shared cache"""
+        return {
+            "messages": list(self.messages),
+            "total_tokens": self.total_tokens,
+            "summary": self.summary,
+            "truncated": self.truncated
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "ConversationWindow":
+        window = cls()
+        window.messages = deque(tuple(message) for message in state["messages"])
+        window.total_tokens = state["total_tokens"]
+        window.summary = state["summary"]
+        window.truncated = state["truncated"]
+        return window
+
+
+class ConversationMemory:
+    """LRU cache of conversation windows so follow-up turns skip the history query.
+
+    With a shared cache configured the windows live there instead, so any
+    worker can serve the next turn of a conversation.
+    """
+
+    def __init__(self, max_conversations: int = MEMORY_CACHE_SIZE):
+        self.max_conversations = max_conversations
+        self._windows: "OrderedDict[int, ConversationWindow]" = OrderedDict()
+
+    async def get_window(self, conversation_id: int, db: AsyncSession) -> ConversationWindow:
+        window = await self._cached(conversation_id)
+        if window is None:
+            window = await self._load(conversation_id, db)
+            await self._store(conversation_id, window)
+        return window
+
+    async def _cached(self, conversation_id: int) -> Optional[ConversationWindow]:
+        shared = get_shared_cache()
+        if shared is not None:
+            state = await shared.get(f"conversation:{conversation_id}")
+            return ConversationWindow.from_state(state) if state is not None else None
+
+        window = self._windows.get(conversation_id)
+        if window is not None:
+            self._windows.move_to_end(conversation_id)
+        return window
+
+    async def _store(self, conversation_id: int, window: ConversationWindow):
+        shared = get_shared_cache()
+        if shared is not None:
+            await shared.set(f"conversation:{conversation_id}", window.to_state(), MEMORY_SHARED_TTL)
+            return
+
+        self._windows[conversation_id] = window
+        self._windows.move_to_end(conversation_id)
+        if len(self._windows) > self.max_conversations:
+            self._windows.popitem(last=False)
+
+    async def _load(self, conversation_id: int, db: AsyncSession) -> ConversationWindow:
+        summary = await db.get(ConversationSummary, conversation_id)
+        query = (
+            select(Message.id, Message.sender, Message.content)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(MEMORY_MAX_MESSAGES)
+        )
+        if summary:
+            query = query.where(Message.id > summary.last_message_id)
+        rows = (await db.execute(query)).all()
+
+        window = ConversationWindow()
+        for message_id, sender, content in reversed(rows):
+            window.append(sender, content, message_id)
+        if summary:
+            window.summary = summary.content
+        if len(rows) == MEMORY_MAX_MESSAGES:
+            window.truncated = True
+        return window
+
+    async def _update(self, conversation_id: int,
+                      change: Callable[[ConversationWindow], None]) -> Optional[ConversationWindow]:
+        """Apply change to the cached window, atomically when it lives in the shared cache"""
+        shared = get_shared_cache()
+        if shared is None:
+            window = await self._cached(conversation_id)
+            if window is not None:
+                change(window)
+            return window
+
+        updated = None
+
+        def apply(state: Optional[dict]) -> Optional[dict]:
+            nonlocal updated
+            if state is None:
+                return None
+            updated = ConversationWindow.from_state(state)
+            change(updated)
+            return updated.to_state()
+
+        # A plain read-modify-write would lose one of two concurrent appends
+        if await shared.update(f"conversation:{conversation_id}", apply, MEMORY_SHARED_TTL) is None:
+            return None
+        return updated
+
+    async def append(self, conversation_id: int, sender: str, content: str,
+                     message_id: Optional[int] = None) -> Optional[ConversationWindow]:
+        """Record a persisted message; uncached conversations are loaded on next use"""
+        return await self._update(conversation_id, lambda window: window.append(sender, content, message_id))
+
+    async def set_summary(self, conversation_id: int, summary: str, last_message_id: int):
+        await self._update(conversation_id, lambda window: window.set_summary(summary, last_message_id))
+
+    async def evict(self, conversation_id: int):
+        self._windows.pop(conversation_id, None)
+        shared = get_shared_cache()
+        if shared is not None:
+            await shared.delete(f"conversation:{conversation_id}")
+
+
+conversation_memory = ConversationMemory()
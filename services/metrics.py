@@ -0,0 +1,159 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+)
+
+# Set by serve.py when it starts several workers: each worker writes its metrics
+# to files there and /metrics aggregates all of them, whichever worker answers
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LLM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "End-to-end request latency (streams until their last chunk)",
+    ["method", "route"], buckets=REQUEST_BUCKETS
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being handled", ["method"], multiprocess_mode="livesum"
+)
+
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "LLM call latency (whole stream for streaming calls)",
+    ["provider", "mode"], buckets=LLM_BUCKETS
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "Time until a streaming LLM call yields its first chunk",
+    ["provider"], buckets=LLM_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "Prompt and completion tokens (estimated when the provider reports no usage)",
+    ["provider", "kind"]
+)
+LLM_ERRORS = Counter("llm_errors_total", "Failed LLM calls", ["provider", "error"])
+LLM_REQUESTS_IN_PROGRESS = Gauge(
+    "llm_requests_in_progress", "LLM calls in flight", ["provider"], multiprocess_mode="livesum"
+)
+LLM_RETRIES = Counter("llm_retries_total", "LLM calls retried after a transient failure", ["provider"])
+LLM_HEDGES = Counter(
+    "llm_hedged_requests_total", "Duplicate LLM calls sent after the latency threshold, by whether they won",
+    ["provider", "result"]
+)
+LLM_FALLBACKS = Counter("llm_fallbacks_total", "LLM calls answered by a provider other than the first", ["provider"])
+LLM_COALESCED = Counter(
+    "llm_coalesced_requests_total", "LLM calls that joined an identical call in flight instead of making their own",
+    ["mode"]
+)
+LLM_CIRCUIT_OPEN = Gauge(
+    "llm_circuit_open", "1 while a provider's circuit breaker is open", ["provider"], multiprocess_mode="livemax"
+)
+
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Database statement time by the route that issued it",
+    ["route"], buckets=DB_BUCKETS
+)
+
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+
+# The ASGI scope of the request being handled; statements outside requests
+# (summarizer, write batching) are attributed to "background"
+_request_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+
+
+def _route_of(scope: Optional[dict]) -> str:
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    # Unmatched paths share one label so scanners can't blow up the series count
+    return getattr(route, "path", "unmatched")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request count, latency and in-flight requests per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method)
+        token = _request_scope.set(scope)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_progress.dec()
+            _request_scope.reset(token)
+            # The router stored the matched route in the scope
+            route = _route_of(scope)
+            HTTP_REQUEST_DURATION.labels(method, route).observe(elapsed)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+
+
+def instrument_engine(engine):
+    """Time every statement run on `engine` (a sync Engine or an AsyncEngine)"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _observe(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_DURATION.labels(_route_of(_request_scope.get())).observe(time.perf_counter() - started)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for providers without usage data"""
+    return max(1, len(text) // 4) if text else 0
+
+
+def record_tokens(provider: str, prompt_tokens: int, completion_tokens: int):
+    LLM_TOKENS.labels(provider, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(provider, "completion").inc(completion_tokens)
+
+
+def record_cache_lookups(cache: str, hits: int = 0, misses: int = 0, result: str = "hit"):
+    if hits:
+        CACHE_LOOKUPS.labels(cache, result).inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache, "miss").inc(misses)
+
+
+def render_metrics() -> bytes:
+    """Prometheus text exposition of this process, or of all workers in multiprocess mode"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_worker_exited():
+    """Drop this worker's live gauges from the multiprocess files"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
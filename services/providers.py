@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import random
+import asyncio
+from typing import List, Dict, Optional, AsyncIterator
+import httpx
+from dotenv import load_dotenv
+from services.intents import intent_classifier
+from services.log import get_logger
+from services.metrics import (
+    LLM_REQUEST_DURATION, LLM_TIME_TO_FIRST_TOKEN, LLM_ERRORS, LLM_REQUESTS_IN_PROGRESS,
+    estimate_tokens, record_tokens
+)
+
+load_dotenv()
+
+DEFAULT_MODEL = "llama3-8b-8192"
+
+# Provider settings (overridable from the environment)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+STUB_LLM_LATENCY = float(os.getenv("STUB_LLM_LATENCY", "0.5"))
+STUB_LLM_TOKENS_PER_SEC = float(os.getenv("STUB_LLM_TOKENS_PER_SEC", "50"))
+# Fault injection for load tests: share of stub calls that fail, or take STUB_LLM_SLOW_LATENCY
+STUB_LLM_ERROR_RATE = float(os.getenv("STUB_LLM_ERROR_RATE", "0"))
+STUB_LLM_SLOW_RATE = float(os.getenv("STUB_LLM_SLOW_RATE", "0"))
+STUB_LLM_SLOW_LATENCY = float(os.getenv("STUB_LLM_SLOW_LATENCY", "5"))
+
+# Self-hosted model server with an OpenAI-compatible API (llama.cpp, vLLM, Ollama)
+LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "http://localhost:11434/v1")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "llama3")
+LOCAL_LLM_API_KEY = os.getenv("LOCAL_LLM_API_KEY", "")
+
+# Where the prompt built in services/llm.py puts the retrieved context and the summary
+CONTEXT_HEADER = "Here's relevant information from our database:"
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+logger = get_logger("providers")
+
+
+class LLMProvider:
+    """Base class for async chat-completion backends"""
+    name = "base"
+    # Model to ask for instead of the caller's (for backends serving other models)
+    model: Optional[str] = None
+    # Answers worth putting in the response cache
+    cacheable = True
+    # Worth sending a hedged duplicate request to
+    hedgeable = True
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_TIMEOUT):
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def complete(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                       max_tokens: int = 500, temperature: float = 0.7) -> str:
+        """Run one completion, bounded by the concurrency limit and request timeout"""
+        async with self._semaphore:
+            in_progress = LLM_REQUESTS_IN_PROGRESS.labels(self.name)
+            in_progress.inc()
+            started = time.perf_counter()
+            try:
+                return await asyncio.wait_for(
+                    self._complete(messages, model, max_tokens, temperature),
+                    timeout=self.timeout
+                )
+            except Exception as e:
+                LLM_ERRORS.labels(self.name, type(e).__name__).inc()
+                raise
+            finally:
+                in_progress.dec()
+                LLM_REQUEST_DURATION.labels(self.name, "complete").observe(time.perf_counter() - started)
+
+    async def stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL,
+                     max_tokens: int = 500, temperature: float = 0.7) -> AsyncIterator[str]:
+        """Yield completion text as it is generated"""
+        # The concurrency slot is held for the whole stream and the timeout applies
+        # to each chunk. Closing this generator closes the upstream request too.
+        async with self._semaphore:
+            in_progress = LLM_REQUESTS_IN_PROGRESS.labels(self.name)
+            in_progress.inc()
+            started = time.perf_counter()
+            chunk_count = 0
+            chunks = self._stream(messages, model, max_tokens, temperature)
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    if chunk:
+                        if not chunk_count:
+                            LLM_TIME_TO_FIRST_TOKEN.labels(self.name).observe(time.perf_counter() - started)
+                        chunk_count += 1
+                        yield chunk
+            except Exception as e:
+                LLM_ERRORS.labels(self.name, type(e).__name__).inc()
+                raise
+            finally:
+                await chunks.aclose()
+                in_progress.dec()
+                LLM_REQUEST_DURATION.labels(self.name, "stream").observe(time.perf_counter() - started)
+                # Streamed chunks are about one token each
+                record_tokens(self.name, sum(estimate_tokens(m["content"]) for m in messages), chunk_count)
+
+    async def _complete(self, messages, model, max_tokens, temperature) -> str:
+        raise NotImplementedError
+
+    async def _stream(self, messages, model, max_tokens, temperature) -> AsyncIterator[str]:
+        # Providers without native streaming emit the whole completion at once
+        yield await self._complete(messages, model, max_tokens, temperature)
+
+    async def aclose(self):
+        pass
+
+
+class GroqProvider(LLMProvider):
+    """Groq backend using the async SDK over one shared, pooled HTTP client"""
+    name = "groq"
+
+    def __init__(self, api_key: str, max_retries: int = LLM_MAX_RETRIES, **kwargs):
+        super().__init__(**kwargs)
+        from groq import AsyncGroq
+
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=5.0)
+        )
+        self._client = AsyncGroq(api_key=api_key, http_client=self._http, max_retries=max_retries)
+
+    async def _complete(self, messages, model, max_tokens, temperature) -> str:
+        response = await self._client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        if response.usage is not None:
+            record_tokens(self.name, response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content
+
+    async def _stream(self, messages, model, max_tokens, temperature) -> AsyncIterator[str]:
+        response = await self._client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True
+        )
+        try:
+            async for chunk in response:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or ""
+        finally:
+            await response.response.aclose()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+class LocalProvider(LLMProvider):
+    """Self-hosted model server speaking the OpenAI chat completions API"""
+    name = "local"
+
+    def __init__(self, base_url: str = LOCAL_LLM_URL, model: str = LOCAL_LLM_MODEL,
+                 api_key: str = LOCAL_LLM_API_KEY, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else None,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=2.0)
+        )
+
+    async def _complete(self, messages, model, max_tokens, temperature) -> str:
+        response = await self._http.post("/chat/completions", json={
+            "model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature
+        })
+        response.raise_for_status()
+        data = response.json()
+        usage = data.get("usage")
+        if usage:
+            record_tokens(self.name, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+        return data["choices"][0]["message"]["content"]
+
+    async def _stream(self, messages, model, max_tokens, temperature) -> AsyncIterator[str]:
+        async with self._http.stream("POST", "/chat/completions", json={
+            "model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature,
+            "stream": True
+        }) as response:
+            response.raise_for_status()
+            # Server-Sent Events: "data: {json}" lines, ending with "data: [DONE]"
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                choices = json.loads(payload).get("choices")
+                if choices:
+                    yield choices[0].get("delta", {}).get("content") or ""
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+PRODUCT_SECTIONS = ("Matching products:", "Available products:", "Products in that price range:")
+ORDER_SECTIONS = ("Your orders:", "Your recent orders:", "Recent orders:")
+
+
+def rule_based_reply(user_message: str, context: str = "") -> str:
+    """Canned answer from the message's intents and the retrieved context; needs no model"""
+    classification = intent_classifier.classify(user_message)
+    sections = [section.strip() for section in context.split("\n\n") if section.strip()]
+    products = [section for section in sections if section.startswith(PRODUCT_SECTIONS)]
+    orders = [section for section in sections if section.startswith(ORDER_SECTIONS)]
+
+    if "order" in classification.intents and orders:
+        return ("Here's what I found about your orders:\n\n" + "\n\n".join(orders)
+                + "\n\nWhat would you like to know about them?")
+    if (classification.wants_listing or "stock" in classification.intents) and products:
+        return ("Here are the products I found:\n\n" + "\n\n".join(products)
+                + "\n\nWould you like more details about any specific product?")
+    if "order" in classification.intents:
+        return ("I couldn't find any orders on your account. If you have an order number, "
+                "please include it (e.g. \"order #123\").")
+    if "greeting" in classification.intents:
+        return ("Hello! 👋 I'm your e-commerce AI assistant. I can help you with:\n\n"
+                "• Product information\n• Order details\n• General questions\n\nWhat would you like to know?")
+    return (f"I understand you're asking about: '{user_message}'\n\n"
+            "I'm your e-commerce assistant and I can help with products, orders, and general questions. "
+            "Could you be more specific about what you'd like to know?")
+
+
+class RuleBasedProvider(LLMProvider):
+    """Last-resort backend answering from the retrieved context with canned replies, without a model"""
+    name = "rules"
+    cacheable = False
+    hedgeable = False
+
+    async def _complete(self, messages, model, max_tokens, temperature) -> str:
+        system_prompt = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        context = ""
+        if CONTEXT_HEADER in system_prompt:
+            context = system_prompt.split(CONTEXT_HEADER, 1)[1].split(SUMMARY_HEADER, 1)[0]
+        return rule_based_reply(messages[-1]["content"] if messages else "", context)
+
+
+class StubProvider(LLMProvider):
+    """Offline provider with a fixed latency and token rate, used for load testing"""
+    name = "stub"
+
+    def __init__(self, latency: float = STUB_LLM_LATENCY,
+                 tokens_per_sec: float = STUB_LLM_TOKENS_PER_SEC, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+
+    async def _wait(self):
+        """Simulated model latency, with the configured share of slow calls and failures"""
+        slow = random.random() < STUB_LLM_SLOW_RATE
+        await asyncio.sleep(STUB_LLM_SLOW_LATENCY if slow else self.latency)
+        if random.random() < STUB_LLM_ERROR_RATE:
+            raise httpx.ConnectError("injected stub failure")
+
+    def _reply(self, messages) -> str:
+        user_message = messages[-1]["content"] if messages else ""
+        return f"[stub] You said: {user_message[:200]}"
+
+    async def _complete(self, messages, model, max_tokens, temperature) -> str:
+        await self._wait()
+        reply = self._reply(messages)
+        record_tokens(self.name, sum(estimate_tokens(m["content"]) for m in messages), estimate_tokens(reply))
+        return reply
+
+    async def _stream(self, messages, model, max_tokens, temperature) -> AsyncIterator[str]:
+        await self._wait()
+        delay = 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0
+        for i, word in enumerate(self._reply(messages).split(" ")):
+            if delay:
+                await asyncio.sleep(delay)
+            yield word if i == 0 else " " + word
+
+
+_provider: Optional[LLMProvider] = None
+
+
+def create_provider(name: str = LLM_PROVIDER, **kwargs) -> LLMProvider:
+    """Build the provider selected by name ("groq", "local", "rules" or "stub")"""
+    if name == "stub":
+        return StubProvider(**kwargs)
+    if name == "rules":
+        return RuleBasedProvider(**kwargs)
+    if name == "local":
+        return LocalProvider(**kwargs)
+    if name == "groq":
+        api_key = os.getenv("GROQ_API_KEY")
+        if not api_key:
+            raise ValueError("GROQ_API_KEY not found in environment variables")
+        return GroqProvider(api_key=api_key, **kwargs)
+    raise ValueError(f"Unknown LLM provider: {name}")
+
+
+def create_router(names: Optional[List[str]] = None) -> LLMProvider:
+    """Route over the providers in LLM_PROVIDERS; ones that can't be set up are left out.
+    Identical calls in flight are coalesced unless LLM_COALESCE is off."""
+    from services.llm_router import ProviderRouter, CoalescingProvider, LLM_PROVIDERS, LLM_COALESCE
+    providers = []
+    for name in names or LLM_PROVIDERS:
+        try:
+            # The router retries with backoff itself, so the SDK must not retry too
+            providers.append(create_provider(name, max_retries=0) if name == "groq" else create_provider(name))
+        except Exception as e:
+            logger.warning("LLM provider %s unavailable: %s", name, e, extra={"provider": name})
+    router = ProviderRouter(providers)
+    return CoalescingProvider(router) if LLM_COALESCE else router
+
+
+def get_provider() -> Optional[LLMProvider]:
+    """Return the process-wide provider router, creating it on first use"""
+    global _provider
+    if _provider is None:
+        try:
+            _provider = create_router()
+            logger.info("LLM providers initialized: %s", ", ".join(_provider.providers))
+        except Exception:
+            logger.exception("LLM provider initialization failed")
+            return None
+    return _provider
+
+
+async def close_provider():
+    global _provider
+    if _provider is not None:
+        await _provider.aclose()
+        _provider = None
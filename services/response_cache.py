@@ -0,0 +1,207 @@
+import os
+import re
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Iterable, List, Dict, Optional, Set, Tuple
+import numpy as np
+from services.embeddings import HashingEncoder, product_embeddings
+from services.catalog_cache import catalog_cache
+from services.shared_cache import get_shared_cache
+from services.metrics import record_cache_lookups
+from services.log import get_logger
+
+# Cache settings (overridable from the environment)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+# Cosine similarity needed for a near-duplicate hit; 0 (the default) disables the
+# similarity tier, which also needs EMBEDDING_MODEL to be set
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+_NUMBER_RE = re.compile(r"\d+")
+# "t" is what normalisation leaves of "n't" (don't -> "don t")
+_NEGATIONS = frozenset({"no", "not", "never", "none", "nothing", "nor", "neither", "without", "cannot", "t"})
+
+logger = get_logger("response_cache")
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return _SPACE_RE.sub(" ", _PUNCTUATION_RE.sub(" ", message.lower())).strip()
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+def _meaning_markers(normalized: str) -> Tuple[Tuple[str, ...], int]:
+    """Numbers and negation count of a normalised message; near-duplicates must agree on both"""
+    words = normalized.split()
+    return tuple(_NUMBER_RE.findall(normalized)), sum(1 for word in words if word in _NEGATIONS)
+
+
+class CachedResponse:
+    __slots__ = ("response", "context_hash", "vector", "markers", "expires_at", "product_ids")
+
+    def __init__(self, response: str, context_hash: str, vector: Optional[np.ndarray],
+                 markers: Tuple[Tuple[str, ...], int], expires_at: float, product_ids: Tuple[int, ...] = ()):
+        self.response = response
+        self.context_hash = context_hash
+        self.vector = vector
+        self.markers = markers
+        self.expires_at = expires_at
+        self.product_ids = product_ids
+
+
+class ResponseCache:
+    """LLM responses keyed on the normalised user message and a hash of everything else in the prompt.
+
+    The exact tier matches the same normalised message (and is also kept in the
+    shared cache when one is configured). The optional similarity tier matches
+    near-duplicate wording with the embedding model, but only among entries
+    built from the same context (system prompt, injected product data and
+    history) and with the same numbers and negations.
+    """
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, max_size: int = RESPONSE_CACHE_SIZE,
+                 similarity: float = RESPONSE_CACHE_SIMILARITY, encoder=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.similarity = similarity
+        self._encoder = encoder
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._by_context: Dict[str, Dict[str, CachedResponse]] = {}
+        # Entries whose prompt listed each product
+        self._by_product: Dict[int, Set[str]] = {}
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def _vector(self, normalized: str) -> Optional[np.ndarray]:
+        if self.similarity <= 0:
+            return None
+        if self._encoder is None:
+            self._encoder = product_embeddings.encoder
+        if isinstance(self._encoder, HashingEncoder):
+            # Word hashing can't tell "size 10" from "size 11" or "like" from "don't like"
+            logger.warning("Response cache similarity tier needs EMBEDDING_MODEL; disabling it")
+            self.similarity = 0
+            return None
+        return self._encoder.encode([normalized])[0]
+
+    def _keys(self, messages: List[Dict[str, str]], model: str, **params) -> Tuple[str, str, str]:
+        normalized = normalize_message(messages[-1]["content"])
+        context_hash = _digest(model, json.dumps(params, sort_keys=True), json.dumps(messages[:-1]))
+        return _digest(context_hash, normalized), context_hash, normalized
+
+    async def get(self, messages: List[Dict[str, str]], model: str, **params) -> Optional[str]:
+        key, context_hash, normalized = self._keys(messages, model, **params)
+        now = time.monotonic()
+
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > now:
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            record_cache_lookups("response", hits=1, result="exact_hit")
+            return entry.response
+
+        shared = get_shared_cache()
+        if shared is not None:
+            response = await shared.get(f"response:{key}")
+            if response is not None:
+                self._put_local(key, context_hash, normalized, response)
+                self.exact_hits += 1
+                record_cache_lookups("response", hits=1, result="shared_hit")
+                return response
+
+        if self.similarity > 0:
+            markers = _meaning_markers(normalized)
+            candidates = [(k, e) for k, e in self._by_context.get(context_hash, {}).items()
+                          if e.expires_at > now and e.markers == markers and e.vector is not None]
+            query = self._vector(normalized) if candidates else None
+            if query is not None:
+                scores = np.stack([e.vector for _, e in candidates]) @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    self._entries.move_to_end(candidates[best][0])
+                    self.similar_hits += 1
+                    record_cache_lookups("response", hits=1, result="similar_hit")
+                    return candidates[best][1].response
+
+        self.misses += 1
+        record_cache_lookups("response", misses=1)
+        return None
+
+    async def put(self, messages: List[Dict[str, str]], model: str, response: str,
+                  product_ids: Iterable[int] = (), **params):
+        key, context_hash, normalized = self._keys(messages, model, **params)
+        self._put_local(key, context_hash, normalized, response, tuple(product_ids))
+        shared = get_shared_cache()
+        if shared is not None:
+            await shared.set(f"response:{key}", response, self.ttl)
+
+    def _put_local(self, key: str, context_hash: str, normalized: str, response: str,
+                   product_ids: Tuple[int, ...] = ()):
+        vector = self._vector(normalized)
+        self._remove(key)
+        entry = CachedResponse(response, context_hash, vector, _meaning_markers(normalized),
+                               time.monotonic() + self.ttl, product_ids)
+        self._entries[key] = entry
+        self._by_context.setdefault(context_hash, {})[key] = entry
+        for product_id in product_ids:
+            self._by_product.setdefault(product_id, set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            bucket = self._by_context.get(entry.context_hash)
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del self._by_context[entry.context_hash]
+            for product_id in entry.product_ids:
+                keys = self._by_product.get(product_id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._by_product[product_id]
+
+    def invalidate_products(self, ids: Iterable[int]) -> int:
+        """Drop entries whose prompt listed any of these products; returns how many"""
+        keys = set()
+        for product_id in ids:
+            keys |= self._by_product.get(product_id, set())
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_context.clear()
+        self._by_product.clear()
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        hits = self.exact_hits + self.similar_hits
+        return {
+            "size": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+
+response_cache = ResponseCache()
+
+# Product changes alter the injected context, so answers that listed a changed
+# product can no longer hit; drop just those (everything when the change set is unknown).
+# Entries copied from the shared tier don't know their products and simply expire
+catalog_cache.add_invalidation_listener(
+    lambda ids: response_cache.clear() if ids is None else response_cache.invalidate_products(ids)
+)
@@ -0,0 +1,289 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from database import AsyncSessionLocal, Product, Customer, Order
+from models import User
+from services.memory import conversation_memory
+from services.search import search_product_ids
+from services.embeddings import product_embeddings
+from services.catalog_cache import catalog_cache
+from services.intents import Classification, intent_classifier
+from services.tracing import span
+from services.log import get_logger
+
+# Context retrieval budgets in seconds (overridable from the environment).
+# A source that misses its timeout is left out of the prompt instead of delaying the LLM call
+CONTEXT_BUDGET = float(os.getenv("CONTEXT_BUDGET", "2.0"))
+SOURCE_TIMEOUTS = {
+    "products": float(os.getenv("CONTEXT_PRODUCTS_TIMEOUT", "1.0")),
+    "orders": float(os.getenv("CONTEXT_ORDERS_TIMEOUT", "0.5")),
+    "profile": float(os.getenv("CONTEXT_PROFILE_TIMEOUT", "0.5")),
+    "history": float(os.getenv("CONTEXT_HISTORY_TIMEOUT", "1.5")),
+}
+# Customer profiles rarely change; keep them per worker instead of querying every turn
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+RECENT_ORDERS = 3
+
+logger = get_logger("retrieval")
+
+
+class SourceResult:
+    """Outcome of one context source: its value, or None with the reason in `status`"""
+    __slots__ = ("name", "value", "status", "elapsed_ms")
+
+    def __init__(self, name: str, value=None, status: str = "ok", elapsed_ms: float = 0.0):
+        self.name = name
+        self.value = value
+        # "ok", "skipped", "timeout", "budget" (total budget ran out) or "error"
+        self.status = status
+        self.elapsed_ms = elapsed_ms
+
+
+class RetrievalResult:
+    """Everything fetched before the LLM call, with per-source timings"""
+    __slots__ = ("sources", "elapsed_ms", "product_ids")
+
+    def __init__(self, sources: Dict[str, SourceResult], elapsed_ms: float, product_ids: Optional[List[int]] = None):
+        self.sources = sources
+        self.elapsed_ms = elapsed_ms
+        # Products shown in the context, so answers built on them can be dropped when they change
+        self.product_ids = product_ids or []
+
+    def value(self, name: str, default=None):
+        source = self.sources.get(name)
+        return source.value if source is not None and source.value is not None else default
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        timings = {name: round(source.elapsed_ms, 2) for name, source in self.sources.items()
+                   if source.status != "skipped"}
+        timings["retrieval"] = round(self.elapsed_ms, 2)
+        return timings
+
+    @property
+    def degraded(self) -> List[str]:
+        return [name for name, source in self.sources.items() if source.status not in ("ok", "skipped")]
+
+
+async def product_context(message: str, db: AsyncSession, include_listing: bool = True,
+                          classification: Optional[Classification] = None, shown: Optional[List[int]] = None) -> str:
+    """Products named in or matching the message, or a short listing for generic product questions.
+    The ids of the products listed are appended to `shown`."""
+    classification = classification or intent_classifier.classify(message)
+    await intent_classifier.refresh(db)
+    context_parts = []
+
+    # Products the message names come first
+    product_ids = list(classification.product_ids)
+    if len(product_ids) < 5:
+        # Search for products matching the message, ranked by the full-text index
+        for product_id in await search_product_ids(db, message, limit=5):
+            if product_id not in product_ids and len(product_ids) < 5:
+                product_ids.append(product_id)
+    if len(product_ids) < 5:
+        # Fill up with semantically similar products ("keep coffee hot" -> Coffee Mug)
+        for product_id in await product_embeddings.search_ids(db, message, limit=5):
+            if product_id not in product_ids and len(product_ids) < 5:
+                product_ids.append(product_id)
+
+    # Product details come from the in-process catalog cache
+    products = await catalog_cache.get_products(db, product_ids)
+    if classification.price_range is not None:
+        # Search hits outside the asked-for price range are noise; named products stay
+        named = set(classification.product_ids)
+        products = [product for product in products
+                    if product.id in named or classification.in_price_range(product.price)]
+    if products:
+        context_parts.append("Matching products:")
+    elif classification.price_range is not None:
+        products = await catalog_cache.get_products(db, await _product_ids_in_range(db, classification.price_range))
+        if products:
+            context_parts.append("Products in that price range:")
+    elif include_listing and classification.wants_listing:
+        # Generic product question: list a few products
+        products = await catalog_cache.get_listing(db, limit=5)
+        if products:
+            context_parts.append("Available products:")
+    for product in products:
+        context_parts.append(f"- {product.name}: ${product.price} ({product.stock_quantity} in stock)")
+    if shown is not None:
+        shown.extend(product.id for product in products)
+
+    return "\n".join(context_parts)
+
+
+async def _product_ids_in_range(db: AsyncSession, price_range: tuple, limit: int = 5) -> List[int]:
+    """The cheapest products within (min, max), served by ix_products_price"""
+    low, high = price_range
+    query = select(Product.id).order_by(Product.price, Product.id).limit(limit)
+    if low is not None:
+        query = query.where(Product.price >= low)
+    if high is not None:
+        query = query.where(Product.price <= high)
+    return list((await db.execute(query)).scalars())
+
+
+async def order_context(message: str, db: AsyncSession, user_id: Optional[int] = None,
+                        classification: Optional[Classification] = None) -> str:
+    """The chatting customer's orders: the ones the message names, otherwise the most recent.
+
+    Orders are only ever looked up through the user's linked customer, and their
+    products are joined in, so this is a single query.
+    """
+    if user_id is None:
+        return ""
+    order_ids = (classification or intent_classifier.classify(message)).order_ids
+    query = (
+        select(Order)
+        .join(User, User.customer_id == Order.customer_id)
+        .where(User.id == user_id)
+        .options(joinedload(Order.product))
+        .order_by(Order.order_date.desc(), Order.id.desc())
+    )
+    query = query.where(Order.id.in_(order_ids)) if order_ids else query.limit(RECENT_ORDERS)
+    orders = (await db.execute(query)).scalars().all()
+
+    context_parts = []
+    if orders:
+        context_parts.append("Your orders:" if order_ids else "Your recent orders:")
+    for order in orders:
+        product = order.product.name if order.product is not None else "unknown product"
+        placed = f"{order.order_date:%Y-%m-%d}" if order.order_date else "unknown date"
+        context_parts.append(
+            f"- Order #{order.id} ({placed}, {order.status}): {order.quantity} x {product}, ${order.total_amount}"
+        )
+    # Never reveal whether someone else's order exists
+    missing = [order_id for order_id in order_ids if order_id not in {order.id for order in orders}]
+    if missing:
+        context_parts.append("No order " + ", ".join(f"#{order_id}" for order_id in missing)
+                             + " was found for this customer.")
+    return "\n".join(context_parts)
+
+
+_profiles: "OrderedDict[int, tuple]" = OrderedDict()
+
+
+async def profile_context(user_id: int, db: AsyncSession) -> str:
+    """The customer record a chat user is linked to"""
+    cached = _profiles.get(user_id)
+    if cached is not None and cached[0] > time.monotonic():
+        _profiles.move_to_end(user_id)
+        return cached[1]
+
+    profile = await _load_profile(user_id, db)
+    _profiles[user_id] = (time.monotonic() + PROFILE_CACHE_TTL, profile)
+    _profiles.move_to_end(user_id)
+    if len(_profiles) > PROFILE_CACHE_SIZE:
+        _profiles.popitem(last=False)
+    return profile
+
+
+async def _load_profile(user_id: int, db: AsyncSession) -> str:
+    result = await db.execute(
+        select(Customer.name, Customer.email, func.count(Order.id))
+        .join(User, User.customer_id == Customer.id)
+        .outerjoin(Order, Order.customer_id == Customer.id)
+        .where(User.id == user_id)
+        .group_by(Customer.id, Customer.name, Customer.email)
+    )
+    row = result.first()
+    if row is None:
+        return ""
+    name, email, order_count = row
+    return f"Customer profile: {name} ({email}), {order_count} previous orders"
+
+
+async def _run_source(name: str, fetch: Callable[[AsyncSession], Awaitable]) -> SourceResult:
+    """Run one source in its own session, so sources can query the database concurrently"""
+    started = time.perf_counter()
+    status, value = "ok", None
+    with span(f"retrieve_{name}") as stage:
+        try:
+            # The session only checks out a connection once the source queries
+            async with AsyncSessionLocal() as db:
+                value = await fetch(db)
+        except asyncio.CancelledError:
+            # Cancelled by retrieve_context when the source ran out of time
+            if stage is not None:
+                stage.set(status="timeout")
+            raise
+        except Exception:
+            status = "error"
+            logger.exception("Context source %s failed", name)
+        if stage is not None:
+            stage.set(status=status)
+    return SourceResult(name, value, status, (time.perf_counter() - started) * 1000)
+
+
+async def retrieve_context(user_message: str, conversation_id: int, user_id: Optional[int] = None,
+                           classification: Optional[Classification] = None) -> RetrievalResult:
+    """Fetch products, orders, the customer profile and conversation history concurrently.
+
+    Each source has its own timeout and all of them share CONTEXT_BUDGET; sources
+    that don't finish in time are reported in `degraded` and left empty.
+    """
+    started = time.perf_counter()
+    # The message's intents decide which sources are worth a query
+    classification = classification or intent_classifier.classify(user_message)
+    is_ecommerce_query = classification.is_ecommerce
+    shown_products: List[int] = []
+    fetchers: Dict[str, Optional[Callable[[AsyncSession], Awaitable]]] = {
+        # Product search runs for every message so "do you have laptops?" finds matches too
+        "products": lambda db: product_context(user_message, db, is_ecommerce_query, classification, shown_products),
+        "orders": (lambda db: order_context(user_message, db, user_id, classification))
+        if user_id is not None and "order" in classification.intents else None,
+        "profile": (lambda db: profile_context(user_id, db)) if user_id is not None and is_ecommerce_query else None,
+        # Recent turns of this conversation, bounded by message count and token budget
+        "history": lambda db: conversation_memory.get_window(conversation_id, db),
+    }
+
+    sources = {name: SourceResult(name, status="skipped") for name, fetch in fetchers.items() if fetch is None}
+    tasks = {
+        asyncio.ensure_future(_run_source(name, fetch)): name
+        for name, fetch in fetchers.items() if fetch is not None
+    }
+    # One wait per expiring deadline instead of a wait_for task per source
+    budget_deadline = started + CONTEXT_BUDGET
+    deadlines = {task: min(started + SOURCE_TIMEOUTS[name], budget_deadline) for task, name in tasks.items()}
+    pending, expired = set(tasks), []
+    try:
+        while pending:
+            timeout = min(deadlines[task] for task in pending) - time.perf_counter()
+            if timeout > 0:
+                await asyncio.wait(pending, timeout=timeout)
+            pending = {task for task in pending if not task.done()}
+            now = time.perf_counter()
+            for task in [task for task in pending if deadlines[task] <= now]:
+                task.cancel()
+                pending.discard(task)
+                expired.append(task)
+                name = tasks[task]
+                status = "budget" if deadlines[task] >= budget_deadline else "timeout"
+                sources[name] = SourceResult(name, status=status, elapsed_ms=(now - started) * 1000)
+    finally:
+        for task in pending:
+            task.cancel()
+        if expired or pending:
+            # Let cancelled sources close their sessions before returning
+            await asyncio.gather(*expired, *pending, return_exceptions=True)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for task, name in tasks.items():
+        if name not in sources:
+            sources[name] = task.result()
+
+    # A products source that timed out never got to list its products
+    product_ids = shown_products if sources["products"].status == "ok" else []
+    result = RetrievalResult({name: sources[name] for name in fetchers}, elapsed_ms, product_ids)
+    if result.degraded:
+        logger.warning("Context sources degraded: %s", ", ".join(result.degraded),
+                       extra={"conversation_id": conversation_id, "timings_ms": result.timings})
+    return result
+
@@ -0,0 +1,147 @@
+import re
+from contextlib import contextmanager
+from typing import List
+from sqlalchemy import select, text, func, literal_column, or_
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Product
+
+# Document searched on Postgres; must match the expression of ix_products_search
+PG_SEARCH_DOCUMENT = (
+    "to_tsvector('english', coalesce(name, '') || ' ' || coalesce(category, '') "
+    "|| ' ' || coalesce(description, ''))"
+)
+
+# Column weights for bm25 on SQLite: name, description, category
+SQLITE_RANK = "bm25(products_fts, 10.0, 2.0, 5.0)"
+
+MAX_QUERY_TERMS = 8
+
+# Words that say nothing about which product is meant
+STOPWORDS = {
+    "a", "about", "all", "an", "and", "any", "are", "be", "buy", "can", "cheap", "cost",
+    "costs", "do", "does", "for", "get", "give", "have", "hello", "hey", "hi", "how", "i", "in",
+    "is", "it", "item", "items", "looking", "me", "much", "my", "need", "of", "on", "or", "order",
+    "orders", "please", "price", "prices", "product", "products", "purchase", "sell", "show",
+    "some", "something", "stock", "tell", "thanks", "the", "there", "this", "to", "want", "what",
+    "whats", "which", "with", "you", "your",
+}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Keep the SQLite index in sync with every write to products
+SQLITE_FTS_TRIGGERS = {
+    "products_fts_insert":
+        "CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN "
+        "INSERT INTO products_fts(rowid, name, description, category) "
+        "VALUES (new.id, new.name, new.description, new.category); END",
+    "products_fts_delete":
+        "CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, description, category) "
+        "VALUES ('delete', old.id, old.name, old.description, old.category); END",
+    "products_fts_update":
+        "CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, description, category) "
+        "VALUES ('delete', old.id, old.name, old.description, old.category); "
+        "INSERT INTO products_fts(rowid, name, description, category) "
+        "VALUES (new.id, new.name, new.description, new.category); END",
+}
+
+
+def query_terms(message: str) -> List[str]:
+    """Extract the distinct search terms of a user message"""
+    terms = []
+    for word in _WORD_RE.findall(message.lower()):
+        if len(word) > 1 and word not in STOPWORDS and word not in terms:
+            terms.append(word)
+    return terms[:MAX_QUERY_TERMS]
+
+
+async def search_product_ids(db: AsyncSession, message: str, limit: int = 5) -> List[int]:
+    """Rank products by relevance to the user's message using the full-text index"""
+    terms = query_terms(message)
+    if not terms:
+        return []
+
+    dialect = db.bind.dialect.name
+    if dialect == "sqlite":
+        # Require every term first (small candidate set, cheap to rank), then any term
+        ids = await _search_sqlite(db, " AND ".join(f'"{term}"' for term in terms), limit)
+        if not ids and len(terms) > 1:
+            ids = await _search_sqlite(db, " OR ".join(f'"{term}"' for term in terms), limit)
+        return ids
+    elif dialect == "postgresql":
+        document = literal_column(PG_SEARCH_DOCUMENT)
+        tsquery = func.to_tsquery("english", " | ".join(terms))
+        result = await db.execute(
+            select(Product.id)
+            .where(document.op("@@")(tsquery))
+            .order_by(func.ts_rank(document, tsquery).desc())
+            .limit(limit)
+        )
+    else:
+        # No full-text support: unranked substring match
+        result = await db.execute(
+            select(Product.id)
+            .where(or_(*[Product.name.ilike(f"%{term}%") for term in terms]))
+            .limit(limit)
+        )
+    return list(result.scalars().all())
+
+
+async def _search_sqlite(db: AsyncSession, match: str, limit: int) -> List[int]:
+    result = await db.execute(
+        text(f"SELECT rowid FROM products_fts WHERE products_fts MATCH :match ORDER BY {SQLITE_RANK} LIMIT :limit"),
+        {"match": match, "limit": limit}
+    )
+    return list(result.scalars().all())
+
+
+def create_search_index(conn):
+    """Migration step: build the product full-text index for the connected backend"""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+            "name, description, category, content='products', content_rowid='id', "
+            "tokenize='porter unicode61')"
+        ))
+        _create_sqlite_triggers(conn)
+    elif dialect == "postgresql":
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_products_search ON products USING GIN ({PG_SEARCH_DOCUMENT})"
+        ))
+
+
+def _has_sqlite_index(conn: Connection) -> bool:
+    return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")).first() is not None
+
+
+def _create_sqlite_triggers(conn: Connection):
+    for statement in SQLITE_FTS_TRIGGERS.values():
+        conn.execute(text(statement))
+    conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+
+
+def restore_search_triggers(conn: Connection):
+    """Recreate SQLite full-text triggers missing after an interrupted bulk load, rebuilding the index"""
+    if conn.dialect.name != "sqlite" or not _has_sqlite_index(conn):
+        return
+    present = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars())
+    if not set(SQLITE_FTS_TRIGGERS) <= present:
+        _create_sqlite_triggers(conn)
+
+
+@contextmanager
+def search_triggers_suspended(engine: Engine):
+    """Bulk loads on SQLite: drop the per-row full-text triggers and rebuild the index once afterwards"""
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            if _has_sqlite_index(conn):
+                for name in SQLITE_FTS_TRIGGERS:
+                    conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    try:
+        yield
+    finally:
+        with engine.begin() as conn:
+            restore_search_triggers(conn)
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+from services.log import get_logger
+
+# Shared cache settings (overridable from the environment).
+# Empty disables the shared tier, "memory://" is the in-process stand-in,
+# "redis://host:6379/0" shares state between all workers and nodes
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "")
+SHARED_CACHE_PREFIX = os.getenv("SHARED_CACHE_PREFIX", "think41:")
+SHARED_CACHE_MAX_CONNECTIONS = int(os.getenv("SHARED_CACHE_MAX_CONNECTIONS", "50"))
+SHARED_CACHE_TIMEOUT = float(os.getenv("SHARED_CACHE_TIMEOUT", "0.5"))
+
+logger = get_logger("shared_cache")
+
+
+class SharedCache:
+    """Key/value cache shared by workers; values must be JSON-serialisable.
+
+    Cache errors are never raised to callers: a failed read is a miss and a
+    failed write is dropped, so requests fall back to the database.
+    """
+
+    name = "base"
+
+    async def get(self, key: str) -> Optional[Any]:
+        return (await self.get_many([key]))[0]
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self.set_many({key: value}, ttl)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        raise NotImplementedError
+
+    async def set_many(self, items: Dict[str, Any], ttl: float):
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def update(self, key: str, change: Callable[[Optional[Any]], Optional[Any]], ttl: float) -> Optional[Any]:
+        """Atomically replace the value with change(value) and return it.
+
+        When change returns None the value is left alone. change may run more
+        than once if another writer got in first, so it must not have side effects
+        beyond its return value.
+        """
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+
+class MemorySharedCache(SharedCache):
+    """In-process stand-in with the same semantics (values round-trip through JSON)"""
+
+    name = "memory"
+
+    def __init__(self, prefix: str = SHARED_CACHE_PREFIX):
+        self.prefix = prefix
+        self._entries: Dict[str, tuple] = {}
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        now = time.monotonic()
+        values = []
+        for key in keys:
+            entry = self._entries.get(self.prefix + key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[self.prefix + key]
+                entry = None
+            values.append(json.loads(entry[1]) if entry is not None else None)
+        return values
+
+    async def set_many(self, items: Dict[str, Any], ttl: float):
+        expires_at = time.monotonic() + ttl
+        for key, value in items.items():
+            self._entries[self.prefix + key] = (expires_at, json.dumps(value))
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(self.prefix + key, None)
+
+    async def update(self, key: str, change: Callable[[Optional[Any]], Optional[Any]], ttl: float) -> Optional[Any]:
+        # No await between the read and the write, so nothing can interleave
+        value = change((await self.get_many([key]))[0])
+        if value is not None:
+            await self.set_many({key: value}, ttl)
+        return value
+
+
+class RedisSharedCache(SharedCache):
+    """Redis (or any server speaking its protocol) through a pooled asyncio client"""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = SHARED_CACHE_PREFIX,
+                 max_connections: int = SHARED_CACHE_MAX_CONNECTIONS, timeout: float = SHARED_CACHE_TIMEOUT):
+        # Optional dependency: only needed when a redis:// URL is configured
+        from redis import asyncio as aioredis
+
+        self.prefix = prefix
+        # Blocking pool: a burst waits briefly for a free connection instead of failing
+        self._pool = aioredis.BlockingConnectionPool.from_url(
+            url,
+            max_connections=max_connections,
+            timeout=timeout,
+            socket_timeout=timeout,
+            socket_connect_timeout=timeout
+        )
+        self._client = aioredis.Redis(connection_pool=self._pool)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        if not keys:
+            return []
+        try:
+            # One round trip for the whole batch
+            raw = await self._client.mget([self.prefix + key for key in keys])
+        except Exception as e:
+            # The queued logger never blocks the request on a Redis outage
+            logger.warning("Shared cache read failed: %s", e)
+            return [None] * len(keys)
+        return [json.loads(value) if value is not None else None for value in raw]
+
+    async def set_many(self, items: Dict[str, Any], ttl: float):
+        if not items:
+            return
+        try:
+            # Pipelined SETs with expiry, sent as one batch (no MULTI/EXEC needed)
+            async with self._client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(self.prefix + key, json.dumps(value), px=max(1, int(ttl * 1000)))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Shared cache write failed: %s", e)
+
+    async def delete(self, *keys: str):
+        if not keys:
+            return
+        try:
+            await self._client.delete(*[self.prefix + key for key in keys])
+        except Exception as e:
+            logger.warning("Shared cache delete failed: %s", e)
+
+    async def update(self, key: str, change: Callable[[Optional[Any]], Optional[Any]], ttl: float) -> Optional[Any]:
+        from redis.exceptions import WatchError
+
+        name = self.prefix + key
+        try:
+            async with self._client.pipeline(transaction=True) as pipe:
+                # Optimistic transaction: retried when another worker wrote the key in between
+                while True:
+                    try:
+                        await pipe.watch(name)
+                        raw = await pipe.get(name)
+                        value = change(json.loads(raw) if raw is not None else None)
+                        if value is None:
+                            return None
+                        pipe.multi()
+                        pipe.set(name, json.dumps(value), px=max(1, int(ttl * 1000)))
+                        await pipe.execute()
+                        return value
+                    except WatchError:
+                        continue
+        except Exception as e:
+            logger.warning("Shared cache update failed: %s", e)
+            return None
+
+    async def aclose(self):
+        await self._client.aclose()
+        await self._pool.disconnect()
+
+
+_shared_cache: Optional[SharedCache] = None
+_initialized = False
+
+
+def create_shared_cache(url: str = SHARED_CACHE_URL) -> Optional[SharedCache]:
+    """Build the backend selected by URL scheme; None when no URL is configured"""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemorySharedCache()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSharedCache(url)
+    raise ValueError(f"Unknown shared cache URL: {url}")
+
+
+def get_shared_cache() -> Optional[SharedCache]:
+    """Return the process-wide shared cache, or None when it is disabled"""
+    global _shared_cache, _initialized
+    if not _initialized:
+        _initialized = True
+        try:
+            _shared_cache = create_shared_cache()
+            if _shared_cache is not None:
+                logger.info("Shared cache initialized: %s", _shared_cache.name)
+        except Exception:
+            logger.exception("Shared cache initialization failed")
+    return _shared_cache
+
+
+async def close_shared_cache():
+    global _shared_cache, _initialized
+    if _shared_cache is not None:
+        await _shared_cache.aclose()
+    _shared_cache = None
+    _initialized = False
@@ -0,0 +1,131 @@
+import os
+import asyncio
+from typing import Optional, Set
+from sqlalchemy import select
+from database import AsyncSessionLocal
+from models import Message, ConversationSummary
+from services.memory import conversation_memory, estimate_tokens
+from services.providers import get_provider, DEFAULT_MODEL
+from services.llm_router import LLMUnavailableError, answer_cacheable
+from services.log import get_logger
+
+# Summarisation settings (overridable from the environment)
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", "6"))
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "4000"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+
+logger = get_logger("summarizer")
+
+SUMMARY_PROMPT = """Summarise the conversation between a customer and an e-commerce assistant.
+Keep facts the assistant will need later: products, order numbers, preferences and open questions.
+Reply with the summary only, in at most a few short paragraphs."""
+
+
+class ConversationSummarizer:
+    """Background worker that folds older messages into a stored conversation summary"""
+
+    def __init__(self):
+        self._queue: "asyncio.Queue[int]" = asyncio.Queue()
+        self._pending: Set[int] = set()
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def schedule(self, conversation_id: int):
+        """Queue a conversation for summarisation; duplicates are ignored"""
+        if self._worker is None or conversation_id in self._pending:
+            return
+        self._pending.add(conversation_id)
+        self._queue.put_nowait(conversation_id)
+
+    async def _run(self):
+        while True:
+            conversation_id = await self._queue.get()
+            try:
+                await self.summarize(conversation_id)
+            except Exception:
+                logger.exception("Summarisation of conversation %d failed", conversation_id,
+                                 extra={"conversation_id": conversation_id})
+            finally:
+                self._pending.discard(conversation_id)
+
+    async def summarize(self, conversation_id: int):
+        provider = get_provider()
+        if not provider:
+            return
+
+        async with AsyncSessionLocal() as db:
+            summary = await db.get(ConversationSummary, conversation_id)
+            query = (
+                select(Message.id, Message.sender, Message.content)
+                .where(Message.conversation_id == conversation_id)
+                .order_by(Message.timestamp.asc(), Message.id.asc())
+            )
+            if summary:
+                query = query.where(Message.id > summary.last_message_id)
+            rows = (await db.execute(query)).all()
+
+            # The most recent messages stay verbatim in the prompt window; everything
+            # older is folded in, however short, so nothing falls out of the prompt unsummarised
+            older = rows[:-SUMMARY_KEEP_MESSAGES]
+            if not older:
+                return
+
+            text = summary.content if summary else ""
+            last_message_id = None
+            chunk, chunk_tokens = [], 0
+            for message_id, sender, content in older:
+                chunk.append(f"{sender}: {content}")
+                chunk_tokens += estimate_tokens(content)
+                last_message_id = message_id
+                if chunk_tokens >= SUMMARY_CHUNK_TOKENS:
+                    text = await self._fold(provider, text, chunk)
+                    chunk, chunk_tokens = [], 0
+            if chunk:
+                text = await self._fold(provider, text, chunk)
+
+            if summary:
+                summary.content = text
+                summary.last_message_id = last_message_id
+            else:
+                db.add(ConversationSummary(
+                    conversation_id=conversation_id,
+                    content=text,
+                    last_message_id=last_message_id
+                ))
+            await db.commit()
+
+        await conversation_memory.set_summary(conversation_id, text, last_message_id)
+
+    async def _fold(self, provider, summary: str, transcript: list) -> str:
+        """Merge one chunk of transcript into the running summary"""
+        content = "\n".join(transcript)
+        if summary:
+            content = f"Summary so far:\n{summary}\n\nNew messages:\n{content}"
+        folded = await provider.complete(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            model=DEFAULT_MODEL,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0.2
+        )
+        # A canned fallback reply is no summary; keep the messages until a model answers
+        if not answer_cacheable():
+            raise LLMUnavailableError("Only the rule-based fallback answered the summary prompt")
+        return folded
+
+
+summarizer = ConversationSummarizer()
@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import queue
+import random
+import secrets
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+import httpx
+
+# Tracing settings (overridable from the environment)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+# One OTLP/JSON ExportTraceServiceRequest per line (the collector "file" exporter format); empty disables
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "logs/traces.jsonl")
+# Optional OTLP/HTTP JSON endpoint, e.g. http://localhost:4318/v1/traces
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+# Share of traces exported; slow traces are always exported
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+# Share of slow traces also written to the slow-request log
+TRACE_SLOW_LOG_SAMPLE_RATE = float(os.getenv("TRACE_SLOW_LOG_SAMPLE_RATE", "1.0"))
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "think41-chatbot")
+
+EXPORT_BATCH_SIZE = 256
+
+slow_log = logging.getLogger("think41.slow_requests")
+
+
+class Trace:
+    """Spans of one request, kept until the request ends so slow ones can be exported whole"""
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, trace_id: Optional[str] = None, sampled: Optional[bool] = None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.sampled = random.random() < TRACE_SAMPLE_RATE if sampled is None else sampled
+        self.spans: List["Span"] = []
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str] = None, kind: int = 1,
+                 attributes: Optional[dict] = None):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind  # OTLP SpanKind: 1 internal, 2 server
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        trace.spans.append(self)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if error is not None:
+                self.error = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_ids() -> Optional[tuple]:
+    """(trace_id, span_id) of the active span, for log correlation"""
+    current = _current_span.get()
+    return (current.trace.trace_id, current.span_id) if current is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a pipeline stage as a child of the active span (a no-op outside traced requests)"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes=attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.end(e)
+        raise
+    finally:
+        child.end()
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Async generators may be closed from another task's context
+            pass
+
+
+class SpanExporter:
+    """Writes finished traces from a background thread, so exporting never blocks the event loop"""
+
+    def __init__(self, path: str = TRACE_EXPORT_PATH, endpoint: str = TRACE_OTLP_ENDPOINT):
+        self.path = path
+        self.endpoint = endpoint
+        self._queue: "queue.SimpleQueue[Optional[dict]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.exported = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path or self.endpoint)
+
+    def export(self, trace: Trace):
+        if not self.enabled:
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+        self._queue.put([span.to_otlp() for span in trace.spans])
+
+    def stop(self, timeout: float = 5.0):
+        """Flush queued traces and stop the thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        fd = None
+        client = httpx.Client(timeout=5.0) if self.endpoint else None
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # O_APPEND with one write per line keeps lines whole across worker processes
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < EXPORT_BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stopping = None in batch
+                traces = [spans for spans in batch if spans is not None]
+                if traces:
+                    self._write(fd, client, traces)
+                if stopping:
+                    return
+        finally:
+            if fd is not None:
+                os.close(fd)
+            if client is not None:
+                client.close()
+
+    def _write(self, fd, client, traces: List[List[dict]]):
+        if fd is not None:
+            for spans in traces:
+                os.write(fd, (json.dumps(_export_request(spans)) + "\n").encode())
+        if client is not None:
+            try:
+                client.post(self.endpoint, json=_export_request([span for spans in traces for span in spans]))
+            except httpx.HTTPError as e:
+                logging.getLogger("think41.tracing").warning("OTLP export failed: %s", e)
+        self.exported += len(traces)
+
+
+def _export_request(spans: List[dict]) -> dict:
+    return {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+            {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+        ]},
+        "scopeSpans": [{"scope": {"name": "think41"}, "spans": spans}],
+    }]}
+
+
+exporter = SpanExporter()
+
+
+def _parse_traceparent(headers) -> tuple:
+    """Trace id, parent span id and sampled flag from a W3C traceparent header"""
+    for name, value in headers:
+        if name == b"traceparent":
+            parts = value.decode("latin-1").split("-")
+            if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+                return parts[1], parts[2], parts[3] == "01"
+    return None, None, None
+
+
+def _finish(trace: Trace, root: Span):
+    slow = root.duration_ms >= TRACE_SLOW_MS
+    if trace.sampled or slow:
+        exporter.export(trace)
+    if slow and random.random() < TRACE_SLOW_LOG_SAMPLE_RATE:
+        stages: Dict[str, float] = {}
+        for child in trace.spans:
+            if child.parent_id == root.span_id:
+                stages[child.name] = stages.get(child.name, 0.0) + child.duration_ms
+        slow_log.warning(
+            "Slow request %s took %.0f ms (%s)", root.name, root.duration_ms,
+            ", ".join(f"{name}={ms:.0f}ms" for name, ms in stages.items()),
+            extra={"trace_id": trace.trace_id, "duration_ms": round(root.duration_ms, 1),
+                   "stages_ms": {name: round(ms, 1) for name, ms in stages.items()}}
+        )
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a root span per HTTP request and returning its trace id in X-Trace-Id"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        trace_id, parent_id, sampled = _parse_traceparent(scope["headers"])
+        trace = Trace(trace_id, sampled)
+        root = Span(trace, f"{scope['method']} {scope['path']}", parent_id, kind=2,
+                    attributes={"http.method": scope["method"], "http.target": scope["path"]})
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                root.set(**{"http.status_code": message["status"]})
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-trace-id", trace.trace_id.encode())
+                ]
+            await send(message)
+
+        token = _current_span.set(root)
+        error = None
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                root.name = f"{scope['method']} {route}"
+                root.set(**{"http.route": route})
+            root.end(error)
+            _finish(trace, root)
@@ -0,0 +1,153 @@
+import os
+import asyncio
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import update
+from database import AsyncSessionLocal
+from models import ConversationSession, Message
+from services.log import get_logger
+
+# Write batching settings (overridable from the environment)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+# How long a write may wait for others to join its batch
+WRITE_BEHIND_MAX_DELAY_MS = float(os.getenv("WRITE_BEHIND_MAX_DELAY_MS", "2"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "256"))
+
+logger = get_logger("write_behind")
+
+
+class PendingWrite:
+    __slots__ = ("conversation_id", "sender", "content", "timestamp", "future")
+
+    def __init__(self, conversation_id: int, sender: str, content: str, future: asyncio.Future):
+        self.conversation_id = conversation_id
+        self.sender = sender
+        self.content = content
+        self.timestamp = datetime.utcnow()
+        self.future = future
+
+    def to_message(self) -> Message:
+        return Message(conversation_id=self.conversation_id, sender=self.sender,
+                       content=self.content, timestamp=self.timestamp)
+
+
+class MessageWriter:
+    """Group commit for chat messages: writes from concurrent requests share one transaction.
+
+    Callers await the commit of their batch, so a returned message is durable and
+    visible to the caller's next read; batching only adds up to the max delay.
+    """
+
+    def __init__(self, enabled: bool = WRITE_BEHIND, session_factory=AsyncSessionLocal,
+                 max_delay_ms: float = WRITE_BEHIND_MAX_DELAY_MS, max_batch: int = WRITE_BEHIND_MAX_BATCH):
+        self.enabled = enabled
+        self.session_factory = session_factory
+        self.max_delay = max_delay_ms / 1000
+        self.max_batch = max_batch
+        self._pending: List[PendingWrite] = []
+        self._wakeup = asyncio.Event()
+        self._stop_requested = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.batches = 0
+        self.writes = 0
+
+    def start(self):
+        if self.enabled and self._worker is None:
+            self._stopping = False
+            self._stop_requested.clear()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the worker"""
+        if self._worker is not None:
+            self._stopping = True
+            self._stop_requested.set()
+            self._wakeup.set()
+            await self._worker
+            self._worker = None
+            # Writes queued after the worker's last check are committed on their own
+            pending, self._pending = self._pending, []
+            for write in pending:
+                await self._flush_one(write)
+
+    async def write(self, conversation_id: int, sender: str, content: str) -> Message:
+        """Persist a message and bump its conversation; returns once committed"""
+        future = asyncio.get_running_loop().create_future()
+        write = PendingWrite(conversation_id, sender, content, future)
+        if self._worker is None:
+            # Not running (disabled or shutting down): commit on its own
+            await self._flush_one(write)
+        else:
+            self._pending.append(write)
+            self._wakeup.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let concurrent requests join the batch; writes arriving while a batch
+            # commits are picked up by the next one. stop() cuts the delay short
+            if len(self._pending) < self.max_batch and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._stop_requested.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if self._pending:
+                self._wakeup.set()
+            if batch:
+                await self._flush(batch)
+            # Checked after the flush too: a stop() during the sleep above had its
+            # wakeup cleared, so waiting again would never return
+            if self._stopping and not self._pending:
+                return
+
+    async def _flush(self, batch: List[PendingWrite]):
+        messages = [write.to_message() for write in batch]
+        async with self.session_factory() as db:
+            try:
+                db.add_all(messages)
+                await db.execute(
+                    update(ConversationSession)
+                    .where(ConversationSession.id.in_({write.conversation_id for write in batch}))
+                    .values(updated_at=datetime.utcnow())
+                )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                logger.exception("Batched write of %d messages failed, retrying one by one", len(batch),
+                                 extra={"conversation_ids": sorted({write.conversation_id for write in batch})})
+                for write in batch:
+                    await self._flush_one(write)
+                return
+
+        self.batches += 1
+        self.writes += len(batch)
+        for write, message in zip(batch, messages):
+            # The caller may have gone away (client disconnect); the write still stands
+            if not write.future.done():
+                write.future.set_result(message)
+
+    async def _flush_one(self, write: PendingWrite):
+        message = write.to_message()
+        async with self.session_factory() as db:
+            try:
+                db.add(message)
+                await db.execute(
+                    update(ConversationSession)
+                    .where(ConversationSession.id == write.conversation_id)
+                    .values(updated_at=write.timestamp)
+                )
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                if not write.future.done():
+                    write.future.set_exception(e)
+                return
+        if not write.future.done():
+            write.future.set_result(message)
+
+
+message_writer = MessageWriter()
@@ -19,6 +19,52 @@ export const chatAPI = {
     return response.json();
   },
 
+  // Send message and stream the AI response (Server-Sent Events)
+  streamMessage: async (data, { onStart, onToken, onDone } = {}) => {
+    const response = await fetch(`${API_BASE_URL}/api/chat/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify(data)
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.detail || 'Failed to send message');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Events are separated by a blank line
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const raw = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = 'message';
+        let payload = '';
+        for (const line of raw.split('\n')) {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          else if (line.startsWith('data: ')) payload += line.slice(6);
+        }
+        const eventData = payload ? JSON.parse(payload) : {};
+
+        if (event === 'start' && onStart) onStart(eventData);
+        else if (event === 'token' && onToken) onToken(eventData.delta);
+        else if (event === 'done' && onDone) onDone(eventData);
+        else if (event === 'error') throw new Error(eventData.detail || 'Stream failed');
+      }
+    }
+  },
+
   // Create new user
   createUser: async (userData) => {
     const response = await fetch(`${API_BASE_URL}/api/users`, {
@@ -38,15 +84,19 @@ export const chatAPI = {
   },
 
   // Get user conversations (now real API call)
-  getUserConversations: async (userId) => {
-    const response = await fetch(`${API_BASE_URL}/api/users/${userId}/conversations`);
+  // Pass { before, before_id } from the last conversation to fetch the next page
+  getUserConversations: async (userId, params = {}) => {
+    const query = new URLSearchParams(params).toString();
+    const response = await fetch(`${API_BASE_URL}/api/users/${userId}/conversations${query ? `?${query}` : ''}`);
     if (!response.ok) throw new Error('Failed to fetch conversations');
     return response.json();
   },
 
   // Get conversation messages (now real API call)
-  getConversationMessages: async (conversationId) => {
-    const response = await fetch(`${API_BASE_URL}/api/conversations/${conversationId}/messages`);
+  // Pass { before_id } with the oldest loaded message id to fetch earlier messages
+  getConversationMessages: async (conversationId, params = {}) => {
+    const query = new URLSearchParams(params).toString();
+    const response = await fetch(`${API_BASE_URL}/api/conversations/${conversationId}/messages${query ? `?${query}` : ''}`);
     if (!response.ok) throw new Error('Failed to fetch messages');
     return response.json();
   },
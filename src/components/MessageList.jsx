@@ -1,22 +1,53 @@
-import React, { useEffect, useRef } from 'react';
+import React, { useLayoutEffect, useRef } from 'react';
 import Message from './Message';
 import { useChatStore } from '../store/chatState';
 import './MessageList.css';
 
 const MessageList = () => {
-  const { messages, isLoading } = useChatStore();
+  const { messages, isLoading, hasOlderMessages, isLoadingOlder, loadOlderMessages } = useChatStore();
   const messagesEndRef = useRef(null);
+  const listRef = useRef(null);
+  // Scroll height before older messages were prepended
+  const prependHeightRef = useRef(null);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
-  useEffect(() => {
-    scrollToBottom();
+  useLayoutEffect(() => {
+    const list = listRef.current;
+    if (prependHeightRef.current !== null && list) {
+      // Keep the messages on screen in place instead of jumping to the bottom
+      list.scrollTop += list.scrollHeight - prependHeightRef.current;
+      prependHeightRef.current = null;
+    } else {
+      scrollToBottom();
+    }
   }, [messages]);
 
+  const loadOlder = async () => {
+    if (!hasOlderMessages || isLoadingOlder) return;
+    prependHeightRef.current = listRef.current?.scrollHeight ?? null;
+    const added = await loadOlderMessages();
+    if (!added) {
+      prependHeightRef.current = null;
+    }
+  };
+
+  const handleScroll = () => {
+    if (listRef.current?.scrollTop === 0) {
+      loadOlder();
+    }
+  };
+
   return (
-    <div className="message-list">
+    <div className="message-list" ref={listRef} onScroll={handleScroll}>
+      {hasOlderMessages && (
+        <button className="load-earlier" onClick={loadOlder} disabled={isLoadingOlder}>
+          {isLoadingOlder ? 'Loading earlier messages…' : 'Load earlier messages'}
+        </button>
+      )}
+
       {messages.length === 0 ? (
         <div className="welcome-message">
           <div className="welcome-content">
@@ -1,6 +1,9 @@
 import { create } from 'zustand';
 import { chatAPI } from '../api/chat';
 
+// Messages fetched per history page (the endpoint's default page size)
+const MESSAGE_PAGE_SIZE = 50;
+
 export const useChatStore = create((set, get) => ({
   // State
   messages: [],
@@ -9,6 +12,8 @@ export const useChatStore = create((set, get) => ({
   currentUser: null,
   isLoading: false,
   error: null,
+  hasOlderMessages: false,
+  isLoadingOlder: false,
 
   // Actions
   setCurrentUser: (user) => set({ currentUser: user }),
@@ -19,6 +24,12 @@ export const useChatStore = create((set, get) => ({
     messages: [...state.messages, message]
   })),
 
+  updateMessage: (id, changes) => set((state) => ({
+    messages: state.messages.map((message) =>
+      message.id === id ? { ...message, ...changes } : message
+    )
+  })),
+
   setLoading: (isLoading) => set({ isLoading }),
 
   setError: (error) => set({ error }),
@@ -46,27 +57,42 @@ export const useChatStore = create((set, get) => ({
     };
     addMessage(userMessage);
 
+    // Placeholder AI message filled in as tokens arrive
+    const streamingId = `streaming-${Date.now()}`;
+    let streamedContent = '';
+
     try {
-      const response = await chatAPI.sendMessage({
+      await chatAPI.streamMessage({
         user_id: currentUser.id.toString(),
         message: content,
         conversation_id: currentConversationId
+      }, {
+        onStart: ({ conversation_id }) => {
+          // Update conversation ID if new
+          if (conversation_id !== currentConversationId) {
+            set({ currentConversationId: conversation_id });
+          }
+          addMessage({
+            id: streamingId,
+            content: '',
+            sender: 'ai',
+            timestamp: new Date().toISOString()
+          });
+          setLoading(false);
+        },
+        onToken: (delta) => {
+          streamedContent += delta;
+          get().updateMessage(streamingId, { content: streamedContent });
+        },
+        onDone: ({ ai_response }) => {
+          get().updateMessage(streamingId, {
+            id: ai_response.id,
+            content: ai_response.content,
+            timestamp: ai_response.timestamp
+          });
+        }
       });
 
-      // Update conversation ID if new
-      if (response.conversation_id !== currentConversationId) {
-        set({ currentConversationId: response.conversation_id });
-      }
-
-      // Add AI response
-      const aiMessage = {
-        id: response.ai_response.id,
-        content: response.ai_response.content,
-        sender: 'ai',
-        timestamp: response.ai_response.timestamp
-      };
-      addMessage(aiMessage);
-
       // Update conversations list
       get().loadConversations();
 
@@ -86,9 +112,13 @@ export const useChatStore = create((set, get) => ({
     setError(null);
 
     try {
-      const messages = await chatAPI.getConversationMessages(conversationId);
+      // Only the newest page; older ones load as the user scrolls up
+      const messages = await chatAPI.getConversationMessages(conversationId, { limit: MESSAGE_PAGE_SIZE });
       setMessages(messages);
-      set({ currentConversationId: conversationId });
+      set({
+        currentConversationId: conversationId,
+        hasOlderMessages: messages.length === MESSAGE_PAGE_SIZE
+      });
     } catch (error) {
       console.error('Failed to load conversation:', error);
       setError('Failed to load conversation');
@@ -97,6 +127,33 @@ export const useChatStore = create((set, get) => ({
     }
   },
 
+  // Prepend the page before the oldest loaded message; returns how many were added
+  loadOlderMessages: async () => {
+    const { currentConversationId, messages, hasOlderMessages, isLoadingOlder } = get();
+    if (!currentConversationId || !hasOlderMessages || isLoadingOlder || messages.length === 0) return 0;
+
+    set({ isLoadingOlder: true });
+    try {
+      const page = await chatAPI.getConversationMessages(currentConversationId, {
+        limit: MESSAGE_PAGE_SIZE,
+        before_id: messages[0].id
+      });
+      // Ignore a page that arrives after the user switched conversations
+      if (get().currentConversationId !== currentConversationId) return 0;
+      set((state) => ({
+        messages: [...page, ...state.messages],
+        hasOlderMessages: page.length === MESSAGE_PAGE_SIZE
+      }));
+      return page.length;
+    } catch (error) {
+      console.error('Failed to load earlier messages:', error);
+      get().setError('Failed to load earlier messages');
+      return 0;
+    } finally {
+      set({ isLoadingOlder: false });
+    }
+  },
+
   // Load conversations list
   loadConversations: async () => {
     const { currentUser } = get();
@@ -114,7 +171,8 @@ export const useChatStore = create((set, get) => ({
   startNewConversation: () => {
     set({
       messages: [],
-      currentConversationId: null
+      currentConversationId: null,
+      hasOlderMessages: false
     });
   },
 
@@ -126,7 +184,9 @@ export const useChatStore = create((set, get) => ({
       currentConversationId: null,
       currentUser: null,
       isLoading: false,
-      error: null
+      error: null,
+      hasOlderMessages: false,
+      isLoadingOlder: false
     });
   }
 }));
\ No newline at end of file
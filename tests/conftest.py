@@ -0,0 +1,14 @@
+import os
+import tempfile
+
+# Set before the app modules read their configuration at import time
+_tmp = tempfile.mkdtemp(prefix="think41-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_tmp}/test.db",
+    "LLM_PROVIDER": "stub",
+    "STUB_LLM_LATENCY": "0",
+    "SHARED_CACHE_URL": "",
+    "TRACE_EXPORT_PATH": "",
+    "EMBEDDING_MODEL": "",
+    "EMBEDDING_INDEX_PATH": f"{_tmp}/product_vectors",
+})
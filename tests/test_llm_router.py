@@ -0,0 +1,129 @@
+import asyncio
+import time
+import httpx
+import pytest
+from services.providers import LLMProvider
+from services.llm_router import CoalescingProvider, LLMUnavailableError, ProviderRouter
+
+MESSAGES = [{"role": "user", "content": "Which jackets are in stock?"}]
+
+
+class FakeProvider(LLMProvider):
+    """Answers after `delay` seconds, or raises `error`; counts upstream calls"""
+
+    def __init__(self, name: str, reply: str = "ok", delay: float = 0.0, error: Exception = None):
+        super().__init__(timeout=5)
+        self.name = name
+        self.reply = reply
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def _complete(self, messages, model, max_tokens, temperature) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+
+def test_identical_concurrent_calls_share_one_upstream_call():
+    upstream = FakeProvider("fake", delay=0.05)
+    provider = CoalescingProvider(upstream)
+
+    async def run():
+        replies = await asyncio.gather(*(provider.complete(MESSAGES) for _ in range(10)))
+
+        async def follow():
+            return [chunk async for chunk in provider.stream(MESSAGES)]
+
+        streamed = await asyncio.gather(*(follow() for _ in range(10)))
+        return replies, streamed
+
+    replies, streamed = asyncio.run(run())
+    assert replies == ["ok"] * 10
+    assert streamed == [["ok"]] * 10
+    # One completion and one stream upstream
+    assert upstream.calls == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call():
+    upstream = FakeProvider("fake", delay=0.05)
+    provider = CoalescingProvider(upstream)
+
+    async def run():
+        callers = [asyncio.ensure_future(provider.complete(MESSAGES)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        callers[0].cancel()
+        return await asyncio.gather(*callers, return_exceptions=True)
+
+    first, *rest = asyncio.run(run())
+    assert isinstance(first, asyncio.CancelledError)
+    assert rest == ["ok", "ok"]
+    assert upstream.calls == 1
+
+
+def test_call_abandoned_by_every_waiter_is_not_joined_again():
+    upstream = FakeProvider("fake", delay=0.05)
+    provider = CoalescingProvider(upstream)
+
+    async def run():
+        abandoned = asyncio.ensure_future(provider.complete(MESSAGES))
+        await asyncio.sleep(0.01)
+        abandoned.cancel()
+        await asyncio.sleep(0)
+        return await provider.complete(MESSAGES)
+
+    assert asyncio.run(run()) == "ok"
+    assert upstream.calls == 2
+
+
+def test_breaker_opens_and_calls_fall_back_to_the_next_provider():
+    down = FakeProvider("down", error=httpx.ConnectError("connection refused"))
+    backup = FakeProvider("backup", reply="from backup")
+    router = ProviderRouter([down, backup], retries=0, hedge_percentile=0)
+    router.backends[0].breaker.failure_threshold = 2
+
+    async def run():
+        return [await router.complete(MESSAGES) for _ in range(4)]
+
+    assert asyncio.run(run()) == ["from backup"] * 4
+    assert router.backends[0].breaker.state == "open"
+    # Once open, the failing provider isn't called at all
+    assert down.calls == 2
+    assert backup.calls == 4
+
+
+def test_non_transient_errors_do_not_open_the_breaker():
+    broken = FakeProvider("broken", error=ValueError("bad request"))
+    backup = FakeProvider("backup")
+    router = ProviderRouter([broken, backup], retries=2, hedge_percentile=0)
+    router.backends[0].breaker.failure_threshold = 1
+
+    assert asyncio.run(router.complete(MESSAGES)) == "ok"
+    assert router.backends[0].breaker.state == "closed"
+    # Not retried either
+    assert broken.calls == 1
+
+
+def test_deadline_raises_llm_unavailable():
+    slow = FakeProvider("slow", delay=2)
+    router = ProviderRouter([slow], retries=0, deadline=0.1, hedge_percentile=0)
+
+    started = time.monotonic()
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(router.complete(MESSAGES))
+    assert time.monotonic() - started < 1
+
+
+def test_slow_call_is_hedged_on_the_next_provider():
+    slow = FakeProvider("slow", reply="slow", delay=2)
+    fast = FakeProvider("fast", reply="fast")
+    router = ProviderRouter([slow, fast], retries=0, hedge_percentile=95)
+    for _ in range(50):
+        router.backends[0].latency.add(0.01)
+
+    started = time.monotonic()
+    assert asyncio.run(router.complete(MESSAGES)) == "fast"
+    assert time.monotonic() - started < 1
+    assert (slow.calls, fast.calls) == (1, 1)
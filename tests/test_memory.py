@@ -0,0 +1,27 @@
+import asyncio
+from services import shared_cache
+from services.memory import ConversationMemory, ConversationWindow
+
+
+def test_window_reports_only_the_tokens_each_append_dropped():
+    window = ConversationWindow(max_messages=3)
+    for text in ("one", "two", "three"):
+        window.append("user", text)
+    assert window.dropped_tokens == 0
+    window.append("user", "four")
+    assert window.dropped_tokens == 1
+    assert [m["content"] for m in window.to_chat_messages()] == ["two", "three", "four"]
+
+
+def test_concurrent_appends_through_the_shared_cache_keep_every_message(monkeypatch):
+    monkeypatch.setattr(shared_cache, "_shared_cache", shared_cache.MemorySharedCache())
+    monkeypatch.setattr(shared_cache, "_initialized", True)
+    memory = ConversationMemory()
+
+    async def run():
+        await shared_cache.get_shared_cache().set("conversation:1", ConversationWindow().to_state(), 60)
+        await asyncio.gather(*(memory.append(1, "user", f"message {i}", i) for i in range(10)))
+        return await memory._cached(1)
+
+    window = asyncio.run(run())
+    assert [message_id for message_id, _, _, _ in window.messages] == list(range(10))
@@ -0,0 +1,51 @@
+import asyncio
+import numpy as np
+from services.response_cache import ResponseCache
+
+
+class SameMeaningEncoder:
+    """Stands in for an embedding model that rates every question as identical"""
+    dim = 4
+    name = "same-meaning"
+
+    def encode(self, texts):
+        return np.ones((len(texts), self.dim), dtype=np.float32) / 2
+
+
+def _ask(question):
+    return [{"role": "system", "content": "You are a shop assistant"}, {"role": "user", "content": question}]
+
+
+def _lookup(cache, cached, asked):
+    async def run():
+        await cache.put(_ask(cached), "model", f"answer to {cached}")
+        return await cache.get(_ask(asked), "model")
+    return asyncio.run(run())
+
+
+def test_similarity_tier_is_off_by_default():
+    cache = ResponseCache()
+    assert cache.similarity == 0
+    assert _lookup(cache, "Do you have this in size 10?", "Do you have this in size 11?") is None
+    assert _lookup(cache, "I do not like this jacket", "I do like this jacket") is None
+
+
+def test_similarity_tier_needs_an_embedding_model():
+    cache = ResponseCache(similarity=0.9)
+    assert _lookup(cache, "Do you have this in size 10?", "Do you have this in size 11?") is None
+    assert cache.similarity == 0
+
+
+def test_similar_questions_with_different_numbers_or_negations_miss():
+    cache = ResponseCache(similarity=0.9, encoder=SameMeaningEncoder())
+    assert _lookup(cache, "Do you have this in size 10?", "Do you have this in size 11?") is None
+    assert _lookup(cache, "I do not like this jacket", "I do like this jacket") is None
+    assert _lookup(cache, "I don't like this jacket", "I like this jacket") is None
+    assert cache.similar_hits == 0
+
+
+def test_similar_questions_with_the_same_numbers_hit():
+    cache = ResponseCache(similarity=0.9, encoder=SameMeaningEncoder())
+    answer = _lookup(cache, "Do you have this in size 10?", "Is this available in size 10")
+    assert answer == "answer to Do you have this in size 10?"
+    assert cache.similar_hits == 1
@@ -0,0 +1,63 @@
+import asyncio
+from sqlalchemy import func, select
+from database import AsyncSessionLocal, engine
+from migrations import prepare_database
+from models import ConversationSession, Message, User
+from services.write_behind import MessageWriter
+
+prepare_database(engine)
+
+
+async def _conversation() -> int:
+    async with AsyncSessionLocal() as db:
+        count = await db.scalar(select(func.count()).select_from(User))
+        user = User(username=f"writer{count}", email=f"writer{count}@example.com")
+        db.add(user)
+        await db.flush()
+        conversation = ConversationSession(user_id=user.id)
+        db.add(conversation)
+        await db.commit()
+        return conversation.id
+
+
+async def _stored(conversation_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(
+            select(func.count()).select_from(Message).where(Message.conversation_id == conversation_id)
+        )
+
+
+def test_stop_flushes_queued_writes_in_one_batch():
+    async def run():
+        conversation_id = await _conversation()
+        # Long enough that only stop() can end the batching delay
+        writer = MessageWriter(enabled=True, max_delay_ms=60_000)
+        writer.start()
+        writes = [asyncio.ensure_future(writer.write(conversation_id, "user", f"message {i}")) for i in range(5)]
+        await asyncio.sleep(0.05)
+        assert not any(write.done() for write in writes)
+
+        await asyncio.wait_for(writer.stop(), timeout=5)
+        messages = await asyncio.gather(*writes)
+        return writer, messages, await _stored(conversation_id)
+
+    writer, messages, stored = asyncio.run(run())
+    assert [message.content for message in messages] == [f"message {i}" for i in range(5)]
+    assert all(message.id is not None for message in messages)
+    assert stored == 5
+    assert (writer.batches, writer.writes) == (1, 5)
+
+
+def test_writes_after_stop_are_committed_directly():
+    async def run():
+        conversation_id = await _conversation()
+        writer = MessageWriter(enabled=True)
+        writer.start()
+        await writer.stop()
+        message = await writer.write(conversation_id, "ai", "late reply")
+        return writer, message, await _stored(conversation_id)
+
+    writer, message, stored = asyncio.run(run())
+    assert message.content == "late reply"
+    assert stored == 1
+    assert writer.batches == 0